@@ -21,12 +21,17 @@ from .models import FormField
 from .models import Image
 from .models import ImageFile
 from .models import Keyer
+from .models import KeyerReelProgress
 from .models import LongForm1990
 from .models import OtherImage
+from .models import ProvisionedReel
 from .models import Record
 from .models import Reel
+from .models import ReelJob
 from .models import Sheet
 
+import EntryApp.form_registry as form_registry
+
 logger = logging.getLogger(__name__)
 
 
@@ -50,7 +55,9 @@ admin.site.register(Record)
 admin.site.register(Sheet)
 
 admin.site.register( CurrentEntry )
-admin.site.register( FormField )
+admin.site.register( KeyerReelProgress )
+admin.site.register( ProvisionedReel )
+admin.site.register( ReelJob )
 
 admin.site.add_action(export_to_csv, 'export_to_csv')
 
@@ -92,7 +99,8 @@ class ImageFileAdmin( admin.ModelAdmin ):
                     'img_file_name',
                     'img_folder_path',
                     'img_reel',
-                    'img_position'
+                    'img_position',
+                    'quality_flags'
                 ]
             }
         ),
@@ -116,9 +124,9 @@ class ImageFileAdmin( admin.ModelAdmin ):
         Image_ImageFileInline
     ]
 
-    list_display = ( 'id', 'img_path', 'img_position' )
+    list_display = ( 'id', 'img_path', 'img_position', 'quality_flags' )
     list_display_links = ( 'id', 'img_path', )
-    list_filter = [ 'img_reel' ]
+    list_filter = [ 'img_reel', 'quality_flags' ]
     search_fields = [
         'img_path',
         'img_file_name',
@@ -172,6 +180,8 @@ class ImageAdmin( admin.ModelAdmin ):
         'image_type',
         'is_complete',
         'problem',
+        'has_breaker',
+        'has_sheet',
         'last_modified'
     )
     list_display_links = ( 'id', 'image_file' )
@@ -186,6 +196,20 @@ class ImageAdmin( admin.ModelAdmin ):
     # date_hierarchy = 'status_date'
     ordering = [ 'last_modified' ]
 
+    # related breaker / sheet flags come from the list query itself
+    def get_queryset( self, request ):
+        return super().get_queryset( request ).with_related_flags()
+
+    def has_breaker( self, obj ):
+        return obj.has_breaker
+    has_breaker.boolean = True
+    has_breaker.admin_order_field = 'has_breaker'
+
+    def has_sheet( self, obj ):
+        return obj.has_sheet
+    has_sheet.boolean = True
+    has_sheet.admin_order_field = 'has_sheet'
+
 #-- END ImageAdmin admin class --#
 
 # Keyer inline, with current reel displayed
@@ -220,4 +244,30 @@ class ReelAdmin( admin.ModelAdmin ):
     ]
 
 
+# FormField edits bump the version so every app process reloads its fields
+@admin.register(FormField)
+class FormFieldAdmin( admin.ModelAdmin ):
+
+    list_display = (
+        'id',
+        'year',
+        'form_type',
+        'field_name',
+    )
+
+    list_filter = [
+        'year',
+        'form_type',
+    ]
+
+    def save_model( self, request, obj, form, change ):
+        super().save_model( request, obj, form, change )
+        form_registry.bump_version()
+
+    def delete_model( self, request, obj ):
+        super().delete_model( request, obj )
+        form_registry.bump_version()
 
+    def delete_queryset( self, request, queryset ):
+        super().delete_queryset( request, queryset )
+        form_registry.bump_version()
@@ -30,6 +30,33 @@ FORM_CHOICES = [
     ('long', 'Long'),
 ]
 
+# background jobs for long-running reel operations (see EntryApp/jobs.py)
+REEL_JOB_ASSIGN_NEXT_REEL = "assign_next_reel"
+REEL_JOB_LOAD_REEL = "load_reel"
+REEL_JOB_SHRINK_REEL = "shrink_reel"
+REEL_JOB_RELEASE_REEL = "release_reel"
+REEL_JOB_TILE_REEL = "tile_reel"
+REEL_JOB_CHECK_REEL_QUALITY = "check_reel_quality"
+REEL_JOB_TYPE_CHOICES = [
+    ( REEL_JOB_ASSIGN_NEXT_REEL, "Assign next reel to keyer" ),
+    ( REEL_JOB_LOAD_REEL, "Load reel into DB" ),
+    ( REEL_JOB_SHRINK_REEL, "Shrink reel images" ),
+    ( REEL_JOB_RELEASE_REEL, "Remove reel from keyer" ),
+    ( REEL_JOB_TILE_REEL, "Build reel image tiles" ),
+    ( REEL_JOB_CHECK_REEL_QUALITY, "Check reel image quality" ),
+]
+
+REEL_JOB_QUEUED = "queued"
+REEL_JOB_RUNNING = "running"
+REEL_JOB_DONE = "done"
+REEL_JOB_FAILED = "failed"
+REEL_JOB_STATUS_CHOICES = [
+    ( REEL_JOB_QUEUED, "Queued" ),
+    ( REEL_JOB_RUNNING, "Running" ),
+    ( REEL_JOB_DONE, "Done" ),
+    ( REEL_JOB_FAILED, "Failed" ),
+]
+
 
 STATE_LIST = [
                 'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', \
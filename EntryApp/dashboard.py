@@ -0,0 +1,364 @@
+"""
+KEYER DASHBOARD STATE
+
+This module builds the state shown on the landing page (IndexView): how many
+images are left in the keyer's reel, which image is next, where the keyer is
+in the current batch, and the list of recently completed images.
+
+Everything is built from a fixed, small number of queries regardless of reel
+size: image counts come from the keyer's KeyerReelProgress row (see
+EntryApp.progress) rather than from counting Image rows. The keyer's CurrentEntry row (with its reel, image and breaker) is
+memoized on the request, so the view helpers in views.py can share it instead
+of each re-fetching it by jbid.
+
+Actions that finish an image look up the keyer's next one as they go and
+hand it to the landing page in a signed query parameter (see HAND-OFF FROM
+ACTIONS below), so the landing page doesn't look it up a second time.
+
+The pages also get the URLs of the next few images in the queue (see
+PREFETCH below) so the browser can fetch them ahead of the keyer.
+"""
+
+from django.core import signing
+from django.db.models import Q
+
+from EntryApp.models import CurrentEntry
+from EntryApp.models import Image
+from EntryApp.progress import get_progress
+from EntryApp.progress import rebuild_progress
+from EntryApp.progress import set_current_position
+
+#==============================================================================#
+# CONSTANTS-ish
+#==============================================================================#
+
+# image batch size
+BATCH_SIZE = 25
+
+# name of the attribute used to memoize CurrentEntry on the request
+REQUEST_CURRENT_ENTRY_ATTR = "_dcdl_current_entry"
+
+# query parameter, salt and lifetime (seconds) of the signed next image ID
+# that actions hand to the landing page
+NEXT_IMAGE_PARAM = "next"
+NEXT_IMAGE_SALT = "EntryApp.dashboard.next_image"
+NEXT_IMAGE_MAX_AGE = 300
+
+# where the web server serves reel images from (the templates build the
+# same URLs)
+IMAGE_URL_PREFIX = "/images/"
+
+
+#==============================================================================#
+# REQUEST-LEVEL MEMOIZATION
+#==============================================================================#
+
+def get_current_entry(request, refresh = False):
+    '''
+    Looks up the CurrentEntry row for the requesting keyer once per request.
+    The reel, image, image file and breaker (with its image, which its
+    __str__ reads) come along in the same query.
+
+    Takes:
+    - request
+    - optional boolean to force a fresh lookup (e.g. after seeding)
+    Returns:
+    - CurrentEntry instance, or None if the keyer doesn't have one yet
+    '''
+
+    current = getattr(request, REQUEST_CURRENT_ENTRY_ATTR, None)
+
+    if current is None or refresh:
+
+        current_qs = CurrentEntry.objects.select_related(
+            'reel',
+            'img__image_file',
+            'image_file',
+            'breaker__img__image_file',
+        )
+        current = current_qs.filter(jbid = request.user.username).first()
+        setattr(request, REQUEST_CURRENT_ENTRY_ATTR, current)
+
+    return current
+
+
+#==============================================================================#
+# QUERYSETS
+#==============================================================================#
+
+def get_user_reel_image_qs(jbid, reel):
+    '''
+    Returns queryset of a keyer's images in a reel
+    '''
+    return Image.objects.filter(jbid = jbid, image_file__img_reel = reel)
+
+
+def get_todo_image_qs(jbid, reel):
+    '''
+    Returns queryset of a keyer's incomplete images in a reel, in reel order
+    '''
+    todo_image_qs = get_user_reel_image_qs(jbid, reel).filter(is_complete = False)
+
+    # order according to ImageFile position instead of id in case loaded wrong
+    return todo_image_qs.order_by('image_file__img_position')
+
+
+def get_recent_image_qs(jbid, reel, limit):
+    '''
+    Most recently modified completed images (with a year or type), excluding
+    the 1990 dummy breaker. Reel and file come along for the thumbnails.
+    '''
+
+    recent_image_qs = get_user_reel_image_qs(jbid, reel)
+    recent_image_qs = recent_image_qs.filter( Q( year__isnull = False ) | Q( image_type__isnull = False ) )
+    recent_image_qs = recent_image_qs.filter(is_complete = True)
+    recent_image_qs = recent_image_qs.exclude( (Q(year__exact = 1990) & Q(image_type__contains = 'breaker')))
+    recent_image_qs = recent_image_qs.select_related('image_file__img_reel')
+    recent_image_qs = recent_image_qs.order_by('-last_modified')
+
+    return recent_image_qs[ : limit ]
+
+
+#==============================================================================#
+# BATCH MATH
+#==============================================================================#
+
+def compute_batch_numbers(position_in_reel, num_images_in_reel, batch_size = BATCH_SIZE):
+    '''
+    Where are we in this batch of images? Pure arithmetic, no queries.
+
+    Takes:
+    - integer position of the current image in its reel
+    - integer number of images in the reel
+    - optional standard batch size
+    Returns:
+    - tuple: (current batch position, num images left in batch, batch size)
+    '''
+
+    # case 1: # images in reel is evenly divisible by batch size, easy
+    # case 2: not evenly divisible, the final batch is smaller
+    if num_images_in_reel % batch_size != 0:
+
+        num_standard_batches = num_images_in_reel // batch_size
+
+        if position_in_reel >= batch_size * num_standard_batches:
+            batch_size = num_images_in_reel % batch_size + 1 # otherwise off by one error
+
+    # modular arithmetic to compute where we are in a batch
+    current_batch_position = position_in_reel % batch_size
+    num_images_left = batch_size - current_batch_position
+
+    return current_batch_position, num_images_left, batch_size
+
+
+#==============================================================================#
+# DASHBOARD STATE
+#==============================================================================#
+
+def point_current_entry_to_image(current, next_image):
+    '''
+    Moves the CurrentEntry image pointer to next_image, only writing if it
+    changed. Keeps the memoized instance in sync.
+    '''
+
+    if next_image is None or current.img_id == next_image.id:
+        return
+
+    CurrentEntry.objects.filter(pk = current.pk).update(
+        img = next_image,
+        image_file_id = next_image.image_file_id
+    )
+    current.img = next_image
+    current.image_file = next_image.image_file
+
+
+def load_dashboard_state(request, recent_image_limit, next_image_id = None):
+    '''
+    Builds the keyer's landing page state and points CurrentEntry (and the
+    progress row) at the next image to code. Assumes seed_current_entry()
+    has already run.
+
+    Takes:
+    - request
+    - integer number of recent images to list
+    - optional ID of the next image, handed over by the action that finished
+        the last one (see read_next_image()). If CurrentEntry already points
+        at it and it's still to do, it isn't looked up again.
+    Returns:
+    - dict with the current entry and reel, todo and completed counts, next
+      image, recent image list and batch numbers (None if nothing to do)
+    '''
+
+    state_OUT = {}
+
+    current = get_current_entry(request)
+    current_reel = current.reel
+    jbid = request.user.username
+
+    progress = get_progress(jbid, current_reel)
+
+    next_image = None
+    handed_image = current.img
+    if (
+        next_image_id is not None
+        and current.img_id == next_image_id
+        and handed_image.is_complete is False
+        and handed_image.image_file.img_reel_id == current_reel.id
+    ):
+        next_image = handed_image
+        next_image.image_file.img_reel = current_reel
+
+    else:
+        next_image_qs = get_todo_image_qs(jbid, current_reel)
+        next_image = next_image_qs.select_related('image_file__img_reel').first()
+
+    next_position = get_image_position(next_image)
+
+    # counters say the reel is done but it isn't, or vice versa, or they point
+    # at another image than the next one to do (Images completed or deleted
+    # behind their back): rebuild them from Image rows rather than show the
+    # wrong counts and buttons. Drift that leaves the next image where it was
+    # is left to the rebuild_reel_progress command.
+    if (next_image is None) != (progress.remaining <= 0) or progress.current_position != next_position:
+        progress = rebuild_progress(jbid, current_reel)
+
+    point_current_entry_to_image(current, next_image)
+    set_current_position(progress, next_position)
+
+    batch_numbers = None
+    if next_image:
+        batch_numbers = compute_batch_numbers(
+            next_image.image_file.img_position,
+            current_reel.image_count
+        )
+
+    state_OUT['current_entry'] = current
+    state_OUT['current_reel'] = current_reel
+    state_OUT['todo_image_count'] = progress.remaining
+    state_OUT['completed_count'] = progress.completed
+    state_OUT['next_image'] = next_image
+    state_OUT['recent_image_list'] = list(get_recent_image_qs(jbid, current_reel, recent_image_limit))
+    state_OUT['batch_numbers'] = batch_numbers
+
+    return state_OUT
+
+
+#==============================================================================#
+# HAND-OFF FROM ACTIONS
+#==============================================================================#
+
+# Actions that finish an image (CodeImage's complete_image, update_other_image,
+# update_breaker_type) look up the keyer's next image themselves and redirect
+# to the landing page with its ID signed in NEXT_IMAGE_PARAM, so the landing
+# page can take it from CurrentEntry instead of looking it up again.
+
+def get_next_todo_image(jbid, image):
+    '''
+    Returns the keyer's next image to code once image is done: the first
+    incomplete image in image's reel other than image itself (None if the
+    reel is finished). Reel and file come along for the landing page.
+    '''
+
+    next_image_qs = get_todo_image_qs(jbid, image.image_file.img_reel_id).exclude(pk = image.pk)
+
+    return next_image_qs.select_related('image_file__img_reel').first()
+
+
+def get_image_position(image):
+    '''
+    Returns image's position in its reel, or None if there's no image
+    '''
+    return image.image_file.img_position if image is not None else None
+
+
+def advance_current_entry(jbid, next_image, **fields):
+    '''
+    Points the keyer's CurrentEntry at next_image (if there is one) and sets
+    any other fields given (e.g. batch_position, breaker), in one UPDATE.
+    '''
+
+    if next_image is not None:
+        fields['img'] = next_image
+        fields['image_file_id'] = next_image.image_file_id
+
+    if fields:
+        CurrentEntry.objects.filter(jbid = jbid).update(**fields)
+
+
+def sign_next_image(jbid, next_image):
+    '''
+    Returns the value for NEXT_IMAGE_PARAM handing next_image to jbid's
+    landing page
+    '''
+    return signing.dumps([jbid, next_image.id], salt = NEXT_IMAGE_SALT, compress = True)
+
+
+def read_next_image(token, jbid):
+    '''
+    Returns the image ID signed in a NEXT_IMAGE_PARAM value, or None if
+    there isn't one or it's for someone else, expired or tampered with
+    '''
+
+    if not token:
+        return None
+
+    try:
+        signed_jbid, image_id = signing.loads(token, salt = NEXT_IMAGE_SALT, max_age = NEXT_IMAGE_MAX_AGE)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+
+    return image_id if signed_jbid == jbid else None
+
+
+#==============================================================================#
+# PREFETCH
+#==============================================================================#
+
+# The code-image and landing pages ask for the URLs of the next few images in
+# the keyer's queue and have the browser fetch them while the keyer works on
+# the current one, so the next image viewer opens from the browser cache.
+
+def get_image_url(year, reel_name, file_name):
+    '''
+    Returns the URL of an image's smaller JPEG, the one the viewer shows
+    '''
+    return f'{IMAGE_URL_PREFIX}{year}/{reel_name}/{file_name}'
+
+
+def get_upcoming_images(jbid, reel, count, exclude_image_id = None):
+    '''
+    Looks up the next images in a keyer's queue, in reel order, in one query
+    that only reads the columns the URLs need.
+
+    Takes:
+    - string jbid
+    - reel (or reel ID)
+    - integer number of images wanted
+    - optional ID of an image to leave out (the one on screen)
+    Returns:
+    - list of dicts with image_id, position, url and tile_url (the image's
+      Deep Zoom descriptor, None if it hasn't been tiled)
+    '''
+
+    todo_image_qs = get_todo_image_qs(jbid, reel)
+    if exclude_image_id is not None:
+        todo_image_qs = todo_image_qs.exclude(pk = exclude_image_id)
+
+    image_rows = todo_image_qs.values_list(
+        'id',
+        'year',
+        'image_file__img_position',
+        'image_file__img_reel__reel_name',
+        'image_file__smaller_image_file_name',
+        'image_file__tile_source_name',
+    )[ : count ]
+
+    return [
+        {
+            'image_id': image_id,
+            'position': position,
+            'url': get_image_url(year, reel_name, file_name),
+            'tile_url': get_image_url(year, reel_name, tile_name) if tile_name else None,
+        }
+        for image_id, year, position, reel_name, file_name, tile_name in image_rows
+    ]
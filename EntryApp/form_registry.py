@@ -0,0 +1,159 @@
+"""
+FORMFIELD REGISTRY
+
+This module keeps an in-memory copy of the FormField table, keyed by
+(year, form_type), so the views can look up which fields a form shows
+without querying the DB on every render and submit.
+
+The table is loaded whole, once per process, the first time it's needed.
+It only changes when load_db.load_form_fields() runs, which bumps the
+version stamp in FormFieldVersion; each process compares its copy's
+version to the DB at most every settings.FORM_FIELD_VERSION_CHECK_SECONDS
+and reloads when it has moved. Saves and deletes of FormField rows in this
+process (admin, fixtures) drop the local copy straight away.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+
+from EntryApp.models import FormField
+from EntryApp.models import FormFieldVersion
+
+#==============================================================================#
+# LOGGER
+#==============================================================================#
+
+logger = logging.getLogger(__name__)
+
+#==============================================================================#
+# CONSTANTS-ish
+#==============================================================================#
+
+# how often (seconds) to check the DB version stamp; override in settings
+DEFAULT_VERSION_CHECK_SECONDS = 30
+
+# primary key of the single FormFieldVersion row
+VERSION_ROW_ID = 1
+
+# the process's copy: {(year, form_type): tuple of field names}, the version
+# it was loaded at, and when that version was last confirmed
+_registry = {
+    'fields': None,
+    'version': None,
+    'checked_at': 0.0,
+}
+_registry_lock = threading.Lock()
+
+
+#==============================================================================#
+# VERSION STAMP
+#==============================================================================#
+
+def get_db_version():
+    '''
+    Returns the FormField version stamp stored in the DB (0 if never bumped)
+    '''
+
+    version = FormFieldVersion.objects.filter(
+        pk = VERSION_ROW_ID
+    ).values_list('version', flat = True).first()
+
+    return version or 0
+
+
+def bump_version():
+    '''
+    Moves the DB version stamp on, so every process reloads its registry.
+    Call after changing FormField rows.
+
+    Returns:
+    - the new version
+    '''
+
+    num_updated = FormFieldVersion.objects.filter(pk = VERSION_ROW_ID).update(version = F('version') + 1)
+    if not num_updated:
+        FormFieldVersion.objects.get_or_create(pk = VERSION_ROW_ID, defaults = {'version': 1})
+
+    invalidate()
+    return get_db_version()
+
+
+def invalidate(**kwargs):
+    '''
+    Drops this process's copy; the next lookup reloads it. Also used as the
+    FormField post_save / post_delete receiver.
+    '''
+    _registry['fields'] = None
+
+
+post_save.connect(invalidate, sender = FormField, dispatch_uid = 'form_registry_save')
+post_delete.connect(invalidate, sender = FormField, dispatch_uid = 'form_registry_delete')
+
+
+#==============================================================================#
+# LOOKUP
+#==============================================================================#
+
+def load_registry():
+    '''
+    Reads the whole FormField table into a dict
+
+    Returns:
+    - dict of (float year, form_type) -> tuple of field names, in id order
+    '''
+
+    fields_OUT = {}
+
+    field_rows = FormField.objects.order_by('id').values_list('year', 'form_type', 'field_name')
+    for year, form_type, field_name in field_rows:
+        fields_OUT.setdefault((float(year), form_type), []).append(field_name)
+
+    return {key: tuple(names) for key, names in fields_OUT.items()}
+
+
+def get_registry():
+    '''
+    Returns the process's copy of the FormField table, loading it if it's
+    missing or its version has moved on
+    '''
+
+    me = 'get_registry()'
+    check_seconds = getattr(settings, 'FORM_FIELD_VERSION_CHECK_SECONDS', DEFAULT_VERSION_CHECK_SECONDS)
+    now = time.monotonic()
+
+    fields = _registry['fields']
+    if fields is not None and now - _registry['checked_at'] < check_seconds:
+        return fields
+
+    with _registry_lock:
+
+        db_version = get_db_version()
+
+        if _registry['fields'] is None or _registry['version'] != db_version:
+            _registry['fields'] = load_registry()
+            _registry['version'] = db_version
+            logger.info(f'{me}: loaded FormField registry version {db_version}')
+
+        _registry['checked_at'] = now
+
+        return _registry['fields']
+
+
+def get_form_fields(year, form_type):
+    '''
+    Looks up the fields a form shows
+
+    Takes:
+    - year (int or float)
+    - string form_type
+    Returns:
+    - list of field names (empty if the form has none)
+    '''
+
+    return list(get_registry().get((float(year), form_type), ()))
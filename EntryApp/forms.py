@@ -5,14 +5,19 @@ This module defines the form objects we use to enter data.
 However, the fields present in most forms are specified in the FormField data
 model in the database, which is queried by the view at runtime. 
 The layout of most forms is specified in layouts.py using Django crispy forms
-objects.
+objects. Form classes built from FormField are cached per process (see
+get_form_class() and get_formset_class()), and so is the HTML of blank
+forms (see get_blank_form_html()).
 """
 
 from django import forms
+from django.utils.safestring import mark_safe
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit
+from crispy_forms.utils import render_crispy_form
 
 import EntryApp.choices as choices
+import EntryApp.form_registry as form_registry
 import EntryApp.layouts as layouts
 
 from EntryApp.models import Breaker
@@ -300,4 +305,132 @@ class CrispyLongFormHelper(CrispyFormSetHelper):
 
     def __init__(self, year, *args, **kwargs):
         super().__init__(year, *args, **kwargs)
-        self.layout = layouts.LONG_FORM_1990
\ No newline at end of file
+        self.layout = layouts.LONG_FORM_1990
+
+
+#================================#
+# FORM CLASS CACHE
+#================================#
+
+# The fields in most forms come from FormField, so their classes are built at
+# runtime with modelform_factory / modelformset_factory. Building one walks
+# every model field and sets up its widget (the 1980/1990 record forms have
+# dozens of radio fields), so each class is built once per process and reused.
+# Keys include the field list, so a FormField reload gets fresh classes.
+
+_form_class_cache = {}
+
+
+def get_form_class(model, year, form_type, fields = None):
+    '''
+    Returns a cached ModelForm class for a model's fields in a year/form type,
+    with the widgets from choices.FORM_WIDGETS
+
+    Takes:
+    - model class
+    - year
+    - string form_type
+    - optional list of field names (default: looked up in the FormField registry)
+    Returns:
+    - ModelForm class
+    '''
+
+    if fields is None:
+        fields = form_registry.get_form_fields(year, form_type)
+
+    key = ('form', model, float(year), form_type, tuple(fields))
+    form_class_OUT = _form_class_cache.get(key)
+
+    if form_class_OUT is None:
+        widgets = {f: choices.FORM_WIDGETS[f] for f in fields if f in choices.FORM_WIDGETS}
+        form_class_OUT = forms.modelform_factory(model, fields = fields, widgets = widgets)
+        _form_class_cache[key] = form_class_OUT
+
+    return form_class_OUT
+
+
+def get_formset_class(model, year, form_type, formset = forms.BaseModelFormSet, extra = 1, fields = None):
+    '''
+    Returns a cached ModelFormSet class for a model's fields in a year/form
+    type. Like the formsets built inline before, no widgets are set.
+
+    Takes:
+    - model class
+    - year
+    - string form_type
+    - optional formset base class and number of extra forms
+    - optional list of field names (default: looked up in the FormField registry)
+    Returns:
+    - ModelFormSet class
+    '''
+
+    if fields is None:
+        fields = form_registry.get_form_fields(year, form_type)
+
+    key = ('formset', model, float(year), form_type, tuple(fields), formset, extra)
+    formset_class_OUT = _form_class_cache.get(key)
+
+    if formset_class_OUT is None:
+        formset_class_OUT = forms.modelformset_factory(
+            model,
+            fields = fields,
+            formset = formset,
+            extra = extra
+        )
+        _form_class_cache[key] = formset_class_OUT
+
+    return formset_class_OUT
+
+
+def clear_form_class_cache():
+    '''
+    Drops every cached form class (benchmarks, tests)
+    '''
+    _form_class_cache.clear()
+
+
+#================================#
+# RENDERED FORM CACHE
+#================================#
+
+# Rendering a crispy layout goes through the template engine once per field,
+# which is slow for the big record layouts (the 1980/1990 InlineRadios serial
+# number bubbles especially). A blank form renders the same every time for a
+# given form class and layout, so its HTML is rendered once per process.
+# Bound forms and forms for existing instances are still rendered per request.
+
+_blank_form_html_cache = {}
+
+
+def get_blank_form_html(form_class, helper_class, year):
+    '''
+    Returns the crispy HTML for an empty, unbound form, rendering it the
+    first time only. Only for helpers with form_tag off: with it on, the
+    markup would include the request's CSRF token.
+
+    Takes:
+    - ModelForm class (from get_form_class(), so cached per process)
+    - FormHelper subclass taking a year
+    - year
+    Returns:
+    - safe HTML string
+    '''
+
+    key = (form_class, helper_class, str(year))
+    html_OUT = _blank_form_html_cache.get(key)
+
+    if html_OUT is None:
+        helper = helper_class(year = year)
+        if helper.form_tag:
+            raise ValueError(f'{helper_class.__name__} renders a form tag, its HTML is per request')
+        html_OUT = mark_safe(render_crispy_form(form_class(), helper))
+        _blank_form_html_cache[key] = html_OUT
+
+    return html_OUT
+
+
+def clear_blank_form_html_cache():
+    '''
+    Drops every cached blank form render (benchmarks, tests)
+    '''
+    _blank_form_html_cache.clear()
@@ -0,0 +1,531 @@
+"""
+STREAMING IMAGE PREPARATION PIPELINE
+
+This module is intended for import and use in prepare_images.py (its
+--pipeline mode), like shrink_images.py and tile_images.py. It prepares
+many reel directories in one pass:
+
+- each reel directory (and its destination, if copying) is read once with
+  os.scandir, and what's known about every full-size image is kept in a
+  SQLite manifest: source size and mtime, and whether it has been shrunk,
+  copied, tiled and removed
+- the stages run as overlapping streams rather than reel by reel: as soon as
+  a chunk of images is shrunk (process pool) its small copies go to the
+  destination (thread pool), then get tiled (process pool) and their
+  full-size originals removed, while later chunks and reels are still
+  shrinking
+- an interrupted run picks up from the manifest: finished stages aren't
+  redone and nothing is recounted. A source file whose size or mtime has
+  changed since it was recorded starts over.
+
+A full-size image is only removed once its small copy exists (and, when
+copying, has arrived at the destination at the same size). Small copies are
+written with the chosen encoder (see shrink_images.SHRINK_ENCODERS); one
+already there from another encoder counts as done.
+"""
+
+import os
+import shutil
+import sqlite3
+import time
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from EntryApp.shrink_images import DEFAULT_SHRINK_ENCODER
+from EntryApp.shrink_images import SHRINK_CHUNK_SIZE
+from EntryApp.shrink_images import SHRINK_ENCODERS
+from EntryApp.shrink_images import SMALLER_SUFFIX
+from EntryApp.shrink_images import is_small_image_name
+from EntryApp.shrink_images import make_new_filepath
+from EntryApp.shrink_images import shrink_chunk
+from EntryApp.tile_images import make_tile_paths
+from EntryApp.tile_images import tile_image
+
+# default manifest file name, in the directory being prepared
+MANIFEST_NAME = "prepare_images_manifest.sqlite3"
+
+# manifest writes between commits
+COMMIT_EVERY = 200
+
+# how often (in finished stage steps) to report progress
+PROGRESS_EVERY = 1000
+
+# threads copying small images to the destination (I/O bound)
+COPY_WORKERS = 4
+
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_file (
+    reel_path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    shrunk INTEGER NOT NULL DEFAULT 0,
+    copied INTEGER NOT NULL DEFAULT 0,
+    tiled INTEGER NOT NULL DEFAULT 0,
+    removed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (reel_path, name)
+)
+"""
+
+#==============================================================================#
+# MANIFEST
+#==============================================================================#
+
+def open_manifest(manifest_path):
+    '''
+    Opens (creating if needed) the SQLite manifest
+
+    Takes:
+    - string filepath to the manifest
+    Returns:
+    - sqlite3 connection
+    '''
+
+    connection = sqlite3.connect(manifest_path)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute(MANIFEST_SCHEMA)
+    connection.commit()
+
+    return connection
+
+
+def save_file_state(connection, record):
+    '''
+    Writes one image's record to the manifest (not committed)
+    '''
+
+    connection.execute(
+        """
+        INSERT OR REPLACE INTO image_file (reel_path, name, size, mtime, shrunk, copied, tiled, removed, error)
+        VALUES (:reel_path, :name, :size, :mtime, :shrunk, :copied, :tiled, :removed, :error)
+        """,
+        record
+    )
+
+
+def get_reel_state(connection, reel_path):
+    '''
+    Returns what the manifest knows about a reel: dict of image name -> record
+    '''
+
+    row_list = connection.execute("SELECT * FROM image_file WHERE reel_path = ?", (reel_path,))
+
+    return {row["name"]: dict(row) for row in row_list}
+
+
+#==============================================================================#
+# SCAN
+#==============================================================================#
+
+def is_full_size_name(name):
+    '''
+    Full-size reel images are gr*.jpg; their shrunk copies end _smaller.jpg
+    (or _smaller.webp)
+    '''
+    return name.startswith("gr") and name.endswith(".jpg") and not is_small_image_name(name)
+
+
+def scan_dir(dir_path):
+    '''
+    Reads a directory once
+
+    Returns:
+    - dict of image file name -> os.stat_result (empty if no directory)
+    '''
+
+    stat_by_name = {}
+
+    if not os.path.isdir(dir_path):
+        return stat_by_name
+
+    with os.scandir(dir_path) as entry_list:
+        for entry in entry_list:
+            if (entry.name.endswith(".jpg") or is_small_image_name(entry.name)) and entry.is_file():
+                stat_by_name[entry.name] = entry.stat()
+
+    return stat_by_name
+
+
+def scan_reel(connection, reel_path, dest_reel_path = None, encoder = DEFAULT_SHRINK_ENCODER):
+    '''
+    Reconciles the manifest with one scan of a reel directory (and of its
+    destination): new images are added, changed ones start over, and work
+    done outside the pipeline (shrunk, copied or removed by hand or by the
+    old prepare_images steps) is recorded as done.
+
+    Takes:
+    - sqlite3 connection
+    - string reel directory filepath
+    - optional string destination directory for this reel's small images
+    - optional encoder name for new small images
+    Returns:
+    - list of records (dicts) for the reel's images, each with the
+        small_name it is (or will be) served as
+    '''
+
+    known = get_reel_state(connection, reel_path)
+    source_stats = scan_dir(reel_path)
+    dest_stats = scan_dir(dest_reel_path) if dest_reel_path else {}
+
+    full_size_names = {name for name in source_stats if is_full_size_name(name)}
+
+    # images already shrunk and removed before the manifest knew about them
+    for name in source_stats:
+        if is_small_image_name(name):
+            full_name = name[ : name.rindex(SMALLER_SUFFIX)] + ".jpg"
+            if full_name not in full_size_names and full_name not in known:
+                known[full_name] = new_record(reel_path, full_name, None, shrunk = 1, removed = 1)
+
+    for name in full_size_names:
+
+        stat = source_stats[name]
+        record = known.get(name)
+
+        if record is None:
+            known[name] = new_record(reel_path, name, stat)
+
+        elif (record["size"], record["mtime"]) != (stat.st_size, stat.st_mtime):
+
+            # rescanned or replaced: what was made from the old file is stale
+            known[name] = new_record(reel_path, name, stat)
+            for small_name in get_small_names(name, encoder):
+                stale_path_list = [
+                    os.path.join(reel_path, small_name),
+                    make_tile_paths(os.path.join(dest_reel_path or reel_path, small_name))[0],
+                ]
+                for stale_path in stale_path_list:
+                    if os.path.isfile(stale_path):
+                        os.remove(stale_path)
+                source_stats.pop(small_name, None)
+                dest_stats.pop(small_name, None)
+
+    record_list = []
+
+    for name, record in sorted(known.items()):
+
+        # this encoder's name, unless only another encoder's copy exists
+        small_name_list = get_small_names(name, encoder)
+        small_name = next(
+            (n for n in small_name_list if n in source_stats or n in dest_stats),
+            small_name_list[0]
+        )
+        record["small_name"] = small_name
+
+        if not record["shrunk"] and small_name in source_stats and name in full_size_names:
+            record["shrunk"] = 1
+
+        if not record["removed"] and name not in full_size_names and small_name in source_stats:
+            record["removed"] = 1
+
+        if dest_reel_path and not record["copied"] and small_name in dest_stats:
+            source_small = source_stats.get(small_name)
+            if source_small is None or source_small.st_size == dest_stats[small_name].st_size:
+                record["copied"] = 1
+
+        save_file_state(connection, record)
+        record_list.append(record)
+
+    connection.commit()
+
+    return record_list
+
+
+def new_record(reel_path, name, stat, shrunk = 0, removed = 0):
+    return {
+        "reel_path": reel_path,
+        "name": name,
+        "size": stat.st_size if stat else None,
+        "mtime": stat.st_mtime if stat else None,
+        "shrunk": shrunk,
+        "copied": 0,
+        "tiled": 0,
+        "removed": removed,
+        "error": None,
+    }
+
+
+def get_small_names(name, encoder = DEFAULT_SHRINK_ENCODER):
+    '''
+    Returns the names an image's small copy can have, the encoder's first
+    '''
+    name_list = [make_new_filepath(name, encoder = encoder)[1]]
+    name_list += [make_new_filepath(name, encoder = other)[1] for other in SHRINK_ENCODERS]
+    return list(dict.fromkeys(name_list))
+
+
+#==============================================================================#
+# STAGES
+#==============================================================================#
+
+def copy_small_image(source_path, dest_path):
+    '''
+    Thread pool task: copies one small image into place atomically, so an
+    interrupted copy never looks finished
+
+    Returns:
+    - size of the copy in bytes
+    '''
+
+    partial_path = dest_path + ".partial"
+    shutil.copyfile(source_path, partial_path)
+    os.replace(partial_path, dest_path)
+
+    return os.path.getsize(dest_path)
+
+
+class ImagePipeline:
+    '''
+    Runs the shrink -> copy -> tile -> remove stages for a list of reel
+    directories, feeding the pools a bounded number of tasks at a time and
+    moving each image on to its next stage as soon as the last one finishes.
+    '''
+
+    def __init__(
+        self,
+        connection,
+        dest = None,
+        tiles = False,
+        remove = True,
+        max_workers = None,
+        copy_workers = COPY_WORKERS,
+        chunk_size = SHRINK_CHUNK_SIZE,
+        progress = print,
+        fast = False,
+        resample = None,
+        encoder = DEFAULT_SHRINK_ENCODER
+    ):
+        self.connection = connection
+        self.dest = dest
+        self.tiles = tiles
+        self.remove = remove
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.copy_workers = copy_workers
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.fast = fast
+        self.resample = resample
+        self.encoder = encoder
+
+        self.futures = {}
+        self.num_unsaved = 0
+        self.num_steps = 0
+        self.result = {"num_images": 0, "shrunk": 0, "copied": 0, "tiled": 0, "removed": 0, "errors": []}
+
+    #--------------------------------#
+    # paths
+    #--------------------------------#
+
+    def get_dest_reel_path(self, reel_path):
+        return os.path.join(self.dest, os.path.basename(reel_path.rstrip("/"))) if self.dest else None
+
+    def get_paths(self, record):
+        '''
+        Returns (full-size path, small path, served small path)
+        '''
+        small_name = record["small_name"]
+        small_path = os.path.join(record["reel_path"], small_name)
+        served_path = small_path
+        if self.dest:
+            served_path = os.path.join(self.get_dest_reel_path(record["reel_path"]), small_name)
+        return os.path.join(record["reel_path"], record["name"]), small_path, served_path
+
+    #--------------------------------#
+    # bookkeeping
+    #--------------------------------#
+
+    def save(self, record, **fields):
+        record.update(fields)
+        save_file_state(self.connection, record)
+        self.num_unsaved += 1
+        if self.num_unsaved >= COMMIT_EVERY:
+            self.connection.commit()
+            self.num_unsaved = 0
+
+    def fail(self, record, error):
+        self.result["errors"].append(f"{os.path.join(record['reel_path'], record['name'])}: {error}")
+        self.save(record, error = error)
+
+    def step_done(self, stage):
+        self.result[stage] += 1
+        self.num_steps += 1
+        if self.progress and self.num_steps % PROGRESS_EVERY == 0:
+            self.report()
+
+    def report(self):
+        seconds = time.perf_counter() - self.start
+        rate = self.result["shrunk"] / seconds if seconds else 0.0
+        self.progress(
+            f"\t{self.result['shrunk']} shrunk ({rate:.1f}/s), {self.result['copied']} copied, "
+            f"{self.result['tiled']} tiled, {self.result['removed']} removed, {len(self.result['errors'])} errors"
+        )
+
+    #--------------------------------#
+    # scheduling
+    #--------------------------------#
+
+    def submit(self, executor, stage, payload, fn, *args):
+        self.futures[executor.submit(fn, *args)] = (stage, payload)
+
+    def advance(self, record):
+        '''
+        Starts the next stage an image needs, or removes its original once
+        everything else is done
+        '''
+
+        full_path, small_path, served_path = self.get_paths(record)
+
+        if not record["shrunk"]:
+            return False
+
+        if self.dest and not record["copied"]:
+            os.makedirs(os.path.dirname(served_path), exist_ok = True)
+            self.submit(self.copy_pool, "copied", record, copy_small_image, small_path, served_path)
+            return True
+
+        if self.tiles and not record["tiled"]:
+            self.submit(self.process_pool, "tiled", record, tile_image, served_path)
+            return True
+
+        if self.remove and not record["removed"]:
+            if not os.path.isfile(small_path) and not os.path.isfile(served_path):
+                self.fail(record, "small copy missing, full-size image kept")
+                return True
+            try:
+                os.remove(full_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.fail(record, f"remove failed: {e}")
+                return True
+            self.save(record, removed = 1)
+            self.step_done("removed")
+
+        return True
+
+    def iter_shrink_chunks(self, reel_path_list):
+        '''
+        Scans reels one at a time as the pools need more work, sending images
+        that are past shrinking straight on and yielding chunks to shrink
+        '''
+
+        chunk = []
+
+        for reel_path in reel_path_list:
+
+            record_list = scan_reel(self.connection, reel_path, self.get_dest_reel_path(reel_path), self.encoder)
+            self.result["num_images"] += len(record_list)
+
+            num_to_shrink = sum(1 for r in record_list if not r["shrunk"])
+            if self.progress:
+                self.progress(f"{reel_path}: {len(record_list)} images, {num_to_shrink} to shrink")
+
+            for record in record_list:
+                if record["shrunk"]:
+                    self.advance(record)
+                    continue
+                chunk.append(record)
+                if len(chunk) >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+
+        if chunk:
+            yield chunk
+
+    def finish(self, future):
+        stage, payload = self.futures.pop(future)
+
+        if stage == "shrunk":
+            try:
+                chunk_result_list = future.result()
+            except Exception as e:
+                chunk_result_list = [(None, False, f"{type(e).__name__}: {e}")] * len(payload)
+            for record, (path, was_shrunk, error) in zip(payload, chunk_result_list):
+                if error:
+                    self.fail(record, error)
+                    continue
+                self.save(record, shrunk = 1, error = None)
+                self.step_done("shrunk")
+                self.advance(record)
+            return
+
+        record = payload
+        try:
+            future.result()
+        except Exception as e:
+            self.fail(record, f"{stage}: {type(e).__name__}: {e}")
+            return
+
+        self.save(record, **{stage: 1})
+        self.step_done(stage)
+        self.advance(record)
+
+    def run(self, reel_path_list):
+        '''
+        Prepares every reel in the list
+
+        Returns:
+        - dict of counts per stage, num_images, errors and seconds
+        '''
+
+        self.start = time.perf_counter()
+        max_shrink_in_flight = 2 * self.max_workers
+
+        with ProcessPoolExecutor(max_workers = self.max_workers) as self.process_pool, \
+                ThreadPoolExecutor(max_workers = self.copy_workers) as self.copy_pool:
+
+            chunk_iter = self.iter_shrink_chunks(reel_path_list)
+            chunks_left = True
+
+            try:
+                while True:
+
+                    # keep the process pool fed without queueing every reel at once
+                    num_shrinking = sum(1 for stage, payload in self.futures.values() if stage == "shrunk")
+                    while chunks_left and num_shrinking < max_shrink_in_flight:
+                        chunk = next(chunk_iter, None)
+                        if chunk is None:
+                            chunks_left = False
+                            break
+                        path_pair_list = [self.get_paths(record)[ : 2] for record in chunk]
+                        self.submit(self.process_pool, "shrunk", chunk, shrink_chunk, path_pair_list, self.fast, self.resample, self.encoder)
+                        num_shrinking += 1
+
+                    if not self.futures:
+                        break
+
+                    done_set, pending_set = wait(list(self.futures), return_when = FIRST_COMPLETED)
+                    for future in done_set:
+                        self.finish(future)
+
+            finally:
+                self.connection.commit()
+
+        self.result["seconds"] = time.perf_counter() - self.start
+        if self.progress:
+            self.report()
+
+        return self.result
+
+
+def run_pipeline(reel_path_list, manifest_path, **options):
+    '''
+    Convenience wrapper: opens the manifest and runs ImagePipeline
+
+    Takes:
+    - list of reel directory filepaths
+    - string filepath to the manifest
+    - ImagePipeline options (dest, tiles, remove, max_workers, fast, resample, encoder, ...)
+    Returns:
+    - dict of counts per stage, num_images, errors and seconds
+    '''
+
+    connection = open_manifest(manifest_path)
+    try:
+        return ImagePipeline(connection, **options).run(reel_path_list)
+    finally:
+        connection.close()
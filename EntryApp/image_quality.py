@@ -0,0 +1,199 @@
+"""
+CHECK SCANS FOR TRUNCATED, CORRUPT, BLANK OR BLACK IMAGES
+
+This module is intended for import and use in reel_diagnostics.py (its
+--quality mode), the check_reel_quality job or the Django shell, like
+shrink_images.py. File sizes alone (see reel_diagnostics.py) miss a frame
+that was scanned blank or cut off part way, and shrink_images.py sets
+LOAD_TRUNCATED_IMAGES so damaged scans still shrink without complaint.
+
+Each image is decoded as a small thumbnail (the JPEG decoder scales by up to
+1/8 while decoding, so this costs a fraction of a full decode) with
+truncation errors turned back on, and its grey levels checked with NumPy:
+
+- truncated: the file ends before the image data does
+- corrupt: the file can't be read as an image at all
+- black: almost every pixel is near black (e.g. an unexposed frame)
+- blank: almost no variation (e.g. leader, an empty frame)
+- aspect_ratio: width / height far outside a page's, e.g. a frame split in
+  the wrong place
+
+Checks fan out over a pool of processes, a chunk of files per task.
+ImageFile.quality_flags records the result once a reel is loaded (see
+load_db.record_reel_quality()).
+"""
+
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
+import numpy as np
+from PIL import Image, ImageFile
+
+QUALITY_TRUNCATED = "truncated"
+QUALITY_CORRUPT = "corrupt"
+QUALITY_BLACK = "black"
+QUALITY_BLANK = "blank"
+QUALITY_ASPECT_RATIO = "aspect_ratio"
+QUALITY_FLAGS = [QUALITY_TRUNCATED, QUALITY_CORRUPT, QUALITY_BLACK, QUALITY_BLANK, QUALITY_ASPECT_RATIO]
+
+# thumbnail the checks run on: the decoder picks the smallest scale that is
+# at least this big
+THUMBNAIL_SIZE = (256, 256)
+
+# black: 99% of pixels at or below this grey level (0-255)
+BLACK_LEVEL = 40
+
+# blank: standard deviation of grey levels below this
+BLANK_STD = 4.0
+
+# width / height outside this range
+MIN_ASPECT_RATIO = 0.4
+MAX_ASPECT_RATIO = 2.5
+
+# files handed to a worker process per task
+QUALITY_CHUNK_SIZE = 50
+
+
+def check_image(image_file_path):
+    '''
+    Decodes an image as a thumbnail and checks it
+
+    Takes:
+    - string filepath to image file
+    Returns:
+    - dict: path, width and height (full size; 0 if unreadable), mean and
+        std of the thumbnail's grey levels, flags (list of QUALITY_* names,
+        empty if the image looks fine) and error (None unless the image
+        couldn't be checked, e.g. a missing file)
+    '''
+
+    result_OUT = {'path': image_file_path, 'width': 0, 'height': 0, 'mean': None, 'std': None, 'flags': [], 'error': None}
+
+    if not os.path.isfile(image_file_path):
+        result_OUT['error'] = "file not found"
+        return result_OUT
+
+    try:
+        with Image.open(image_file_path) as image:
+            result_OUT['width'], result_OUT['height'] = image.size
+            image.draft('L', THUMBNAIL_SIZE)
+            pixels = np.asarray(image.convert('L'), dtype = np.float32)
+    except OSError as e:
+        # Pillow reports data that stops early as "image file is truncated"
+        # or "broken data stream"; anything else it can't read is corrupt
+        is_truncated = 'truncated' in str(e) or 'broken data stream' in str(e)
+        result_OUT['flags'].append(QUALITY_TRUNCATED if is_truncated else QUALITY_CORRUPT)
+        return result_OUT
+    except (SyntaxError, ValueError):
+        result_OUT['flags'].append(QUALITY_CORRUPT)
+        return result_OUT
+
+    result_OUT['mean'] = float(pixels.mean())
+    result_OUT['std'] = float(pixels.std())
+
+    if np.percentile(pixels, 99) <= BLACK_LEVEL:
+        result_OUT['flags'].append(QUALITY_BLACK)
+    elif result_OUT['std'] < BLANK_STD:
+        result_OUT['flags'].append(QUALITY_BLANK)
+
+    aspect_ratio = result_OUT['width'] / result_OUT['height'] if result_OUT['height'] else 0.0
+    if not MIN_ASPECT_RATIO <= aspect_ratio <= MAX_ASPECT_RATIO:
+        result_OUT['flags'].append(QUALITY_ASPECT_RATIO)
+
+    return result_OUT
+
+
+def check_chunk(image_file_list):
+    '''
+    Worker task: checks a chunk of images, one at a time, with truncated
+    images raising instead of being padded out (shrink_images.py turns that
+    on process-wide)
+
+    Returns:
+    - list of check_image() results
+    '''
+
+    was_loading_truncated = ImageFile.LOAD_TRUNCATED_IMAGES
+    ImageFile.LOAD_TRUNCATED_IMAGES = False
+
+    try:
+        return [check_image(image_file_path) for image_file_path in image_file_list]
+    finally:
+        ImageFile.LOAD_TRUNCATED_IMAGES = was_loading_truncated
+
+
+def check_images(
+    image_file_list,
+    max_workers = None,
+    chunk_size = QUALITY_CHUNK_SIZE,
+    progress = None,
+    progress_every = 500
+):
+    '''
+    Checks a list of images across a pool of worker processes
+
+    Takes:
+    - list of image filepaths, from one reel or many
+    - optional number of worker processes (default: one per CPU; 1 runs
+        everything in this process)
+    - optional number of files per task
+    - optional progress callback taking (num done, num total, seconds
+        elapsed), called every progress_every images and at the end
+    - optional number of images between progress reports
+    Returns:
+    - list of check_image() results, in image_file_list order
+    '''
+
+    start = time.perf_counter()
+    num_total = len(image_file_list)
+    result_by_path = {}
+    next_report = progress_every
+
+    def collect(chunk_result_list):
+        nonlocal next_report
+        for result in chunk_result_list:
+            result_by_path[result['path']] = result
+        if progress and len(result_by_path) >= next_report:
+            progress(len(result_by_path), num_total, time.perf_counter() - start)
+            next_report = len(result_by_path) + progress_every
+
+    chunk_list = [image_file_list[i : i + chunk_size] for i in range(0, num_total, chunk_size)]
+
+    if max_workers == 1 or len(chunk_list) <= 1:
+
+        for chunk in chunk_list:
+            collect(check_chunk(chunk))
+
+    else:
+
+        with ProcessPoolExecutor(max_workers = max_workers) as executor:
+            chunk_by_future = {executor.submit(check_chunk, chunk): chunk for chunk in chunk_list}
+            for future in as_completed(chunk_by_future):
+                try:
+                    collect(future.result())
+                except Exception as e:
+                    # the worker itself died (e.g. out of memory): report its chunk unchecked
+                    collect([
+                        {'path': path, 'width': 0, 'height': 0, 'mean': None, 'std': None, 'flags': [], 'error': f"{type(e).__name__}: {e}"}
+                        for path in chunk_by_future[future]
+                    ])
+
+    if progress and num_total:
+        progress(num_total, num_total, time.perf_counter() - start)
+
+    return [result_by_path[image_file_path] for image_file_path in image_file_list]
+
+
+def get_flags_by_name(result_list):
+    '''
+    Returns dict of file name -> comma-separated flags for the flagged
+    images in a list of results (the form ImageFile.quality_flags takes)
+    '''
+
+    return {
+        os.path.basename(result['path']): ",".join(result['flags'])
+        for result in result_list if result['flags']
+    }
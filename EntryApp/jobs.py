@@ -0,0 +1,411 @@
+"""
+BACKGROUND REEL JOBS
+
+This module runs long reel operations off the request path. Jobs are rows
+in the ReelJob table; `python manage.py run_reel_jobs` claims them one at a
+time and runs the matching handler below.
+
+Every handler is idempotent, so a job whose worker crashed part way can
+simply be run again:
+
+- assign_next_reel: the whole "next reel" step is one transaction, and the
+  assigned reel id is written to the job in that same transaction; it
+  does nothing once the keyer has moved off the reel it was queued from
+- load_reel: load_db.load_reel() skips reels and ImageFiles it already has
+- shrink_reel: images that already have a _smaller copy are skipped
+- release_reel: the slot is only cleared if the keyer is still in it
+- tile_reel: images whose .dzi is already written are skipped
+- check_reel_quality: checking only reads the images, and recording the
+  flags overwrites the last result
+
+Enqueue from the app or the django shell, e.g.
+
+    import EntryApp.jobs as jobs
+    jobs.enqueue_load_reel('/data/storage/images/1970/some_reel', 1970, 'IL')
+"""
+
+import logging
+import traceback
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+import EntryApp.choices as choices
+import EntryApp.load_db as ldb
+
+from EntryApp.image_quality import check_images
+from EntryApp.image_quality import get_flags_by_name
+from EntryApp.models import Keyer
+from EntryApp.models import Reel
+from EntryApp.models import ReelJob
+from EntryApp.reel_allocator import lock_keyer
+from EntryApp.reel_allocator import move_keyer_to_next_reel
+from EntryApp.reel_allocator import release_reel_slot
+from EntryApp.shrink_images import DEFAULT_SHRINK_ENCODER
+from EntryApp.shrink_images import RESAMPLE_FILTERS
+from EntryApp.shrink_images import get_full_size_image_list
+from EntryApp.shrink_images import shrink_images
+from EntryApp.tile_images import get_served_image_list
+from EntryApp.tile_images import tile_image
+
+#==============================================================================#
+# LOGGER
+#==============================================================================#
+
+logger = logging.getLogger(__name__)
+
+#==============================================================================#
+# CONSTANTS-ish
+#==============================================================================#
+
+# running jobs not heard from in this long are assumed to have lost their worker
+STALE_AFTER_MINUTES = 30
+
+# a failed job waits this long before its second attempt, doubling each time
+RETRY_DELAY_SECONDS = 30
+
+# how often (in images) long handlers report progress
+PROGRESS_EVERY = 50
+
+
+#==============================================================================#
+# ENQUEUE
+#==============================================================================#
+
+def enqueue_job(job_type, payload, jbid = None):
+    '''
+    Adds a job to the queue. If the same keyer already has a job of this
+    type with the same payload that is queued, running or done, that job is
+    returned instead of queueing a second one (double clicks, page reloads,
+    a form resubmitted after the job finished). Only a failed job is queued
+    again.
+
+    Takes:
+    - string job type, one of choices.REEL_JOB_TYPE_CHOICES
+    - dict of handler arguments
+    - optional string keyer jbid
+    Returns:
+    - ReelJob instance
+    '''
+
+    if not jbid:
+        return ReelJob.objects.create(job_type = job_type, payload = payload, jbid = jbid)
+
+    with transaction.atomic():
+
+        # the keyer's row lock makes a second request wait for the first
+        # one's job, then find it, rather than both finding nothing
+        lock_keyer(jbid)
+
+        same_job = ReelJob.objects.filter(
+            jbid = jbid,
+            job_type = job_type,
+            **{f'payload__{key}': value for key, value in payload.items()}
+        ).exclude(status = choices.REEL_JOB_FAILED).order_by('-id').first()
+
+        if same_job:
+            return same_job
+
+        return ReelJob.objects.create(job_type = job_type, payload = payload, jbid = jbid)
+
+
+def enqueue_assign_next_reel(jbid, from_reel_id):
+    payload = {'jbid': jbid, 'from_reel_id': from_reel_id}
+    return enqueue_job(choices.REEL_JOB_ASSIGN_NEXT_REEL, payload, jbid = jbid)
+
+
+def enqueue_load_reel(reel_path, year, state):
+    payload = {'reel_path': reel_path, 'year': year, 'state': state}
+    return enqueue_job(choices.REEL_JOB_LOAD_REEL, payload)
+
+
+def enqueue_shrink_reel(reel_path):
+    return enqueue_job(choices.REEL_JOB_SHRINK_REEL, {'reel_path': reel_path})
+
+
+def enqueue_tile_reel(reel_path):
+    return enqueue_job(choices.REEL_JOB_TILE_REEL, {'reel_path': reel_path})
+
+
+def enqueue_check_reel_quality(reel_path):
+    return enqueue_job(choices.REEL_JOB_CHECK_REEL_QUALITY, {'reel_path': reel_path})
+
+
+def enqueue_release_reel(reel_id, jbid, keyer_position, delete_img = False):
+    payload = {
+        'reel_id': reel_id,
+        'jbid': jbid,
+        'keyer_position': keyer_position,
+        'delete_img': delete_img
+    }
+    return enqueue_job(choices.REEL_JOB_RELEASE_REEL, payload)
+
+
+def get_latest_keyer_job(jbid, job_type = choices.REEL_JOB_ASSIGN_NEXT_REEL):
+    '''
+    Returns a keyer's most recent job of a type, or None
+    '''
+    return ReelJob.objects.filter(jbid = jbid, job_type = job_type).order_by('-id').first()
+
+
+#==============================================================================#
+# HANDLERS
+#==============================================================================#
+
+def report_progress(job, num_done, num_total):
+    '''
+    Records percent complete; also serves as the worker's heartbeat
+    '''
+
+    progress = int(100 * num_done / num_total) if num_total else 100
+    ReelJob.objects.filter(pk = job.pk).update(progress = progress, last_modified = timezone.now())
+    job.progress = progress
+
+
+def handle_assign_next_reel(job):
+
+    # already done by an earlier attempt: the reel id was saved with it
+    if 'reel_id' in job.result:
+        return job.result
+
+    with transaction.atomic():
+
+        # does nothing if the keyer has already moved off from_reel_id
+        this_reel = move_keyer_to_next_reel(
+            job.payload['jbid'],
+            from_reel_id = job.payload.get('from_reel_id')
+        )
+        result = {'reel_id': this_reel.id if this_reel else None}
+
+        # same transaction as the assignment, so a crash can't split them
+        ReelJob.objects.filter(pk = job.pk).update(result = result)
+
+    return result
+
+
+def handle_load_reel(job):
+
+    payload = job.payload
+    ldb.load_reel(
+        payload['reel_path'],
+        payload['year'],
+        payload['state'],
+        progress = lambda num_done, num_total: report_progress(job, num_done, num_total),
+        progress_every = PROGRESS_EVERY
+    )
+
+    reel_id_list = list(
+        Reel.objects.filter(reel_path = payload['reel_path'], year = payload['year']).values_list('id', flat = True)
+    )
+    return {'reel_ids': reel_id_list}
+
+
+def handle_shrink_reel(job):
+
+    # resume: shrink_images() skips what an earlier attempt finished
+    result = shrink_images(
+        get_full_size_image_list(job.payload['reel_path']),
+        max_workers = getattr(settings, 'SHRINK_IMAGE_WORKERS', None),
+        progress = lambda num_done, num_total, seconds: report_progress(job, num_done, num_total),
+        progress_every = PROGRESS_EVERY,
+        fast = getattr(settings, 'SHRINK_IMAGE_FAST', False),
+        resample = RESAMPLE_FILTERS[getattr(settings, 'SHRINK_IMAGE_RESAMPLE', 'crop')],
+        encoder = getattr(settings, 'SHRINK_IMAGE_ENCODER', DEFAULT_SHRINK_ENCODER)
+    )
+
+    return {
+        'num_images': result['num_images'],
+        'num_shrunk': result['num_shrunk'],
+        'bytes_in': result['bytes_in'],
+        'bytes_out': result['bytes_out'],
+        'encode_seconds': round(result['encode_seconds'], 3),
+        'errors': result['errors'],
+    }
+
+
+def handle_tile_reel(job):
+
+    reel_path = job.payload['reel_path']
+
+    image_file_list = get_served_image_list(reel_path)
+    num_total = len(image_file_list)
+    error_list = []
+
+    for i, image_path in enumerate(image_file_list, start = 1):
+
+        # resume: tile_image() skips images whose .dzi is already there
+        try:
+            tile_image(image_path)
+        except Exception as e:
+            error_list.append(f"{image_path}: {type(e).__name__}: {e}")
+
+        if i % PROGRESS_EVERY == 0:
+            report_progress(job, i, num_total)
+
+    # point the reel's ImageFiles at their pyramids, if it's loaded yet
+    num_recorded = ldb.record_reel_tiles(reel_path)
+
+    return {'num_images': num_total, 'num_recorded': num_recorded, 'errors': error_list}
+
+
+def handle_check_reel_quality(job):
+
+    reel_path = job.payload['reel_path']
+
+    result_list = check_images(
+        get_served_image_list(reel_path),
+        max_workers = getattr(settings, 'IMAGE_QUALITY_WORKERS', None),
+        progress = lambda num_done, num_total, seconds: report_progress(job, num_done, num_total),
+        progress_every = PROGRESS_EVERY
+    )
+    flags_by_name = get_flags_by_name(result_list)
+
+    # flag the reel's ImageFiles, if it's loaded yet
+    num_recorded = ldb.record_reel_quality(reel_path, flags_by_name)
+
+    flag_counts = {}
+    for quality_flags in flags_by_name.values():
+        for flag in quality_flags.split(","):
+            flag_counts[flag] = flag_counts.get(flag, 0) + 1
+
+    return {
+        'num_images': len(result_list),
+        'num_flagged': len(flags_by_name),
+        'flag_counts': flag_counts,
+        'num_recorded': num_recorded,
+        'errors': [f"{r['path']}: {r['error']}" for r in result_list if r['error']],
+    }
+
+
+def handle_release_reel(job):
+
+    payload = job.payload
+    reel = Reel.objects.get(pk = payload['reel_id'])
+    keyer = Keyer.objects.get(jbid = payload['jbid'])
+
+    was_cleared = release_reel_slot(
+        reel,
+        keyer,
+        payload['keyer_position'],
+        payload.get('delete_img', False)
+    )
+    return {'slot_cleared': was_cleared}
+
+
+JOB_HANDLERS = {
+    choices.REEL_JOB_ASSIGN_NEXT_REEL: handle_assign_next_reel,
+    choices.REEL_JOB_LOAD_REEL: handle_load_reel,
+    choices.REEL_JOB_SHRINK_REEL: handle_shrink_reel,
+    choices.REEL_JOB_RELEASE_REEL: handle_release_reel,
+    choices.REEL_JOB_TILE_REEL: handle_tile_reel,
+    choices.REEL_JOB_CHECK_REEL_QUALITY: handle_check_reel_quality,
+}
+
+
+#==============================================================================#
+# WORKER
+#==============================================================================#
+
+def claim_next_job():
+    '''
+    Takes the oldest queued job and marks it running. Jobs other workers
+    are claiming are skipped, not waited on, and so are failed jobs still
+    waiting out their retry delay.
+
+    Returns:
+    - ReelJob instance, or None if there is nothing to run yet
+    '''
+
+    with transaction.atomic():
+
+        job = ReelJob.objects.select_for_update(skip_locked = True).filter(
+            Q(run_after__isnull = True) | Q(run_after__lte = timezone.now()),
+            status = choices.REEL_JOB_QUEUED
+        ).order_by('id').first()
+
+        if job is None:
+            return None
+
+        job.status = choices.REEL_JOB_RUNNING
+        job.attempts += 1
+        job.started = timezone.now()
+        job.save(update_fields = ['status', 'attempts', 'started', 'last_modified'])
+
+    return job
+
+
+def run_job(job):
+    '''
+    Runs a claimed job. On failure the job goes back in the queue, to be
+    retried after RETRY_DELAY_SECONDS (doubled for each attempt so far),
+    until it has used up max_attempts; then it is marked failed.
+
+    Takes:
+    - running ReelJob instance
+    Returns:
+    - the same instance, with its final status
+    '''
+
+    me = 'run_job()'
+
+    try:
+        result = JOB_HANDLERS[job.job_type](job)
+
+    except Exception:
+
+        job.error = traceback.format_exc()
+        job.status = choices.REEL_JOB_QUEUED if job.attempts < job.max_attempts else choices.REEL_JOB_FAILED
+        job.run_after = timezone.now() + timedelta(seconds = RETRY_DELAY_SECONDS * 2 ** (job.attempts - 1))
+        logger.exception(f'{me}: {job} attempt {job.attempts} failed')
+
+    else:
+
+        job.result = result or {}
+        job.progress = 100
+        job.status = choices.REEL_JOB_DONE
+
+    job.finished = timezone.now()
+    job.save(update_fields = ['result', 'progress', 'status', 'run_after', 'error', 'finished', 'last_modified'])
+
+    return job
+
+
+def requeue_stale_jobs(stale_after_minutes = STALE_AFTER_MINUTES):
+    '''
+    Puts running jobs whose worker has gone quiet back in the queue
+
+    Returns:
+    - number of jobs requeued
+    '''
+
+    cutoff = timezone.now() - timedelta(minutes = stale_after_minutes)
+
+    return ReelJob.objects.filter(
+        status = choices.REEL_JOB_RUNNING,
+        last_modified__lt = cutoff
+    ).update(status = choices.REEL_JOB_QUEUED)
+
+
+def run_pending_jobs(max_jobs = None):
+    '''
+    Runs queued jobs until the queue is empty (or max_jobs have run)
+
+    Returns:
+    - list of jobs run
+    '''
+
+    job_list_OUT = []
+
+    while max_jobs is None or len(job_list_OUT) < max_jobs:
+
+        job = claim_next_job()
+        if job is None:
+            break
+
+        job_list_OUT.append(run_job(job))
+
+    return job_list_OUT
@@ -10,6 +10,7 @@ for use in the Django shell.
 import csv
 import glob
 import json
+import logging
 import os
 import socket
 from pathlib import Path
@@ -17,8 +18,15 @@ from pathlib import Path
 from django.conf import settings
 from django.contrib.auth.models import Group
 from django.db import connection
+from django.db import transaction
 
-from EntryApp.shrink_images import shrink_reel_images_before_db
+from EntryApp.shrink_images import get_image_variant
+from EntryApp.shrink_images import get_small_image_list
+from EntryApp.shrink_images import shrink_images_before_db_in_bulk
+from EntryApp.tile_images import get_tiled_name
+import EntryApp.form_registry as form_registry
+import EntryApp.image_quality as image_quality
+import EntryApp.reel_allocator as reel_allocator
 
 from EntryApp.models import Breaker
 from EntryApp.models import CurrentEntry
@@ -31,19 +39,27 @@ from EntryApp.models import Record
 from EntryApp.models import Reel
 from EntryApp.models import Sheet
 
+logger = logging.getLogger(__name__)
+
 CHUNK_SIZE = 10000 # deprecated because we realized Reels can't be split 
 
+# how often (in images) load_reel() reports progress, when given a callback
+LOAD_PROGRESS_EVERY = 500
+
 
-def load_imagefiles(reel_path, year, chunk_name, image_chunk):
+def load_imagefiles(reel_path, year, chunk_name, image_chunk, progress = None, progress_every = LOAD_PROGRESS_EVERY):
     '''
     Loads images from a given reel into ImageFile model.
-    Expects .jpg images.
+    Expects the shrunk .jpg (or .webp) images.
 
     Takes:
     - reel filepath
     - year
     - name of the chunk of images
     - lsit of image filepaths
+    - optional progress callback taking the number of images done in this
+      chunk, called every progress_every images
+    - optional number of images between progress reports
     Returns: None
     '''
 
@@ -79,6 +95,8 @@ def load_imagefiles(reel_path, year, chunk_name, image_chunk):
             image_file_instance.year = year
             image_file_instance.img_reel = parent_reel
             image_file_instance.smaller_image_file_name = image_file_instance.img_file_name #TODO: improve this
+            image_file_instance.smaller_image_variant = get_image_variant(full_file_path)
+            image_file_instance.tile_source_name = get_tiled_name(full_file_path)
             image_file_instance.save()
             
 
@@ -95,6 +113,9 @@ def load_imagefiles(reel_path, year, chunk_name, image_chunk):
 
         #-- END check to see if we already have instance for this file path. --#
 
+        if progress and file_counter % progress_every == 0:
+            progress(file_counter)
+
         #print( "----> ImageFile: {image_file}".format( image_file = image_file_instance ) )
 
     # set the number of images in reel to number of files
@@ -189,7 +210,7 @@ def point_current_entry_to_new_reel(jbid, this_reel):
     current.save()
 
 
-def load_reel(reel_path, year, state):
+def load_reel(reel_path, year, state, progress = None, progress_every = LOAD_PROGRESS_EVERY):
     '''
     Wrapper method to load a reel into the DB
     Used for csv bulk load
@@ -198,6 +219,10 @@ def load_reel(reel_path, year, state):
     - string reel directory filepath, NOT ending in / 
     - integer year to which the images belong
     - string state abbreviation (postal code)
+    - optional progress callback taking (num done, num total), called every
+      progress_every images and at the end; the reel_jobs worker uses it
+      as its heartbeat
+    - optional number of images between progress reports
     Returns:
     - None
     '''
@@ -212,7 +237,8 @@ def load_reel(reel_path, year, state):
     print(f'path_head is {path_head}')
     
     # how many images are in here?
-    image_list = glob.glob(reel_path + "/*_smaller.jpg")
+    # one shrunk copy per image; the configured encoder's if there are two
+    image_list = get_small_image_list(reel_path, getattr(settings, 'SHRINK_IMAGE_ENCODER', None))
     num_images = len(image_list)
     num_chunks = max(num_images // CHUNK_SIZE, 1)
     print(f"Splitting {reel_path}  with {num_images} images into {num_chunks} chunks...")
@@ -225,6 +251,7 @@ def load_reel(reel_path, year, state):
     chunks = chunk_images(image_list, num_images, num_chunks)
 
     # loop through them
+    num_loaded = 0
     for name, chunk in zip(chunk_names, chunks):
 
         print(f"name is {name} and chunk is {chunk}")
@@ -238,15 +265,135 @@ def load_reel(reel_path, year, state):
             state = state
         )
 
-        # call load_imagefiles
-        load_imagefiles(reel_path, year, name, chunk)
+        # call load_imagefiles, counting progress across chunks
+        chunk_progress = None
+        if progress:
+            chunk_progress = lambda num_done, offset = num_loaded: progress(offset + num_done, num_images)
+        load_imagefiles(reel_path, year, name, chunk, chunk_progress, progress_every)
+        num_loaded += len(chunk)
 
+    if progress:
+        progress(num_images, num_images)
 
     return
 
 #-- END function load_reel() --#
 
 
+def record_reel_tiles(reel_path):
+    '''
+    Records which of a loaded reel's ImageFiles have a finished tile pyramid
+    (see EntryApp/tile_images.py), for reels tiled after they were loaded.
+    Pyramids that have gone missing are cleared, so the viewer falls back
+    to the plain image.
+
+    Takes:
+    - string reel directory filepath, as given to load_reel(); a trailing
+      slash is ignored
+    Returns:
+    - number of ImageFiles updated
+    '''
+
+    me = 'record_reel_tiles()'
+    reel_path = reel_path.rstrip('/')
+    changed_list = []
+
+    image_file_qs = ImageFile.objects.filter(img_reel__reel_path = reel_path)
+    image_file_qs = image_file_qs.only('id', 'img_folder_path', 'smaller_image_file_name', 'tile_source_name')
+
+    image_file_list = list(image_file_qs)
+    if not image_file_list:
+        logger.warning(f'{me}: no ImageFiles loaded for {reel_path}')
+
+    for image_file in image_file_list:
+
+        served_path = os.path.join(image_file.img_folder_path or reel_path, image_file.smaller_image_file_name)
+        tiled_name = get_tiled_name(served_path)
+
+        if tiled_name != image_file.tile_source_name:
+            image_file.tile_source_name = tiled_name
+            changed_list.append(image_file)
+
+    ImageFile.objects.bulk_update(changed_list, ['tile_source_name'], batch_size = 1000)
+
+    return len(changed_list)
+
+#-- END function record_reel_tiles() --#
+
+
+def record_reel_quality(reel_path, flags_by_name):
+    '''
+    Records the image quality check results (see EntryApp/image_quality.py)
+    on a loaded reel's ImageFiles. Images not in flags_by_name are cleared,
+    so a re-check after rescanning drops flags that no longer apply.
+
+    Takes:
+    - string reel directory filepath, as given to load_reel(); a trailing
+      slash is ignored
+    - dict of served file name -> comma-separated flags, e.g. from
+      image_quality.get_flags_by_name()
+    Returns:
+    - number of ImageFiles updated
+    '''
+
+    me = 'record_reel_quality()'
+    reel_path = reel_path.rstrip('/')
+    changed_list = []
+
+    image_file_qs = ImageFile.objects.filter(img_reel__reel_path = reel_path)
+    image_file_qs = image_file_qs.only('id', 'img_file_name', 'quality_flags')
+
+    image_file_list = list(image_file_qs)
+    if not image_file_list:
+        logger.warning(f'{me}: no ImageFiles loaded for {reel_path}')
+
+    for image_file in image_file_list:
+
+        quality_flags = flags_by_name.get(image_file.img_file_name, "")
+
+        if quality_flags != image_file.quality_flags:
+            image_file.quality_flags = quality_flags
+            changed_list.append(image_file)
+
+    ImageFile.objects.bulk_update(changed_list, ['quality_flags'], batch_size = 1000)
+
+    return len(changed_list)
+
+#-- END function record_reel_quality() --#
+
+
+def record_quality_report(anomaly_csv_path):
+    '''
+    Records the quality flags from a reel_diagnostics.py --quality anomaly
+    file on every loaded reel it covers
+
+    Takes:
+    - string path to the anomaly csv (columns path, file_name, anomaly, ...)
+    Returns:
+    - number of ImageFiles updated
+    '''
+
+    flags_by_reel = {}
+
+    with open(anomaly_csv_path, newline = '') as csv_file:
+        for row in csv.DictReader(csv_file):
+            flags_by_name = flags_by_reel.setdefault(row['path'], {})
+            if row['anomaly'] in image_quality.QUALITY_FLAGS and row['file_name']:
+                flag_list = flags_by_name.setdefault(row['file_name'], [])
+                flag_list.append(row['anomaly'])
+
+    num_updated = 0
+    for reel_path, flags_by_name in flags_by_reel.items():
+        num_updated += record_reel_quality(
+            reel_path,
+            {name: ",".join(flag_list) for name, flag_list in flags_by_name.items()}
+        )
+
+    return num_updated
+
+#-- END function record_quality_report() --#
+
+
 def create_1990_dummy_breakers(keyer_jbids=[]):
     '''
     Create default breaker for 1990 for each user, plus associated dummy image
@@ -414,24 +561,30 @@ def create_image_fixture(path, users, out, ext="*.jpg"):
 
 def load_form_fields(field_tbl_path=settings.FORM_FIELDS_CSV, reload=True):
     '''
-    Load the formfield table into the DB (1 row at a time)
+    Load the formfield table into the DB, then bump the FormField version so
+    every running app process reloads its copy (see form_registry)
 
     Takes:
     - path string to csv file mapping fields to years
     - optional boolean if keeping what's in the FormField model
     '''
 
-    if reload:
-        FormField.objects.all().delete()
-
     with open(field_tbl_path) as f:
         csvreader = csv.reader(f)
         next(csvreader) # skip header row
 
+        field_list = []
         for row in csvreader:
             print(row)
-            field = FormField(year = row[0], form_type=row[1], field_name=row[2])
-            field.save()
+            field_list.append(FormField(year = row[0], form_type=row[1], field_name=row[2]))
+
+    with transaction.atomic():
+
+        if reload:
+            FormField.objects.all().delete()
+
+        FormField.objects.bulk_create(field_list)
+        form_registry.bump_version()
 
 
 def load_reels_from_csv(reel_csv_path):
@@ -465,42 +618,13 @@ def assign_reel_to_keyer(this_reel, keyer, keyer_position):
     - None
     '''
 
-    # set the keyer
-    if keyer_position == 1:
-        this_reel.keyer_one = keyer
-
-    elif keyer_position == 2:
-        this_reel.keyer_two = keyer
-
-    else:
+    if keyer_position not in [1, 2]:
         print(f'assign_reel_to_keyer() got wrong number for keyer position')
         raise ValueError
 
-    # increment reel keyer count
-    this_reel.keyer_count += 1
-    this_reel.save()
-
-    # also increment keyer reel count
-    keyer.reel_count += 1
-    keyer.save()
-
-    # now, get year and associated image files 
-    year = this_reel.year
-    image_file_qs = ImageFile.objects.filter(img_reel_id = this_reel)
-
-    # loop through and create Image instance w/this keyer 
-    for image_file_instance in image_file_qs:
-
-        img = Image.objects.create( 
-                image_file=image_file_instance, \
-                jbid=keyer.jbid, \
-                is_complete=False, \
-                year=year,
-                image_type=None, \
-                problem=False
-        )
-
-    #-- END loop over images in the reel --#
+    # locks the reel, fills the slot and bulk creates the Images in one go
+    reel_allocator.assign_reel_to_keyer(this_reel, keyer, keyer_position)
+    this_reel.refresh_from_db()
 
     return 
 
@@ -518,32 +642,14 @@ def remove_reel_from_keyer(this_reel, this_keyer, keyer_position, delete_img = F
     - optional boolean: True will delete associated Images, False will preserve them
     '''
 
-    # remove keyer from position and decrement keyer count
-    if keyer_position == 1:
-        this_reel.keyer_one_id = None
-    elif keyer_position == 2:
-        this_reel.keyer_two_id = None
-    else:
+    if keyer_position not in [1, 2]:
         print("load_db.remove_reel_from_keyer() got unknown keyer position")
-    
-    this_reel.keyer_count += -1
-    this_reel.save()
-
-    # decrement keyer
-    this_keyer.reel_count += -1
-    this_keyer.save()
-
-    # delete images if specified 
-    if delete_img:
-
-        year = this_reel.year
-        image_file_qs = ImageFile.objects.filter(img_reel_id = this_reel)
+        raise ValueError
 
-        # loop through and create Image instance w/this keyer 
-        for image_file_instance in image_file_qs:            
-            image_qs = Image.objects.filter(image_file =  image_file_instance)
-            image = image_qs.filter(jbid = this_keyer.jbid).get()
-            image.delete()
+    # clears the slot only if this keyer is still in it; bulk deletes Images
+    reel_allocator.release_reel_slot(this_reel, this_keyer, keyer_position, delete_img)
+    this_reel.refresh_from_db()
+    this_keyer.refresh_from_db()
 
     return
 
@@ -605,7 +711,7 @@ def bulk_load_db(shrink_images=False):
     '''
 
     if shrink_images:
-        shrink_reel_images_before_db(settings.DEFAULT_REEL_LOAD_SPEC)
+        shrink_images_before_db_in_bulk(settings.DEFAULT_REEL_LOAD_SPEC)
 
     load_form_fields(settings.FORM_FIELDS_CSV)
     load_reels_from_csv(settings.DEFAULT_REEL_LOAD_SPEC)
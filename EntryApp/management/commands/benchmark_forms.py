@@ -0,0 +1,105 @@
+"""
+BENCHMARK FORM CONSTRUCTION
+
+Times building the FormField-driven form classes the way the views used to
+(modelform_factory / modelformset_factory on every request) against the
+per-process cache in forms.py, for every (year, form_type) in FormField.
+Each timing covers getting the class and instantiating one blank form, i.e.
+what a request pays before rendering.
+
+Usage:
+    python manage.py benchmark_forms [--repeat N]
+"""
+
+import time
+
+from django import forms
+from django.core.management.base import BaseCommand
+
+import EntryApp.choices as choices
+import EntryApp.form_registry as form_registry
+
+from EntryApp.forms import BaseBreakerFormSet
+from EntryApp.forms import clear_form_class_cache
+from EntryApp.forms import get_form_class
+from EntryApp.forms import get_formset_class
+from EntryApp.models import Breaker
+from EntryApp.models import LongForm1990
+from EntryApp.models import Record
+from EntryApp.models import Sheet
+
+# model for each form type, and whether the views use a formset for it
+FORM_TYPE_MODELS = {
+    'breaker': (Breaker, True),
+    'long': (LongForm1990, False),
+    'short': (Record, False),
+    'sheet': (Sheet, False),
+}
+
+
+class Command(BaseCommand):
+
+    help = 'Time form class construction, uncached vs cached'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=200,
+            help='constructions to time per form (default 200)'
+        )
+
+    def build_uncached(self, model, is_formset, fields):
+        if is_formset:
+            formset_class = forms.modelformset_factory(model, fields = fields, formset = BaseBreakerFormSet)
+            return formset_class(queryset = model.objects.none())
+        widgets = {f: choices.FORM_WIDGETS[f] for f in fields if f in choices.FORM_WIDGETS}
+        return forms.modelform_factory(model, fields = fields, widgets = widgets)()
+
+    def build_cached(self, model, is_formset, year, form_type, fields):
+        if is_formset:
+            formset_class = get_formset_class(model, year, form_type, formset = BaseBreakerFormSet, fields = fields)
+            return formset_class(queryset = model.objects.none())
+        return get_form_class(model, year, form_type, fields = fields)()
+
+    def time_it(self, build, repeat):
+        '''
+        Returns mean milliseconds per call
+        '''
+        start = time.perf_counter()
+        for i in range(repeat):
+            build()
+        return 1000 * (time.perf_counter() - start) / repeat
+
+    def handle(self, *args, **options):
+
+        repeat = options['repeat']
+        registry = form_registry.get_registry()
+
+        self.stdout.write(f'{"form":<16}{"fields":>8}{"uncached ms":>14}{"cached ms":>12}{"speedup":>10}')
+
+        for (year, form_type), fields in sorted(registry.items()):
+
+            if form_type not in FORM_TYPE_MODELS:
+                continue
+
+            model, is_formset = FORM_TYPE_MODELS[form_type]
+            fields = list(fields)
+
+            uncached_ms = self.time_it(
+                lambda: self.build_uncached(model, is_formset, fields),
+                repeat
+            )
+
+            # first build fills the cache; time the steady state after it
+            clear_form_class_cache()
+            self.build_cached(model, is_formset, year, form_type, fields)
+            cached_ms = self.time_it(
+                lambda: self.build_cached(model, is_formset, year, form_type, fields),
+                repeat
+            )
+
+            speedup = uncached_ms / cached_ms if cached_ms else float('inf')
+            self.stdout.write(
+                f'{int(year)} {form_type:<11}{len(fields):>8}{uncached_ms:>14.3f}{cached_ms:>12.3f}{speedup:>9.1f}x'
+            )
@@ -0,0 +1,153 @@
+"""
+BENCHMARK IMAGE SHRINKING
+
+Shrinks a sample of a reel's full-size scans both ways
+shrink_images.shrink_image() can: the standard full decode plus LANCZOS
+resize, and fast mode, where the JPEG decoder halves the image as it decodes
+(draft mode). Each mode runs in its own fresh process so its peak memory is
+its own. Reports time per image, peak RSS above the process's starting RSS
+and output size, then checks every fast output against the standard one:
+the mean absolute pixel difference (0-255) must be within --tolerance.
+
+Usage:
+    python manage.py benchmark_shrink REEL_PATH [--limit N] [--tolerance T] [--resample FILTER]
+"""
+
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from PIL import Image
+
+import EntryApp.shrink_images as shrink_images
+
+from EntryApp.shrink_images import RESAMPLE_FILTERS
+from EntryApp.shrink_images import get_full_size_image_list
+from EntryApp.shrink_images import make_new_filepath
+from EntryApp.shrink_images import shrink_image
+
+
+def run_mode(image_path_list, out_dir, fast, resample):
+    '''
+    Shrinks every image into out_dir in this (fresh) process
+
+    Returns:
+    - dict of seconds, peak RSS growth in KB and total output bytes
+    '''
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+
+    num_bytes = 0
+    for image_path in image_path_list:
+        out_path = os.path.join(out_dir, make_new_filepath(os.path.basename(image_path))[1])
+        shrink_image(image_path, out_path, fast = fast, resample = resample)
+        num_bytes += os.path.getsize(out_path)
+
+    return {
+        'seconds': time.perf_counter() - start,
+        'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb,
+        'bytes': num_bytes,
+    }
+
+
+def get_mean_difference(path_a, path_b):
+    '''
+    Returns the mean absolute pixel difference (0-255) of two images, or
+    None if their sizes differ
+    '''
+
+    with Image.open(path_a) as image_a, Image.open(path_b) as image_b:
+        if image_a.size != image_b.size:
+            return None
+        return shrink_images.get_mean_difference(image_a, image_b)
+
+
+class Command(BaseCommand):
+
+    help = 'Time standard vs fast (draft mode) image shrinking on a sample reel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('reel_path', help='reel directory with full-size gr*.jpg scans')
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=50,
+            help='images to shrink per mode (default 50)'
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=2.0,
+            help='largest allowed mean absolute pixel difference, 0-255 (default 2.0)'
+        )
+        parser.add_argument(
+            '--resample',
+            choices=sorted(RESAMPLE_FILTERS),
+            default='crop',
+            help='final step in fast mode for odd-sized scans (default crop)'
+        )
+
+    def handle(self, *args, **options):
+
+        image_path_list = get_full_size_image_list(options['reel_path'].rstrip('/'))[:options['limit']]
+        if not image_path_list:
+            raise CommandError(f"no full-size gr*.jpg images in {options['reel_path']}")
+
+        resample = RESAMPLE_FILTERS[options['resample']]
+        out_dirs = {mode: tempfile.mkdtemp(prefix=f'benchmark_shrink_{mode}_') for mode in ['standard', 'fast']}
+
+        try:
+            results = {}
+            for mode, out_dir in out_dirs.items():
+                # a fresh process per mode, so peak RSS isn't the other mode's
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    results[mode] = executor.submit(run_mode, image_path_list, out_dir, mode == 'fast', resample).result()
+
+            num_images = len(image_path_list)
+            self.stdout.write(f'{num_images} images from {options["reel_path"]}')
+            self.stdout.write(f'{"mode":<10}{"ms/image":>10}{"peak RSS MB":>13}{"KB/image":>10}')
+            for mode, result in results.items():
+                self.stdout.write(
+                    f'{mode:<10}{1000 * result["seconds"] / num_images:>10.1f}'
+                    f'{result["peak_kb"] / 1024:>13.1f}{result["bytes"] / 1024 / num_images:>10.1f}'
+                )
+            self.stdout.write(f'speedup {results["standard"]["seconds"] / results["fast"]["seconds"]:.1f}x')
+
+            difference_list = []
+            for image_path in image_path_list:
+                out_name = make_new_filepath(os.path.basename(image_path))[1]
+                difference = get_mean_difference(
+                    os.path.join(out_dirs['standard'], out_name),
+                    os.path.join(out_dirs['fast'], out_name)
+                )
+                difference_list.append((image_path, difference))
+
+        finally:
+            for out_dir in out_dirs.values():
+                shutil.rmtree(out_dir, ignore_errors=True)
+
+        over_list = [
+            (image_path, difference) for image_path, difference in difference_list
+            if difference is None or difference > options['tolerance']
+        ]
+        measured_list = [difference for image_path, difference in difference_list if difference is not None]
+        if measured_list:
+            self.stdout.write(
+                f'mean pixel difference: average {sum(measured_list) / len(measured_list):.2f}, '
+                f'worst {max(measured_list):.2f} (tolerance {options["tolerance"]})'
+            )
+
+        if over_list:
+            for image_path, difference in over_list:
+                detail = 'size differs' if difference is None else f'{difference:.2f}'
+                self.stdout.write(f'  {image_path}: {detail}')
+            raise CommandError(f'{len(over_list)} fast output(s) outside tolerance')
+
+        self.stdout.write('fast output within tolerance')
@@ -0,0 +1,109 @@
+"""
+EXPLAIN THE KEYER HOT-PATH QUERIES
+
+Runs EXPLAIN ANALYZE on each query the landing and coding pages run for
+every keyer, so we can check on production-sized data that the indexes in
+models.py are being used. Any plan line with a sequential scan is flagged.
+
+Usage:
+    python manage.py explain_hot_queries [--jbid JBID] [--no-analyze]
+
+On backends without EXPLAIN ANALYZE (e.g. sqlite) a plain EXPLAIN is run.
+"""
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+
+from EntryApp.dashboard import get_recent_image_qs
+from EntryApp.dashboard import get_todo_image_qs
+from EntryApp.models import CurrentEntry
+from EntryApp.models import FormField
+from EntryApp.models import ImageFile
+from EntryApp.models import KeyerReelProgress
+from EntryApp.models import Record
+from EntryApp.models import Sheet
+from EntryApp.reel_allocator import get_open_reel_qs
+
+
+class Command(BaseCommand):
+
+    help = 'EXPLAIN ANALYZE the keyer hot-path queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--jbid',
+            help='keyer to build the queries for (default: first keyer with a CurrentEntry)'
+        )
+        parser.add_argument(
+            '--no-analyze',
+            action='store_true',
+            help='plain EXPLAIN: plan only, queries are not executed'
+        )
+
+    def get_hot_queries(self, current):
+        '''
+        Returns list of (name, queryset) tuples, mirroring the view code
+        '''
+
+        jbid = current.jbid
+        reel = current.reel
+        sheet = Sheet.objects.filter(jbid = jbid).order_by('-id').first()
+
+        reel_queue_qs = get_open_reel_qs(current.keyer)
+
+        query_list_OUT = [
+            ('current entry', CurrentEntry.objects.filter(jbid = jbid)),
+            ('reel progress', KeyerReelProgress.objects.filter(jbid = jbid, reel = reel)),
+            ('next image', get_todo_image_qs(jbid, reel)[:1]),
+            ('recent images', get_recent_image_qs(jbid, reel, 5)),
+            ('reel queue', reel_queue_qs[:1]),
+            ('reel image files', ImageFile.objects.filter(img_reel = reel).order_by('img_position')),
+            ('form fields', FormField.objects.filter(year = reel.year, form_type = 'breaker')),
+        ]
+
+        if sheet:
+            query_list_OUT.append(
+                ('sheet records', Record.objects.filter(sheet = sheet).order_by('line_no', 'col_no'))
+            )
+
+        return query_list_OUT
+
+    def is_seq_scan(self, plan_line):
+        '''
+        Spots full table scans in postgres ("Seq Scan") or sqlite ("SCAN x"
+        without an index) plans
+        '''
+        if 'Seq Scan' in plan_line:
+            return True
+        return ' SCAN ' in f' {plan_line} ' and 'INDEX' not in plan_line
+
+    def handle(self, *args, **options):
+
+        current_qs = CurrentEntry.objects.select_related('reel', 'keyer')
+        if options['jbid']:
+            current_qs = current_qs.filter(jbid = options['jbid'])
+        current = current_qs.order_by('id').first()
+
+        if current is None:
+            raise CommandError('no CurrentEntry found to build queries from')
+
+        analyze = not options['no_analyze'] and connection.vendor == 'postgresql'
+        num_seq_scans = 0
+
+        self.stdout.write(f'keyer {current.jbid}, reel {current.reel}, analyze={analyze}\n')
+
+        for name, queryset in self.get_hot_queries(current):
+
+            plan = queryset.explain(analyze = True) if analyze else queryset.explain()
+
+            self.stdout.write(f'=== {name}')
+            self.stdout.write(str(queryset.query))
+            for line in plan.splitlines():
+                if self.is_seq_scan(line):
+                    num_seq_scans += 1
+                    line = line + '   <-- sequential scan'
+                self.stdout.write(line)
+            self.stdout.write('')
+
+        self.stdout.write(f'{num_seq_scans} sequential scan(s) flagged')
@@ -0,0 +1,52 @@
+"""
+FILL THE WARM REEL POOL
+
+Assigns every active keyer their next reel(s) ahead of time, so clicking
+"next reel" is a pointer flip instead of a reel assignment, and gives back
+reels held for keyers who have gone idle. See EntryApp/reel_allocator.py.
+
+Run it from cron, or let the job worker do it with
+`python manage.py run_reel_jobs --fill-pool SECONDS`.
+
+Usage:
+    python manage.py fill_reel_pool [--depth N] [--idle-hours H] [--no-release]
+"""
+
+from django.core.management.base import BaseCommand
+
+import EntryApp.reel_allocator as reel_allocator
+
+
+class Command(BaseCommand):
+
+    help = 'Provision next reels for active keyers and release reels held for idle ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--depth',
+            type=int,
+            help='reels to keep provisioned per keyer (default: settings.REEL_POOL_DEPTH)'
+        )
+        parser.add_argument(
+            '--idle-hours',
+            type=float,
+            help='hours without activity before a keyer is idle (default: settings.REEL_POOL_IDLE_HOURS)'
+        )
+        parser.add_argument(
+            '--no-release',
+            action='store_true',
+            help='only fill; keep reels held for idle keyers'
+        )
+
+    def handle(self, *args, **options):
+
+        if not options['no_release']:
+            released_list = reel_allocator.release_idle_reels(options['idle_hours'])
+            for jbid, reel_id in released_list:
+                self.stdout.write(f'released reel {reel_id} held for {jbid}')
+
+        provisioned_list = reel_allocator.fill_reel_pool(options['depth'], options['idle_hours'])
+        for provisioned in provisioned_list:
+            self.stdout.write(str(provisioned))
+
+        self.stdout.write(f'{len(provisioned_list)} reel(s) provisioned')
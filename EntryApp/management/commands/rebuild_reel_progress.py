@@ -0,0 +1,41 @@
+"""
+REBUILD KEYER REEL PROGRESS COUNTERS
+
+Recomputes KeyerReelProgress rows from Image rows and fixes any that have
+drifted. Safe to run while keyers are working.
+
+Usage:
+    python manage.py rebuild_reel_progress [--jbid JBID] [--reel REEL_ID] [--dry-run]
+"""
+
+from django.core.management.base import BaseCommand
+
+from EntryApp.progress import rebuild_all_progress
+
+
+class Command(BaseCommand):
+
+    help = 'Rebuild per-keyer reel progress counters from Image rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jbid', help='only rebuild this keyer')
+        parser.add_argument('--reel', type=int, help='only rebuild this reel id')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='report drifted counters without fixing them'
+        )
+
+    def handle(self, *args, **options):
+
+        num_checked, drifted_list = rebuild_all_progress(
+            jbid = options['jbid'],
+            reel_id = options['reel'],
+            dry_run = options['dry_run']
+        )
+
+        for jbid, reel_id in drifted_list:
+            self.stdout.write(f'drifted: {jbid} reel {reel_id}')
+
+        verb = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(f'checked {num_checked} keyer/reel pairs, {verb} {len(drifted_list)}')
@@ -0,0 +1,112 @@
+"""
+REPORT SHRUNK IMAGE SIZE BY ENCODER
+
+For each reel, encodes a sample of its full-size scans at half size with
+every encoder in shrink_images.SHRINK_ENCODERS (in memory; nothing is
+written to the reel) and reports, per encoder: bytes per image, the saving
+against the full-size scans and against baseline JPEG (what the app served
+originally), encode time per image, and the mean absolute pixel difference
+from the unencoded half-size image (0-255) as a rough legibility check.
+
+Usage:
+    python manage.py report_encoders REEL_PATH [REEL_PATH ...] [--limit N] [--encoders jpeg,webp] [--fast] [--csv FILE]
+"""
+
+import csv
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from EntryApp.shrink_images import DEFAULT_SHRINK_ENCODER
+from EntryApp.shrink_images import SHRINK_ENCODERS
+from EntryApp.shrink_images import compare_encoders
+from EntryApp.shrink_images import get_full_size_image_list
+
+CSV_COLUMNS = [
+    'reel_path',
+    'encoder',
+    'num_images',
+    'bytes_in',
+    'bytes_out',
+    'saved_vs_full_size',
+    'saved_vs_jpeg',
+    'encode_ms_per_image',
+    'mean_difference',
+]
+
+
+class Command(BaseCommand):
+
+    help = 'Compare shrunk image size, encode time and fidelity across output encoders, per reel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('reel_path', nargs='+', help='reel directories with full-size gr*.jpg scans')
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=20,
+            help='images to sample per reel (default 20)'
+        )
+        parser.add_argument(
+            '--encoders',
+            default=','.join(SHRINK_ENCODERS),
+            help=f'comma-separated encoders to compare (default {",".join(SHRINK_ENCODERS)})'
+        )
+        parser.add_argument('--fast', action='store_true', help='decode in draft mode, as shrink_image(fast=True)')
+        parser.add_argument('--csv', help='also write the report to this csv file')
+
+    def handle(self, *args, **options):
+
+        encoder_list = [e.strip() for e in options['encoders'].split(',') if e.strip()]
+        unknown_list = [e for e in encoder_list if e not in SHRINK_ENCODERS]
+        if unknown_list:
+            raise CommandError(f'unknown encoder(s) {", ".join(unknown_list)}; choose from {", ".join(SHRINK_ENCODERS)}')
+
+        row_list = []
+
+        self.stdout.write(
+            f'{"reel":<30}{"encoder":<13}{"images":>7}{"KB/image":>10}{"vs full":>9}{"vs jpeg":>9}{"encode ms":>11}{"diff":>7}'
+        )
+
+        for reel_path in options['reel_path']:
+
+            reel_path = reel_path.rstrip('/')
+            image_file_list = get_full_size_image_list(reel_path)[:options['limit']]
+            if not image_file_list:
+                self.stderr.write(f'{reel_path}: no full-size gr*.jpg images, skipped')
+                continue
+
+            report = compare_encoders(image_file_list, encoder_list, options['fast'])
+
+            # baseline JPEG is what the app served before encoders were selectable
+            jpeg_bytes = report[DEFAULT_SHRINK_ENCODER]['bytes_out'] if DEFAULT_SHRINK_ENCODER in report else None
+
+            for encoder, result in report.items():
+
+                row = {
+                    'reel_path': reel_path,
+                    'encoder': encoder,
+                    'num_images': result['num_images'],
+                    'bytes_in': result['bytes_in'],
+                    'bytes_out': result['bytes_out'],
+                    'saved_vs_full_size': round(1 - result['bytes_out'] / result['bytes_in'], 4),
+                    'saved_vs_jpeg': round(1 - result['bytes_out'] / jpeg_bytes, 4) if jpeg_bytes else '',
+                    'encode_ms_per_image': round(1000 * result['encode_seconds'] / result['num_images'], 2),
+                    'mean_difference': round(result['mean_difference'], 3),
+                }
+                row_list.append(row)
+
+                vs_jpeg = f'{row["saved_vs_jpeg"]:.0%}' if jpeg_bytes else '-'
+                self.stdout.write(
+                    f'{reel_path[-29:]:<30}{encoder:<13}{row["num_images"]:>7}'
+                    f'{result["bytes_out"] / 1024 / result["num_images"]:>10.1f}'
+                    f'{row["saved_vs_full_size"]:>9.0%}{vs_jpeg:>9}'
+                    f'{row["encode_ms_per_image"]:>11.1f}{row["mean_difference"]:>7.2f}'
+                )
+
+        if options['csv']:
+            with open(options['csv'], 'w', newline='') as csv_file:
+                writer = csv.DictWriter(csv_file, fieldnames=CSV_COLUMNS)
+                writer.writeheader()
+                writer.writerows(row_list)
+            self.stdout.write(f'wrote {len(row_list)} rows to {options["csv"]}')
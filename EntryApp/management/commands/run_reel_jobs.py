@@ -0,0 +1,78 @@
+"""
+RUN BACKGROUND REEL JOBS
+
+Worker for the ReelJob queue (see EntryApp/jobs.py). Run one per
+deployment alongside the web server, e.g. under the same supervisor or in
+a tmux session. Several workers can share a queue safely.
+
+Usage:
+    python manage.py run_reel_jobs              # poll forever
+    python manage.py run_reel_jobs --once       # drain the queue and exit
+    python manage.py run_reel_jobs --fill-pool  # also keep the warm reel pool full
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+import EntryApp.jobs as jobs
+import EntryApp.reel_allocator as reel_allocator
+
+
+class Command(BaseCommand):
+
+    help = 'Run queued reel jobs (reel assignment, loading, shrinking)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='run whatever is queued, then exit'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=2.0,
+            help='seconds to wait between polls of an empty queue'
+        )
+        parser.add_argument(
+            '--stale-minutes',
+            type=int,
+            default=jobs.STALE_AFTER_MINUTES,
+            help='requeue running jobs not heard from in this long'
+        )
+        parser.add_argument(
+            '--fill-pool',
+            type=float,
+            metavar='SECONDS',
+            help='every SECONDS, top up the warm reel pool and release idle keyers\' reels'
+        )
+
+    def handle(self, *args, **options):
+
+        last_fill = None
+
+        while True:
+
+            # another worker may have died since the last pass
+            num_requeued = jobs.requeue_stale_jobs(options['stale_minutes'])
+            if num_requeued:
+                self.stdout.write(f'requeued {num_requeued} stale job(s)')
+
+            if options['fill_pool'] is not None:
+                if last_fill is None or time.monotonic() - last_fill >= options['fill_pool']:
+                    reel_allocator.release_idle_reels()
+                    for provisioned in reel_allocator.fill_reel_pool():
+                        self.stdout.write(str(provisioned))
+                    last_fill = time.monotonic()
+
+            for job in jobs.run_pending_jobs():
+                self.stdout.write(f'{job}: attempt {job.attempts}')
+
+            if options['once']:
+                break
+
+            # don't hang on to a connection the DB may have dropped
+            close_old_connections()
+            time.sleep(options['sleep'])
@@ -7,6 +7,8 @@ import os
 
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
 from django.urls import reverse
 
 import EntryApp.choices as choices
@@ -129,7 +131,24 @@ class Reel(models.Model):
             models.CheckConstraint(
                 check = models.Q(state__in=choices.STATE_LIST),
                 name = 'valid state postal abbreviation'
-            )
+            ),
+            # backstops for the reel allocator
+            models.CheckConstraint(
+                check = models.Q(keyer_count__lte = 2),
+                name = 'reel_at_most_two_keyers'
+            ),
+            models.CheckConstraint(
+                check = ~models.Q(keyer_one = models.F('keyer_two')),
+                name = 'reel_keyers_distinct'
+            ),
+        ]
+        indexes = [
+            # reel assignment queue: open slots, fewest keyers then oldest
+            models.Index(
+                fields = ['keyer_count', 'id'],
+                name = 'reel_open_slot_idx',
+                condition = models.Q(keyer_count__lt = 2) & ~models.Q(reel_name = 'dummy_breaker_reel')
+            ),
         ]
 
 
@@ -196,6 +215,16 @@ class ImageFile(models.Model):
         - smaller_image_file_name: filename of compressed image, which is 
           served by app (depending on when shrinking was done, may be the same 
           as img_file_name)
+        - smaller_image_variant: which encoder wrote the served image, e.g.
+          "jpeg", "progressive" or "webp" (see EntryApp/shrink_images.py);
+          empty if it wasn't recognized
+        - quality_flags: comma-separated problems found by the content
+          checks, e.g. "blank" or "truncated,aspect_ratio" (see
+          EntryApp/image_quality.py); empty if none were found or the reel
+          hasn't been checked
+        - tile_source_name: filename of the Deep Zoom (.dzi) tile pyramid
+          built from the smaller image, in the same folder; empty until the
+          reel has been tiled (see EntryApp/tile_images.py)
         - create_date: timestamp from instance creation, at image loading
         - year: the year of the reel to which this image belongs
 
@@ -213,6 +242,15 @@ class ImageFile(models.Model):
     # name of compressed version
     smaller_image_file_name = models.CharField( max_length = 255, default = "")
 
+    # encoder the compressed version was written with
+    smaller_image_variant = models.CharField( max_length = 20, blank = True, default = "" )
+
+    # problems the image quality checks found, if any
+    quality_flags = models.CharField( max_length = 100, blank = True, default = "", db_index = True )
+
+    # name of the Deep Zoom descriptor, if the image has been tiled
+    tile_source_name = models.CharField( max_length = 255, blank = True, default = "" )
+
     # automatic create and update time stamps.
     create_date = models.DateTimeField( auto_now_add = True )
     last_modified = models.DateTimeField( auto_now = True )
@@ -220,6 +258,12 @@ class ImageFile(models.Model):
     # could keep these... these values will be populated as entry proceeds
     year = models.IntegerField( blank = True, null = True )
 
+    class Meta:
+        indexes = [
+            # walking a reel in order
+            models.Index(fields = ['img_reel', 'img_position'], name = 'imagefile_reel_pos_idx'),
+        ]
+
     def __str__(self):
 
         # return reference
@@ -302,6 +346,23 @@ class ImageFile(models.Model):
 # MODELS FOR DATA ENTRY
 #=====================================================#
 
+class ImageQuerySet(models.QuerySet):
+
+    def with_related_flags(self):
+        '''
+        Annotates each image with has_breaker and has_sheet, using EXISTS
+        subqueries in the same query that fetches the images. Image
+        .has_related_objects() uses these instead of counting.
+        '''
+
+        return self.annotate(
+            has_breaker = models.Exists(Breaker.objects.filter(img = models.OuterRef('pk'))),
+            has_sheet = models.Exists(Sheet.objects.filter(img = models.OuterRef('pk'))),
+        )
+
+#-- END class ImageQuerySet --#
+
+
 class Image(models.Model):
 
     """
@@ -317,7 +378,9 @@ class Image(models.Model):
     Methods:
     - has_related_objects(): helper method that checks for child Breakers or 
     Sheets, to prevent data loss resulting from a keyer changing the Image 
-    type. 
+    type. Fetch images with Image.objects.with_related_flags() and it costs
+    no extra queries, until a Breaker, Sheet or Record for the image is
+    written (see clear_related_flags()).
 
     Attributes:
         Foreign keys:
@@ -378,6 +441,8 @@ class Image(models.Model):
     create_date = models.DateTimeField( auto_now_add = True )
     last_modified = models.DateTimeField( auto_now = True )
 
+    objects = ImageQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -385,6 +450,20 @@ class Image(models.Model):
                 name='unique_img_entry'
             )
         ]
+        indexes = [
+            # a keyer's todo queue: only incomplete images are indexed
+            models.Index(
+                fields = ['jbid', 'image_file'],
+                name = 'image_todo_idx',
+                condition = models.Q(is_complete = False)
+            ),
+            # a keyer's recently completed images
+            models.Index(
+                fields = ['jbid', '-last_modified'],
+                name = 'image_recent_done_idx',
+                condition = models.Q(is_complete = True)
+            ),
+        ]
 
     def __str__(self):
 
@@ -429,10 +508,29 @@ class Image(models.Model):
 
     #-- END overridden built-in __str__() method --#
 
+    def clear_related_flags( self ):
+        '''
+        Drops the has_breaker / has_sheet flags that
+        Image.objects.with_related_flags() annotated this instance with, so
+        the next has_related_objects() looks them up again. Called when a
+        Breaker, Sheet or Record for the image is saved or deleted (see
+        drop_related_flags()).
+        '''
+
+        for flag_name in [ 'has_breaker', 'has_sheet' ]:
+            self.__dict__.pop( flag_name, None )
+
+    #-- END method clear_related_flags() --#
+
     def has_related_objects( self ):
         '''
         Checks for breakers and sheets related to an image. Used to ensure
         foreign keys are preserved during image keying. 
+
+        Uses the has_breaker / has_sheet flags from
+        Image.objects.with_related_flags() if the image was fetched with them
+        and nothing related to it has been written since; otherwise looks
+        both up in one query, every time.
         '''
 
         # return reference
@@ -442,21 +540,22 @@ class Image(models.Model):
         me = "Image.has_related_objects"
         status_message = None
         my_type = None
-        my_breaker_qs = None
-        my_breaker_count = None
-        my_sheet_qs = None
-        my_sheet_count = None
+        flags = None
 
         # get type
         my_type = self.image_type
 
+        # flags not annotated, or dropped by a write since? look them up.
+        if ( hasattr( self, 'has_breaker' ) and hasattr( self, 'has_sheet' ) ):
+            flags = { 'has_breaker': self.has_breaker, 'has_sheet': self.has_sheet }
+        else:
+            flags = Image.objects.with_related_flags().filter( pk = self.pk ).values( 'has_breaker', 'has_sheet' ).get()
+
         # look for all children, regardless of type - log a message if child is
         #     counter to type.
 
         # breakers
-        my_breaker_qs = self.breaker_set.all()
-        my_breaker_count = my_breaker_qs.count()
-        if ( my_breaker_count > 0 ):
+        if ( flags[ 'has_breaker' ] ):
             has_related_OUT = True
             if ( my_type != choices.IMAGE_TYPE_BREAKER ):
                 status_message = "WARNING - there are associated breakers for image of type {image_type} ( image: {me} ).".format(
@@ -468,9 +567,7 @@ class Image(models.Model):
         #-- END check if related breakers --#
 
         # sheets
-        my_sheet_qs = self.sheet_set.all()
-        my_sheet_count = my_sheet_qs.count()
-        if ( my_sheet_count > 0 ):
+        if ( flags[ 'has_sheet' ] ):
             has_related_OUT = True
             if ( my_type != choices.IMAGE_TYPE_SHEET ):
                 status_message = "WARNING - there are associated sheets for image of type {image_type} ( image: {me} ).".format(
@@ -919,6 +1016,12 @@ class Record(models.Model):
     - serial_no_1-serial_no_11: 11 radios for the serial number bubbles
     """
 
+    class Meta:
+        indexes = [
+            # records of a sheet in entry order
+            models.Index(fields = ['sheet', 'line_no', 'col_no'], name = 'record_sheet_order_idx'),
+        ]
+
     # required to uniquely identify the record
     sheet = models.ForeignKey(Sheet, on_delete=models.CASCADE)
     jbid = models.CharField(
@@ -1168,6 +1271,31 @@ class Record(models.Model):
     def __str__(self):
         return f'Record {self.line_no} {self.jbid} on {self.sheet}: {self.last_name, self.first_name}'
 
+
+def drop_related_flags(sender, instance, **kwargs):
+    '''
+    Breaker / Sheet / Record post_save and post_delete receiver: the image
+    they belong to may have different related objects now, so if it was
+    loaded through this instance its with_related_flags() flags are dropped
+    '''
+
+    # a record's image is its sheet's
+    if sender is Record:
+        if not Record.sheet.is_cached(instance):
+            return
+        instance = instance.sheet
+
+    if type(instance).img.is_cached(instance):
+        instance.img.clear_related_flags()
+
+
+post_save.connect(drop_related_flags, sender = Breaker, dispatch_uid = 'related_flags_breaker_save')
+post_delete.connect(drop_related_flags, sender = Breaker, dispatch_uid = 'related_flags_breaker_delete')
+post_save.connect(drop_related_flags, sender = Sheet, dispatch_uid = 'related_flags_sheet_save')
+post_delete.connect(drop_related_flags, sender = Sheet, dispatch_uid = 'related_flags_sheet_delete')
+post_save.connect(drop_related_flags, sender = Record, dispatch_uid = 'related_flags_record_save')
+post_delete.connect(drop_related_flags, sender = Record, dispatch_uid = 'related_flags_record_delete')
+
 #=====================================================#
 # MODELS FOR METADATA AND BACKEND
 #=====================================================#
@@ -1190,6 +1318,12 @@ class CurrentEntry(models.Model):
         images keyers can have within a reel
     '''
 
+    class Meta:
+        constraints = [
+            # one pointer row per keyer; also the index for lookups by jbid
+            models.UniqueConstraint(fields = ['jbid'], name = 'unique_current_entry')
+        ]
+
     jbid = models.CharField(max_length=255, default='jbid000')
     keyer = models.ForeignKey(Keyer, on_delete=models.CASCADE)
 
@@ -1218,6 +1352,142 @@ class CurrentEntry(models.Model):
         return ''
 
 
+class KeyerReelProgress(models.Model):
+
+    '''
+    Denormalized counters of one keyer's progress through one reel, so the
+    landing page doesn't have to count Image rows on every load.
+
+    The counters are kept up to date by EntryApp.progress when an image is
+    marked complete. They can be rebuilt from Image rows at any time with
+    `python manage.py rebuild_reel_progress`.
+
+    - jbid: keyer id, same as Image.jbid
+    - reel: reel foreign key
+    - completed: number of the keyer's images in the reel that are complete
+    - remaining: number that are not
+    - current_position: img_position of the next image to code, or null
+        if the reel is finished
+    '''
+
+    jbid = models.CharField(max_length=255)
+    reel = models.ForeignKey(Reel, on_delete=models.CASCADE)
+
+    # plain integers: a drifted counter shouldn't break a save
+    completed = models.IntegerField(default=0)
+    remaining = models.IntegerField(default=0)
+    current_position = models.IntegerField(blank=True, null=True)
+
+    # tracking; also bumped on every completion, so it doubles as the keyer's
+    # last activity (used to release the warm reel pool of idle keyers)
+    last_modified = models.DateTimeField( auto_now = True )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields = ['jbid', 'reel'],
+                name = 'unique_keyer_reel_progress'
+            )
+        ]
+
+    def __str__(self):
+        return f'KeyerReelProgress: {self.jbid} {self.reel_id} {self.completed} done, {self.remaining} left'
+
+
+class ProvisionedReel(models.Model):
+
+    '''
+    Warm pool of reels: a reel that has already been assigned to a keyer
+    (slot taken, Image rows created) but isn't in their CurrentEntry yet.
+    When the keyer clicks "next reel" the oldest one is claimed, which is
+    just a pointer flip in CurrentEntry.
+
+    Kept filled by `python manage.py fill_reel_pool` (or the run_reel_jobs
+    worker with --fill-pool); reels held for idle keyers are given back.
+    See EntryApp.reel_allocator.
+    '''
+
+    jbid = models.CharField(max_length=255)
+    reel = models.ForeignKey(Reel, on_delete=models.CASCADE)
+    create_date = models.DateTimeField( auto_now_add = True )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields = ['jbid', 'reel'],
+                name = 'unique_provisioned_reel'
+            )
+        ]
+
+    def __str__(self):
+        return f'ProvisionedReel: {self.reel_id} ready for {self.jbid}'
+
+
+class ReelJob(models.Model):
+
+    '''
+    Queue of long-running reel operations (assigning a reel to a keyer,
+    loading or shrinking a reel, removing a reel from a keyer) so they run
+    in `python manage.py run_reel_jobs` instead of in a web request or an
+    interactive shell. See EntryApp.jobs for the handlers.
+
+    - job_type: which operation, see choices.REEL_JOB_TYPE_CHOICES
+    - status: queued -> running -> done or failed; a failed attempt goes
+        back to queued until max_attempts is reached
+    - jbid: keyer the job is for, if any (used by the landing page)
+    - payload: arguments for the handler
+    - result: what the handler returned, e.g. the id of the assigned reel
+    - progress: percent complete, updated by the handler as it goes (this
+        also bumps last_modified, which doubles as a worker heartbeat)
+    - attempts / max_attempts: retry bookkeeping
+    - run_after: a failed job isn't retried before this, so a retry doesn't
+        hit the same passing problem (a locked table, a busy disk) at once
+    - error: traceback of the most recent failure
+    '''
+
+    job_type = models.CharField(max_length=50, choices=choices.REEL_JOB_TYPE_CHOICES)
+    status = models.CharField(
+        max_length = 20,
+        choices = choices.REEL_JOB_STATUS_CHOICES,
+        default = choices.REEL_JOB_QUEUED
+    )
+    jbid = models.CharField(max_length=255, blank=True, null=True)
+
+    payload = models.JSONField(default=dict)
+    result = models.JSONField(default=dict, blank=True)
+
+    progress = models.PositiveSmallIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField( blank = True, null = True )
+    error = models.TextField(blank=True, default='')
+
+    # tracking
+    create_date = models.DateTimeField( auto_now_add = True )
+    last_modified = models.DateTimeField( auto_now = True )
+    started = models.DateTimeField( blank = True, null = True )
+    finished = models.DateTimeField( blank = True, null = True )
+
+    class Meta:
+        indexes = [
+            # the worker's queue
+            models.Index(
+                fields = ['id'],
+                name = 'reeljob_queued_idx',
+                condition = models.Q(status = choices.REEL_JOB_QUEUED)
+            ),
+            # a keyer's latest job, for the landing page
+            models.Index(fields = ['jbid', '-id'], name = 'reeljob_keyer_idx'),
+        ]
+
+    def __str__(self):
+        return f'ReelJob {self.id} {self.job_type} {self.status} ({self.progress}%)'
+
+    @property
+    def is_active(self):
+        return self.status in [choices.REEL_JOB_QUEUED, choices.REEL_JOB_RUNNING]
+
+
 class FormField(models.Model):
     """
     Class to track form x field metadata, i.e. which fields are in which forms
@@ -1226,6 +1496,11 @@ class FormField(models.Model):
     look up which fields to serve the user when they are entering data
     """
 
+    class Meta:
+        indexes = [
+            models.Index(fields = ['year', 'form_type'], name = 'formfield_year_type_idx'),
+        ]
+
     year = models.FloatField()
     form_type = models.CharField(
             max_length=255,
@@ -1235,3 +1510,20 @@ class FormField(models.Model):
 
     def __str__(self):
         return f'FormField {self.year} {self.form_type}: {self.field_name}'
+
+class FormFieldVersion(models.Model):
+    """
+    Single-row table holding a version stamp for the FormField table.
+
+    Every process keeps its own copy of the FormField rows (see
+    EntryApp.form_registry); bumping this version, as load_form_fields()
+    does, tells all of them to reload.
+    """
+
+    version = models.IntegerField(default=0)
+
+    # tracking
+    last_modified = models.DateTimeField( auto_now = True )
+
+    def __str__(self):
+        return f'FormFieldVersion {self.version}'
@@ -0,0 +1,224 @@
+"""
+KEYER REEL PROGRESS COUNTERS
+
+This module keeps the KeyerReelProgress table (one row per keyer per reel)
+in step with Image.is_complete, so the landing page can read how many
+images are done and left without counting Image rows.
+
+- mark_image_complete() is the one place views should mark an image
+  complete: it flips the flag and bumps the counters in one transaction.
+- get_progress() reads a keyer's row, building it from Image rows the
+  first time a keyer is seen in a reel.
+- rebuild_progress() / rebuild_all_progress() recompute counters from Image
+  rows when they drift (see the rebuild_reel_progress management command).
+"""
+
+import logging
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import F
+from django.db.models import Min
+from django.db.models import Q
+from django.utils import timezone
+
+from EntryApp.models import Image
+from EntryApp.models import KeyerReelProgress
+
+#==============================================================================#
+# LOGGER
+#==============================================================================#
+
+logger = logging.getLogger(__name__)
+
+# mark_image_complete() default: leave current_position alone
+POSITION_UNCHANGED = object()
+
+# a landing page load that doesn't move the keyer still marks them active
+# for the warm reel pool, but only writes once the row is this old
+ACTIVITY_BUMP_MINUTES = 15
+
+
+#==============================================================================#
+# COUNTING FROM IMAGE ROWS
+#==============================================================================#
+
+# aggregates that define the counters; shared by the single and bulk rebuild
+PROGRESS_AGGREGATES = {
+    'completed': Count('id', filter = Q(is_complete = True)),
+    'remaining': Count('id', filter = Q(is_complete = False)),
+    'current_position': Min('image_file__img_position', filter = Q(is_complete = False)),
+}
+
+
+def rebuild_progress(jbid, reel):
+    '''
+    Recomputes one keyer's counters for one reel from Image rows
+
+    Takes:
+    - string keyer jbid
+    - reel instance
+    Returns:
+    - saved KeyerReelProgress instance
+    '''
+
+    counts = Image.objects.filter(
+        jbid = jbid,
+        image_file__img_reel = reel
+    ).aggregate(**PROGRESS_AGGREGATES)
+
+    progress_OUT, created = KeyerReelProgress.objects.update_or_create(
+        jbid = jbid,
+        reel = reel,
+        defaults = counts
+    )
+
+    return progress_OUT
+
+
+def rebuild_all_progress(jbid = None, reel_id = None, dry_run = False):
+    '''
+    Recomputes counters for every keyer/reel pair that has Image rows, in
+    one grouped query, and fixes the rows that drifted.
+
+    Takes:
+    - optional jbid and reel id to limit the rebuild
+    - optional boolean: if True, report drift without writing
+    Returns:
+    - tuple: (number of pairs checked, list of (jbid, reel_id) that drifted)
+    '''
+
+    me = 'rebuild_all_progress()'
+    drifted_list_OUT = []
+
+    image_qs = Image.objects.all()
+    if jbid:
+        image_qs = image_qs.filter(jbid = jbid)
+    if reel_id:
+        image_qs = image_qs.filter(image_file__img_reel_id = reel_id)
+
+    # one row per (jbid, reel) with the true counters
+    expected_rows = image_qs.values('jbid', 'image_file__img_reel_id').order_by().annotate(**PROGRESS_AGGREGATES)
+
+    # what the table holds now
+    progress_qs = KeyerReelProgress.objects.all()
+    if jbid:
+        progress_qs = progress_qs.filter(jbid = jbid)
+    if reel_id:
+        progress_qs = progress_qs.filter(reel_id = reel_id)
+    existing = {(p.jbid, p.reel_id): p for p in progress_qs}
+
+    num_checked = 0
+    for row in expected_rows:
+
+        num_checked += 1
+        key = (row['jbid'], row['image_file__img_reel_id'])
+        counts = {name: row[name] for name in PROGRESS_AGGREGATES}
+        current = existing.get(key)
+
+        if current and all(getattr(current, name) == value for name, value in counts.items()):
+            continue
+
+        drifted_list_OUT.append(key)
+        logger.warning(f'{me}: progress for {key} drifted, expected {counts}')
+
+        if not dry_run:
+            KeyerReelProgress.objects.update_or_create(
+                jbid = key[0],
+                reel_id = key[1],
+                defaults = counts
+            )
+
+    return num_checked, drifted_list_OUT
+
+
+#==============================================================================#
+# READ / UPDATE
+#==============================================================================#
+
+def get_progress(jbid, reel):
+    '''
+    Looks up a keyer's counters for a reel, building them if they're missing
+
+    Takes:
+    - string keyer jbid
+    - reel instance
+    Returns:
+    - KeyerReelProgress instance
+    '''
+
+    progress_OUT = KeyerReelProgress.objects.filter(jbid = jbid, reel = reel).first()
+
+    if progress_OUT is None:
+        progress_OUT = rebuild_progress(jbid, reel)
+
+    return progress_OUT
+
+
+def set_current_position(progress, position):
+    '''
+    Records the position of the keyer's next image, only writing if it moved
+    or the row is more than ACTIVITY_BUMP_MINUTES old. last_modified is
+    what reel_allocator.get_active_jbids() reads, so a keyer who only loads
+    the landing page still counts as active.
+    '''
+
+    now = timezone.now()
+
+    if (
+        progress.current_position == position
+        and progress.last_modified >= now - timedelta(minutes = ACTIVITY_BUMP_MINUTES)
+    ):
+        return
+
+    KeyerReelProgress.objects.filter(pk = progress.pk).update(
+        current_position = position,
+        last_modified = now
+    )
+    progress.current_position = position
+    progress.last_modified = now
+
+
+def mark_image_complete(image, current_position = POSITION_UNCHANGED):
+    '''
+    Marks an image complete and updates its keyer's reel counters in the same
+    transaction. Images that were already complete don't count twice.
+
+    Takes:
+    - Image instance (any other pending changes on it are saved too)
+    - optional position of the keyer's next image (None if the reel is done),
+        saved with the counters instead of by a later set_current_position()
+    Returns:
+    - boolean: True if the image wasn't complete before
+    '''
+
+    with transaction.atomic():
+
+        # lock the row so two requests can't both count the same image
+        was_complete = Image.objects.select_for_update().filter(
+            pk = image.pk
+        ).values_list('is_complete', flat = True).first()
+
+        image.is_complete = True
+        image.save()
+
+        if was_complete is True:
+            return False
+
+        # counters only track True/False; a null flag was never "remaining"
+        counter_updates = {
+            'completed': F('completed') + 1,
+            'remaining': F('remaining') - (1 if was_complete is False else 0),
+            'last_modified': timezone.now(),
+        }
+        if current_position is not POSITION_UNCHANGED:
+            counter_updates['current_position'] = current_position
+
+        KeyerReelProgress.objects.filter(
+            jbid = image.jbid,
+            reel_id = image.image_file.img_reel_id
+        ).update(**counter_updates)
+
+    return True
@@ -0,0 +1,602 @@
+"""
+REEL ASSIGNMENT
+
+This module hands reels to keyers. Assigning a reel means putting the keyer
+in one of the reel's two keyer slots and creating one Image row per
+ImageFile in the reel for that keyer.
+
+It is used by the app (views.assign_reel() and the "next reel" button),
+by background jobs (EntryApp.jobs) and from the django shell
+(load_db.assign_reel_to_keyer(), load_db.remove_reel_from_keyer()).
+
+Everything for one assignment happens in a single transaction, and Image
+rows are written with bulk_create in batches of
+settings.REEL_ASSIGN_BATCH_SIZE, so a 10,000 image reel is a handful of
+INSERTs rather than 10,000.
+
+Concurrency: the next reel is popped with SELECT ... FOR UPDATE SKIP LOCKED,
+so concurrent requests don't queue behind each other, and the slot itself is
+claimed with a single conditional UPDATE (slot still empty, fewer than two
+keyers, other slot not this keyer) using an F() increment of keyer_count. If
+the UPDATE matches nothing another request got there first and we move on to
+the next reel. The conditional UPDATE is what keeps slots safe on backends
+that ignore row locks (sqlite); the lock just keeps requests from colliding.
+
+Warm pool: fill_reel_pool() assigns active keyers their next reel(s) ahead
+of time and records them as ProvisionedReels, so the "next reel" button
+only has to flip CurrentEntry to one of them. release_idle_reels() gives
+back reels held for keyers who have stopped working.
+"""
+
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models import Q
+from django.utils import timezone
+
+from datetime import timedelta
+
+from EntryApp.models import CurrentEntry
+from EntryApp.models import Image
+from EntryApp.models import ImageFile
+from EntryApp.models import Keyer
+from EntryApp.models import KeyerReelProgress
+from EntryApp.models import ProvisionedReel
+from EntryApp.models import Reel
+
+#==============================================================================#
+# LOGGER
+#==============================================================================#
+
+logger = logging.getLogger(__name__)
+
+#==============================================================================#
+# CONSTANTS-ish
+#==============================================================================#
+
+# rows per INSERT when creating a keyer's Images; override in settings
+DEFAULT_BATCH_SIZE = 1000
+
+# the 1990 breaker reel is never handed out
+DUMMY_BREAKER_REEL_NAME = 'dummy_breaker_reel'
+
+# how many reels to try before giving up when others keep beating us to them
+MAX_CLAIM_ATTEMPTS = 10
+
+# warm pool defaults; override with REEL_POOL_DEPTH / REEL_POOL_IDLE_HOURS
+DEFAULT_POOL_DEPTH = 1
+DEFAULT_POOL_IDLE_HOURS = 24
+
+# reel slot number -> (field for this slot, field for the other slot)
+SLOT_FIELDS = {
+    1: ('keyer_one', 'keyer_two'),
+    2: ('keyer_two', 'keyer_one'),
+}
+
+
+def get_batch_size(batch_size = None):
+    '''
+    Returns batch_size if given, else settings.REEL_ASSIGN_BATCH_SIZE, else
+    the module default
+    '''
+
+    if batch_size:
+        return batch_size
+
+    return getattr(settings, 'REEL_ASSIGN_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+#==============================================================================#
+# QUERYSETS
+#==============================================================================#
+
+def get_open_reel_qs(keyer):
+    '''
+    Reels this keyer could be given, in assignment order:
+    - reels with 0 or 1 keyer assigned
+    - not the 1990 dummy breaker reel
+    - not already assigned to this keyer
+    - prefer reels with 0 keyers over those with 1, then lower ids (i.e.
+      those loaded earlier) over higher
+
+    Takes:
+    - keyer instance
+    Returns:
+    - Reel queryset
+    '''
+
+    reel_qs = Reel.objects.filter(keyer_count__lt = 2)
+    reel_qs = reel_qs.exclude(reel_name = DUMMY_BREAKER_REEL_NAME)
+    reel_qs = reel_qs.exclude(Q(keyer_one = keyer) | Q(keyer_two = keyer))
+
+    return reel_qs.order_by('keyer_count', 'id')
+
+
+#==============================================================================#
+# ASSIGNMENT
+#==============================================================================#
+
+def create_reel_images(reel, jbid, batch_size = None):
+    '''
+    Creates the keyer's Image rows for every ImageFile in a reel, in batches.
+    Rows that already exist (e.g. a keyer re-assigned a reel whose Images
+    were kept) are left alone.
+
+    Takes:
+    - reel instance
+    - string keyer jbid
+    - optional number of rows per INSERT
+    Returns:
+    - number of ImageFiles in the reel
+    '''
+
+    # only the ids are needed, not whole ImageFile rows
+    image_file_id_list = list(
+        ImageFile.objects.filter(img_reel = reel).values_list('id', flat = True)
+    )
+
+    Image.objects.bulk_create(
+        [
+            Image(
+                image_file_id = image_file_id,
+                jbid = jbid,
+                is_complete = False,
+                year = reel.year,
+                image_type = None,
+                problem = False
+            )
+            for image_file_id in image_file_id_list
+        ],
+        batch_size = get_batch_size(batch_size),
+        ignore_conflicts = True
+    )
+
+    return len(image_file_id_list)
+
+
+def claim_reel_slot(reel_id, keyer, keyer_position):
+    '''
+    Atomically puts a keyer in a reel slot if, and only if, the slot is still
+    empty, the reel has fewer than two keyers and the keyer isn't already in
+    the other slot. One UPDATE, no read-modify-write.
+
+    Takes:
+    - integer reel id
+    - keyer instance
+    - integer 1 or 2 for the slot
+    Returns:
+    - boolean: True if this call got the slot
+    '''
+
+    slot_field, other_field = SLOT_FIELDS[keyer_position]
+
+    reel_qs = Reel.objects.filter(pk = reel_id, keyer_count__lt = 2)
+    reel_qs = reel_qs.filter(**{f'{slot_field}__isnull': True})
+    reel_qs = reel_qs.exclude(**{other_field: keyer})
+
+    num_updated = reel_qs.update(
+        keyer_count = F('keyer_count') + 1,
+        last_modified = timezone.now(),
+        **{slot_field: keyer}
+    )
+
+    return num_updated == 1
+
+
+def fill_reel_slot(reel, keyer, keyer_position = None, batch_size = None):
+    '''
+    Claims a reel slot for a keyer, bumps the keyer's reel count and creates
+    the keyer's Images. Call inside a transaction.
+
+    Takes:
+    - reel instance
+    - keyer instance
+    - optional integer 1 or 2 for the slot; default is the first empty one
+    - optional number of rows per INSERT
+    Returns:
+    - reel instance (refreshed), or None if the slot was taken meanwhile
+    '''
+
+    me = 'fill_reel_slot()'
+
+    if keyer_position is None:
+        keyer_position = 1 if reel.keyer_one_id is None else 2
+
+    if keyer_position not in SLOT_FIELDS:
+        raise ValueError(f'{me}: got wrong number for keyer position {keyer_position}')
+
+    if not claim_reel_slot(reel.id, keyer, keyer_position):
+        logger.info(f'{me}: {keyer.jbid} lost reel {reel.id} slot {keyer_position}')
+        return None
+
+    reel.refresh_from_db(fields = ['keyer_one', 'keyer_two', 'keyer_count', 'last_modified'])
+
+    # also increment keyer reel count
+    Keyer.objects.filter(pk = keyer.pk).update(reel_count = F('reel_count') + 1)
+    keyer.reel_count += 1
+
+    create_reel_images(reel, keyer.jbid, batch_size)
+
+    return reel
+
+
+def assign_reel_to_keyer(reel, keyer, keyer_position, batch_size = None):
+    '''
+    Assigns a specific reel slot to a keyer
+
+    Takes:
+    - reel instance
+    - keyer instance
+    - integer 1 or 2 denoting keyer position
+    - optional number of rows per INSERT
+    Returns:
+    - reel instance
+    Raises:
+    - ValueError if the slot isn't free
+    '''
+
+    me = 'assign_reel_to_keyer()'
+
+    with transaction.atomic():
+
+        locked_reel = Reel.objects.select_for_update().get(pk = reel.pk)
+        reel_OUT = fill_reel_slot(locked_reel, keyer, keyer_position, batch_size)
+
+        if reel_OUT is None:
+            raise ValueError(f'{me}: reel {reel.id} slot {keyer_position} is not free')
+
+    return reel_OUT
+
+
+def assign_next_reel(keyer, batch_size = None):
+    '''
+    Gives a keyer the first reel in the queue (fewest keyers, then lowest
+    id). Reels another request has locked are skipped rather than waited
+    on, and a reel whose slot was claimed under us is passed over for the
+    next one, so two keyers clicking at once never share a slot. If every
+    open reel is locked we wait on the first, and if that one fills while we
+    wait we try again: we only report no reels once none are open.
+
+    Takes:
+    - keyer instance
+    - optional number of rows per INSERT
+    Returns:
+    - assigned reel instance, or None if there are no reels left for this keyer
+    '''
+
+    me = 'assign_next_reel()'
+
+    for attempt in range(MAX_CLAIM_ATTEMPTS):
+
+        with transaction.atomic():
+
+            reel_queue_qs = get_open_reel_qs(keyer)
+            this_reel = reel_queue_qs.select_for_update(skip_locked = True).first()
+
+            # every open reel is locked by another request: wait our turn
+            # rather than tell the keyer we're out of reels
+            if this_reel is None:
+                this_reel = reel_queue_qs.select_for_update().first()
+
+            if this_reel is None:
+                # the reel we waited on filled up meanwhile: only say we're
+                # out of reels if nothing is open any more
+                if reel_queue_qs.exists():
+                    continue
+                return None
+
+            this_reel = fill_reel_slot(this_reel, keyer, batch_size = batch_size)
+
+        if this_reel is not None:
+            return this_reel
+
+    logger.warning(f'{me}: {keyer.jbid} lost the race {MAX_CLAIM_ATTEMPTS} times, giving up')
+    return None
+
+
+#==============================================================================#
+# WHOLE OPERATIONS
+#==============================================================================#
+
+def mark_reel_complete_for_keyer(reel, jbid):
+    '''
+    Marks a reel complete in whichever slot holds the keyer
+
+    Takes:
+    - reel instance
+    - string keyer jbid
+    Returns:
+    - None
+    Raises:
+    - ValueError if the keyer isn't in either slot
+    '''
+
+    me = 'mark_reel_complete_for_keyer()'
+
+    # handle case where first slot is null because we meddled
+    if reel.keyer_one and reel.keyer_one.jbid == jbid:
+        Reel.objects.filter(pk = reel.pk).update(is_complete_keyer_one = True)
+
+    elif reel.keyer_two and reel.keyer_two.jbid == jbid:
+        Reel.objects.filter(pk = reel.pk).update(is_complete_keyer_two = True)
+
+    else:
+        raise ValueError(f'{me}: {jbid} is not assigned to either keyer slot in {reel}')
+
+
+def lock_keyer(jbid):
+    '''
+    Locks the keyer's row until the end of the transaction, so that moves
+    for one keyer happen one at a time: a second click waits for the first,
+    then sees where it left the keyer. Must be called inside
+    transaction.atomic().
+
+    Takes:
+    - string keyer jbid
+    Returns:
+    - keyer instance
+    '''
+
+    return Keyer.objects.select_for_update().get(jbid = jbid)
+
+
+def get_current_entry(jbid):
+    '''
+    Returns the keyer's CurrentEntry, with its reel and that reel's keyers
+    '''
+
+    return CurrentEntry.objects.select_related(
+        'reel__keyer_one',
+        'reel__keyer_two'
+    ).get(jbid = jbid)
+
+
+def move_keyer_to_next_reel(jbid, batch_size = None, from_reel_id = None):
+    '''
+    What the "next reel" button does, in one transaction: marks the keyer's
+    current reel complete, assigns the next reel and points CurrentEntry at
+    it. Either all of it happens or none of it does, so it is safe to retry.
+
+    With from_reel_id (the reel the keyer asked to move on from), nothing
+    changes if the keyer is no longer on that reel: a repeated click or a
+    resubmitted job gets the reel the keyer is on now instead of completing
+    it and moving them on again.
+
+    Takes:
+    - string keyer jbid
+    - optional number of rows per INSERT
+    - optional reel id the keyer is moving on from
+    Returns:
+    - newly assigned reel (or the keyer's current reel, if they already
+      moved off from_reel_id), or None if there are no reels left for this
+      keyer
+    '''
+
+    with transaction.atomic():
+
+        keyer = lock_keyer(jbid)
+        current = get_current_entry(jbid)
+        if from_reel_id is not None and current.reel_id != from_reel_id:
+            return current.reel
+
+        # a reel already provisioned for this keyer is just a pointer flip
+        this_reel = flip_to_provisioned_reel(current)
+        if this_reel:
+            return this_reel
+
+        if current.reel:
+            mark_reel_complete_for_keyer(current.reel, jbid)
+
+        this_reel = assign_next_reel(keyer, batch_size)
+
+        if this_reel:
+            CurrentEntry.objects.filter(pk = current.pk).update(reel = this_reel)
+
+    return this_reel
+
+
+def release_reel_slot(reel, keyer, keyer_position, delete_img = False):
+    '''
+    Takes a keyer off a reel and optionally deletes their Images for it.
+    Safe to run twice: the slot is only cleared (and the counts only go
+    down) if the keyer is still in it.
+
+    Takes:
+    - reel instance
+    - keyer instance
+    - integer 1 or 2 for the slot
+    - optional boolean: True deletes the keyer's Images for the reel
+    Returns:
+    - boolean: True if the slot was cleared by this call
+    '''
+
+    slot_field, other_field = SLOT_FIELDS[keyer_position]
+
+    with transaction.atomic():
+
+        num_updated = Reel.objects.filter(
+            pk = reel.pk,
+            **{slot_field: keyer}
+        ).update(
+            keyer_count = F('keyer_count') - 1,
+            last_modified = timezone.now(),
+            **{slot_field: None}
+        )
+
+        if num_updated:
+            Keyer.objects.filter(pk = keyer.pk).update(reel_count = F('reel_count') - 1)
+
+        if delete_img:
+            Image.objects.filter(jbid = keyer.jbid, image_file__img_reel = reel).delete()
+            KeyerReelProgress.objects.filter(jbid = keyer.jbid, reel = reel).delete()
+
+    return num_updated == 1
+
+
+#==============================================================================#
+# WARM POOL
+#==============================================================================#
+
+def claim_provisioned_reel(jbid, from_reel_id = None):
+    '''
+    Moves a keyer to their oldest provisioned reel, if they have one: marks
+    the current reel complete and flips CurrentEntry, in one transaction.
+    Nothing is changed if the pool is empty, or if from_reel_id is given
+    and the keyer has already moved off it (see move_keyer_to_next_reel()).
+
+    Takes:
+    - string keyer jbid
+    - optional reel id the keyer is moving on from
+    Returns:
+    - the claimed reel (or the keyer's current reel, if they already moved
+      off from_reel_id), or None if nothing was provisioned for this keyer
+    '''
+
+    with transaction.atomic():
+
+        lock_keyer(jbid)
+        current = get_current_entry(jbid)
+        if from_reel_id is not None and current.reel_id != from_reel_id:
+            return current.reel
+
+        return flip_to_provisioned_reel(current)
+
+
+def flip_to_provisioned_reel(current):
+    '''
+    claim_provisioned_reel() once the keyer is locked: marks the current
+    reel complete and points CurrentEntry at the oldest provisioned reel.
+    Must be called inside transaction.atomic().
+
+    Takes:
+    - the keyer's CurrentEntry, from get_current_entry()
+    Returns:
+    - the claimed reel, or None if nothing was provisioned for this keyer
+    '''
+
+    provisioned = ProvisionedReel.objects.select_for_update(skip_locked = True).filter(
+        jbid = current.jbid
+    ).select_related('reel').order_by('id').first()
+
+    if provisioned is None:
+        return None
+
+    if current.reel:
+        mark_reel_complete_for_keyer(current.reel, current.jbid)
+
+    CurrentEntry.objects.filter(pk = current.pk).update(reel = provisioned.reel)
+    provisioned.delete()
+
+    return provisioned.reel
+
+
+def get_active_jbids(idle_hours = None):
+    '''
+    Keyers who have done something in the last idle_hours (a completed
+    image bumps their KeyerReelProgress row, and so does a landing page
+    load, at most every progress.ACTIVITY_BUMP_MINUTES)
+
+    Returns:
+    - set of jbid strings
+    '''
+
+    if idle_hours is None:
+        idle_hours = getattr(settings, 'REEL_POOL_IDLE_HOURS', DEFAULT_POOL_IDLE_HOURS)
+
+    cutoff = timezone.now() - timedelta(hours = idle_hours)
+
+    return set(
+        KeyerReelProgress.objects.filter(
+            last_modified__gte = cutoff
+        ).values_list('jbid', flat = True).distinct()
+    )
+
+
+def fill_reel_pool(depth = None, idle_hours = None, batch_size = None):
+    '''
+    Tops up every active keyer's warm pool to depth provisioned reels
+
+    Takes:
+    - optional pool depth per keyer (default settings.REEL_POOL_DEPTH)
+    - optional hours without activity after which a keyer is idle
+    - optional number of rows per INSERT
+    Returns:
+    - list of ProvisionedReels created
+    '''
+
+    me = 'fill_reel_pool()'
+    provisioned_list_OUT = []
+
+    if depth is None:
+        depth = getattr(settings, 'REEL_POOL_DEPTH', DEFAULT_POOL_DEPTH)
+
+    active_jbid_set = get_active_jbids(idle_hours)
+    # only keyers with a CurrentEntry can be moved on to a provisioned reel
+    keyer_qs = Keyer.objects.filter(
+        jbid__in = active_jbid_set
+    ).filter(
+        jbid__in = CurrentEntry.objects.values('jbid')
+    ).order_by('id')
+
+    for keyer in keyer_qs:
+
+        num_needed = depth - ProvisionedReel.objects.filter(jbid = keyer.jbid).count()
+
+        for i in range(num_needed):
+
+            with transaction.atomic():
+
+                this_reel = assign_next_reel(keyer, batch_size)
+                if this_reel is None:
+                    break
+
+                provisioned_list_OUT.append(
+                    ProvisionedReel.objects.create(jbid = keyer.jbid, reel = this_reel)
+                )
+
+            logger.info(f'{me}: provisioned {this_reel} for {keyer.jbid}')
+
+    return provisioned_list_OUT
+
+
+def release_idle_reels(idle_hours = None):
+    '''
+    Gives back provisioned reels held for keyers who have gone idle: the
+    slot is freed and the unused Images are deleted.
+
+    Takes:
+    - optional hours without activity after which a keyer is idle
+    Returns:
+    - list of (jbid, reel id) released
+    '''
+
+    me = 'release_idle_reels()'
+    released_list_OUT = []
+
+    active_jbid_set = get_active_jbids(idle_hours)
+    idle_qs = ProvisionedReel.objects.exclude(jbid__in = active_jbid_set).select_related('reel')
+
+    for provisioned in idle_qs:
+
+        with transaction.atomic():
+
+            # skip it if the keyer is claiming it right now
+            locked = ProvisionedReel.objects.select_for_update(skip_locked = True).filter(
+                pk = provisioned.pk
+            ).first()
+            if locked is None:
+                continue
+
+            reel = provisioned.reel
+            keyer = Keyer.objects.get(jbid = provisioned.jbid)
+            keyer_position = 1 if reel.keyer_one_id == keyer.id else 2
+
+            release_reel_slot(reel, keyer, keyer_position, delete_img = True)
+            locked.delete()
+
+        released_list_OUT.append((provisioned.jbid, reel.id))
+        logger.info(f'{me}: released {reel} held for idle keyer {provisioned.jbid}')
+
+    return released_list_OUT
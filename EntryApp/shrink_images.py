@@ -5,62 +5,370 @@ REDUCE THE SIZE OF IMAGES TO HELP APP LOAD SPEEDS
 This module is intended for import and use in the prepare_images.py 
 module or alternatively in the Django shell. It contains methods used
  to compress images and save them with a different names.
+
+Shrinking is CPU bound (decode, resize, re-encode), so shrink_images() fans
+the work out over a pool of processes, a chunk of files per task. In fast
+mode the JPEG decoder does the halving itself (Pillow's draft mode), which
+skips building the full-size pixels; `python manage.py benchmark_shrink`
+compares it with the standard path on a sample reel. Images
+whose _smaller copy already exists are skipped, so an interrupted run can
+simply be started again. Errors are collected per file and returned rather
+than stopping the run.
+
+The shrunk copies can be written by any encoder in SHRINK_ENCODERS (baseline
+JPEG by default); `python manage.py report_encoders` compares their size,
+encode time and fidelity on sample reels.
 """
 
 import glob
+import io
 import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
 import pandas as pd
-from PIL import Image, ImageFile
+from PIL import Image, ImageChops, ImageFile, ImageStat
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
-
-def make_new_filepath(image_file_path, suffix = "_smaller"):
+# files handed to a worker process per task: big enough that process
+# overhead doesn't matter, small enough that progress stays smooth and the
+# last few tasks don't leave most workers idle
+SHRINK_CHUNK_SIZE = 25
+
+# how often (in images) to report progress
+SHRINK_PROGRESS_EVERY = 500
+
+# added to a full-size image's name to name its shrunk copy
+SMALLER_SUFFIX = "_smaller"
+
+# encoders for the shrunk copies the app serves: file extension, Pillow
+# format and save options. "jpeg" is the original baseline JPEG. A
+# "progressive" JPEG shows a coarse whole page early in its download and
+# sharpens as the rest arrives; "webp" is smaller for similar legibility
+# (every current browser shows it).
+SHRINK_ENCODERS = {
+    "jpeg": {"extension": ".jpg", "format": "JPEG", "options": {"optimize": True, "quality": 30}},
+    "progressive": {"extension": ".jpg", "format": "JPEG", "options": {"optimize": True, "quality": 30, "progressive": True}},
+    "webp": {"extension": ".webp", "format": "WEBP", "options": {"quality": 40, "method": 4}},
+}
+DEFAULT_SHRINK_ENCODER = "jpeg"
+
+# final resample filters fast mode can use on odd-sized scans, by the name
+# settings and command lines use; "crop" trims the odd pixel instead
+RESAMPLE_FILTERS = {
+    "crop": None,
+    "bilinear": Image.BILINEAR,
+    "bicubic": Image.BICUBIC,
+    "lanczos": Image.LANCZOS,
+}
+
+# extensions a shrunk copy can have, in the order they're preferred when an
+# image has more than one
+SMALL_IMAGE_EXTENSIONS = list(dict.fromkeys(e["extension"] for e in SHRINK_ENCODERS.values()))
+
+
+def make_new_filepath(image_file_path, suffix = SMALLER_SUFFIX, encoder = DEFAULT_SHRINK_ENCODER):
     '''
     Takes the existing image file path and appends suffix
 
     Takes:
-    - string filepath to image file
+    - string filepath (or file name) to image file
     - optional suffix (default is _smaller)
+    - optional encoder name from SHRINK_ENCODERS, for the extension
     Returns:
-    - None
+    - tuple: (new filepath, new file name)
     '''
 
-    out_path = image_file_path.strip(".jpg") + suffix + ".jpg"
+    out_path = os.path.splitext(image_file_path)[0] + suffix + SHRINK_ENCODERS[encoder]["extension"]
     out_name = out_path.split("/")[-1]
 
     return out_path, out_name
 
 
-def shrink_image(image_file_path, out_path):
+def is_small_image_name(name):
+    '''
+    True for a shrunk copy's file name (or path), whatever its encoder
     '''
-    Reduce the size of an image by half and save it with new name
+    return any(name.endswith(SMALLER_SUFFIX + extension) for extension in SMALL_IMAGE_EXTENSIONS)
+
+
+def get_small_image_list(reel_path, encoder = None):
+    '''
+    Returns the shrunk copies in a reel directory, one per image, in order
+
+    Takes:
+    - string of path to reel
+    - optional encoder name: where an image has copies from more than one
+        encoder (a reel re-shrunk in another format), the one to pick.
+        Otherwise the first in SMALL_IMAGE_EXTENSIONS order.
+    Returns:
+    - list of filepaths
+    '''
+
+    preferred_extension = SHRINK_ENCODERS[encoder]["extension"] if encoder else None
+    path_by_stem = {}
+
+    for extension in SMALL_IMAGE_EXTENSIONS:
+        for path in glob.glob(reel_path + "/*" + SMALLER_SUFFIX + extension):
+            stem = path[ : -len(extension)]
+            if stem not in path_by_stem or extension == preferred_extension:
+                path_by_stem[stem] = path
+
+    return sorted(path_by_stem.values())
+
+
+def get_image_variant(image_file_path):
+    '''
+    Works out which encoder in SHRINK_ENCODERS wrote an image, from its
+    header (the pixels aren't decoded)
+
+    Returns:
+    - encoder name, or "" if none matches (e.g. a full-size scan in another
+        format) or the file can't be read
+    '''
+
+    try:
+        with Image.open(image_file_path) as image:
+            image_format = image.format
+            is_progressive = bool(image.info.get("progressive"))
+    except (OSError, SyntaxError):
+        return ""
+
+    for name, encoder in SHRINK_ENCODERS.items():
+        if encoder["format"] == image_format and bool(encoder["options"].get("progressive")) == is_progressive:
+            return name
+
+    return ""
+
+
+def get_mean_difference(image_a, image_b):
+    '''
+    Returns the mean absolute pixel difference (0-255) of two same-sized
+    images, averaged over bands
+    '''
+
+    difference = ImageChops.difference(image_a.convert(image_b.mode), image_b)
+    band_means = ImageStat.Stat(difference).mean
+
+    return sum(band_means) / len(band_means)
+
+
+def make_half_size(image_file_path, fast = False, resample = None):
+    '''
+    Decodes an image at half size
 
     Takes:
     - string filepath to image file
-    - optional suffix (default is _smaller)
+    - optional boolean, True to have the JPEG decoder scale by half as it
+        decodes (draft mode) instead of decoding at full size and resizing
+    - optional Pillow filter for a final resample in fast mode. By default
+        odd-sized scans, which the decoder rounds up, are cropped by the
+        extra pixel instead. Images the decoder can't scale (not JPEG) are
+        resized with this filter, or LANCZOS.
     Returns:
-    - None
+    - PIL Image
+    '''
+
+    with Image.open(image_file_path) as image:
+
+        # cut size in half (LANCZOS is the filter Pillow used to call ANTIALIAS)
+        new_dimensions = (image.size[0] // 2, image.size[1] // 2)
+
+        if fast:
+            # 1/2 scale in the DCT domain during decode; rounds odd sizes up
+            image.draft(image.mode, new_dimensions)
+
+        extra_pixels = (image.size[0] - new_dimensions[0], image.size[1] - new_dimensions[1])
+
+        if extra_pixels == (0, 0):
+            half_size = image.copy()
+        elif fast and resample is None and max(extra_pixels) <= 1 and min(extra_pixels) >= 0:
+            half_size = image.crop((0, 0) + new_dimensions)
+        else:
+            half_size = image.resize(new_dimensions, resample if fast and resample is not None else Image.LANCZOS)
+
+    return half_size
+
+
+def encode_image(image, fp, encoder = DEFAULT_SHRINK_ENCODER):
+    '''
+    Saves an image to a filepath or file object with one of SHRINK_ENCODERS
+    '''
+
+    image.save(fp, format = SHRINK_ENCODERS[encoder]["format"], **SHRINK_ENCODERS[encoder]["options"])
+
+
+def shrink_image(image_file_path, out_path, fast = False, resample = None, encoder = DEFAULT_SHRINK_ENCODER):
+    '''
+    Reduce the size of an image by half and save it with new name. Errors
+    are raised to the caller, which collects them (see shrink_images()).
+
+    Takes:
+    - string filepath to image file
+    - string filepath to save the smaller image to
+    - optional boolean for fast (draft mode) decoding, see make_half_size()
+    - optional Pillow filter for fast mode, see make_half_size()
+    - optional encoder name from SHRINK_ENCODERS (default baseline JPEG)
+    Returns:
+    - None if out_path already existed, otherwise a dict: bytes_in (the
+        full-size image), bytes_out and encode_seconds
     '''
 
     #  # skip this if compressed image already exists
     if os.path.isfile(out_path):
-        return
+        return None
 
-    try:
-        image = Image.open(image_file_path)
+    half_size = make_half_size(image_file_path, fast, resample)
 
-        # cut size in half
-        new_dimensions = (image.size[0] // 2, image.size[1] // 2)
-        half_size = image.resize(new_dimensions, Image.ANTIALIAS)
+    # save with new name; write aside and rename so an interrupted save
+    # never leaves a partial image that looks finished
+    partial_path = out_path + ".partial"
+    start = time.perf_counter()
+    encode_image(half_size, partial_path, encoder)
+    encode_seconds = time.perf_counter() - start
+    os.replace(partial_path, out_path)
+
+    return {
+        "bytes_in": os.path.getsize(image_file_path),
+        "bytes_out": os.path.getsize(out_path),
+        "encode_seconds": encode_seconds,
+    }
 
-        # save with new name
-        half_size.save(out_path, optimize=True, quality=30)
 
-    except Exception as e:
-        print("Exception in shrink_image():", image_file_path, e)
+def shrink_chunk(path_pair_list, fast = False, resample = None, encoder = DEFAULT_SHRINK_ENCODER):
+    '''
+    Worker task: shrinks a chunk of images, one at a time
+
+    Takes:
+    - list of (image filepath, out filepath) tuples
+    - optional boolean for fast (draft mode) shrinking
+    - optional Pillow filter for fast mode, see make_half_size()
+    - optional encoder name from SHRINK_ENCODERS
+    Returns:
+    - list of (image filepath, shrink_image() result, error message or
+        None) tuples
+    '''
+
+    result_list = []
+
+    for image_file_path, out_path in path_pair_list:
+        try:
+            result_list.append((image_file_path, shrink_image(image_file_path, out_path, fast, resample, encoder), None))
+        except Exception as e:
+            result_list.append((image_file_path, False, f"{type(e).__name__}: {e}"))
+
+    return result_list
+
+
+def print_progress(num_done, num_total, seconds):
+    '''
+    Default progress report for shrink_images(): counts and throughput
+    '''
+
+    rate = num_done / seconds if seconds else 0.0
+    seconds_left = (num_total - num_done) / rate if rate else 0.0
+    print(f"\t\t{num_done}/{num_total} images, {rate:.1f} images/s, ~{seconds_left / 60:.0f} min left")
+
+
+def shrink_images(
+    image_file_list,
+    max_workers = None,
+    chunk_size = SHRINK_CHUNK_SIZE,
+    progress = print_progress,
+    progress_every = SHRINK_PROGRESS_EVERY,
+    fast = False,
+    resample = None,
+    encoder = DEFAULT_SHRINK_ENCODER
+):
+    '''
+    Shrinks a list of images across a pool of worker processes. Images
+    whose _smaller copy already exists are skipped up front.
+
+    Takes:
+    - list of image filepaths, from one reel or many
+    - optional number of worker processes (default: one per CPU; 1 runs
+        everything in this process)
+    - optional number of files per task
+    - optional progress callback taking (num done, num total, seconds
+        elapsed), called every progress_every images and at the end; None
+        for no reports. Totals only count images that still needed shrinking.
+    - optional number of images between progress reports
+    - optional boolean for fast (draft mode) shrinking, see shrink_image()
+    - optional Pillow filter for fast mode, see make_half_size()
+    - optional encoder name from SHRINK_ENCODERS
+    Returns:
+    - dict: num_images, num_shrunk, num_skipped, errors (list of
+        "path: message" strings) and seconds, plus bytes_in, bytes_out and
+        encode_seconds summed over the images shrunk
+    '''
+
+    start = time.perf_counter()
+
+    result_OUT = {
+        'num_images': len(image_file_list),
+        'num_shrunk': 0,
+        'num_skipped': 0,
+        'errors': [],
+        'bytes_in': 0,
+        'bytes_out': 0,
+        'encode_seconds': 0.0,
+    }
+
+    # skip finished images before paying to ship them to a worker
+    path_pair_list = []
+    for image_file_path in image_file_list:
+        out_path, out_name = make_new_filepath(image_file_path, encoder = encoder)
+        if os.path.isfile(out_path):
+            result_OUT['num_skipped'] += 1
+        else:
+            path_pair_list.append((image_file_path, out_path))
+
+    num_total = len(path_pair_list)
+    num_done = 0
+    next_report = progress_every
+
+    def collect(chunk_result_list):
+        nonlocal num_done, next_report
+        for image_file_path, shrunk, error in chunk_result_list:
+            if error:
+                result_OUT['errors'].append(f"{image_file_path}: {error}")
+            elif shrunk:
+                result_OUT['num_shrunk'] += 1
+                for key in ['bytes_in', 'bytes_out', 'encode_seconds']:
+                    result_OUT[key] += shrunk[key]
+            else:
+                result_OUT['num_skipped'] += 1
+        num_done += len(chunk_result_list)
+        if progress and num_done >= next_report:
+            progress(num_done, num_total, time.perf_counter() - start)
+            next_report = num_done + progress_every
+
+    chunk_list = [path_pair_list[i : i + chunk_size] for i in range(0, num_total, chunk_size)]
+
+    if max_workers == 1 or len(chunk_list) <= 1:
+
+        for chunk in chunk_list:
+            collect(shrink_chunk(chunk, fast, resample, encoder))
+
+    else:
+
+        with ProcessPoolExecutor(max_workers = max_workers) as executor:
+            chunk_by_future = {executor.submit(shrink_chunk, chunk, fast, resample, encoder): chunk for chunk in chunk_list}
+            for future in as_completed(chunk_by_future):
+                try:
+                    collect(future.result())
+                except Exception as e:
+                    # the worker itself died (e.g. out of memory): blame its chunk
+                    collect([(path, None, f"{type(e).__name__}: {e}") for path, out_path in chunk_by_future[future]])
+
+    result_OUT['seconds'] = time.perf_counter() - start
+    if progress and num_total:
+        progress(num_done, num_total, result_OUT['seconds'])
 
-    return
+    return result_OUT
 
 
 # this code would work if the full size images are loaded in DB already,
@@ -93,48 +401,152 @@ def shrink_image(image_file_path, out_path):
 #             print(e)
 
 
-def shrink_reel_images_before_db(reel_path):
+def get_full_size_image_list(reel_path):
+    '''
+    Returns the full-size images in a reel directory (not the _smaller
+    copies), in order
+    '''
+
+    image_file_list = sorted(glob.glob(reel_path + "/gr*.jpg"))
+
+    return [i for i in image_file_list if not is_small_image_name(i)]
+
+
+def describe_sizes(result):
+    '''
+    One-line size and encode-time report for a shrink_images() result
+    '''
+
+    if not result['num_shrunk']:
+        return "nothing shrunk"
+
+    saved = 1 - result['bytes_out'] / result['bytes_in'] if result['bytes_in'] else 0.0
+
+    return (
+        f"{result['bytes_out'] / 2**20:.1f} MB written from {result['bytes_in'] / 2**20:.1f} MB"
+        f" ({saved:.0%} saved), encoding {1000 * result['encode_seconds'] / result['num_shrunk']:.1f} ms/image"
+    )
+
+
+def compare_encoders(image_file_list, encoder_list = None, fast = False):
+    '''
+    Encodes the same half-size images with several encoders, in memory, to
+    compare what each would cost before choosing one for a reel
+
+    Takes:
+    - list of full-size image filepaths (a sample of a reel is plenty)
+    - optional list of encoder names (default all of SHRINK_ENCODERS)
+    - optional boolean for fast (draft mode) decoding
+    Returns:
+    - dict of encoder name -> dict: num_images, bytes_in (full-size),
+        bytes_out, encode_seconds and mean_difference (mean absolute pixel
+        difference from the unencoded half-size image, 0-255)
+    '''
+
+    encoder_list = encoder_list or list(SHRINK_ENCODERS)
+    report_OUT = {
+        encoder: {'num_images': 0, 'bytes_in': 0, 'bytes_out': 0, 'encode_seconds': 0.0, 'mean_difference': 0.0}
+        for encoder in encoder_list
+    }
+
+    for image_file_path in image_file_list:
+
+        half_size = make_half_size(image_file_path, fast)
+        bytes_in = os.path.getsize(image_file_path)
+
+        for encoder in encoder_list:
+
+            buffer = io.BytesIO()
+            start = time.perf_counter()
+            encode_image(half_size, buffer, encoder)
+            encode_seconds = time.perf_counter() - start
+
+            buffer.seek(0)
+            with Image.open(buffer) as encoded:
+                difference = get_mean_difference(encoded, half_size)
+
+            row = report_OUT[encoder]
+            row['num_images'] += 1
+            row['bytes_in'] += bytes_in
+            row['bytes_out'] += buffer.getbuffer().nbytes
+            row['encode_seconds'] += encode_seconds
+            row['mean_difference'] += difference
+
+    for row in report_OUT.values():
+        if row['num_images']:
+            row['mean_difference'] /= row['num_images']
+
+    return report_OUT
+
+
+def shrink_reel_images_before_db(reel_path, max_workers = None, fast = False, resample = None, encoder = DEFAULT_SHRINK_ENCODER):
     '''
     Method to shrink images in a reel before they are loaded in to DB
 
     Takes: 
     - string of path to reel, e.g. /data/storage/images/1970/this_1970_reel 
-    Returns: None
+    - optional number of worker processes (see shrink_images())
+    - optional boolean for fast (draft mode) shrinking
+    - optional Pillow filter for fast mode, see make_half_size()
+    - optional encoder name from SHRINK_ENCODERS
+    Returns:
+    - dict of counts, sizes and errors from shrink_images()
     '''
 
-    image_file_list = glob.glob(reel_path + "/gr*.jpg")
+    image_file_list = get_full_size_image_list(reel_path)
 
-    # check whether images are already shrunk
-    small_image_list = sorted(glob.glob(reel_path + "/*_smaller.jpg"))
+    # check whether images are already shrunk by this encoder; shrink_images()
+    # only skips copies with its extension, so copies in another format don't count
+    extension = SHRINK_ENCODERS[encoder]["extension"]
+    small_image_list = [p for p in get_small_image_list(reel_path, encoder) if p.endswith(extension)]
  
-    if len(small_image_list) != 0:
+    if image_file_list and len(small_image_list) >= len(image_file_list):
         
-        print(f"\t\t{len(small_image_list)} images in here are already small, doing nothing.")
-        return
+        print(f"\t\t{len(small_image_list)} images in here already have {encoder} copies, nothing to shrink.")
 
-    else:
+    elif image_file_list:
 
-        print(f"\t\tShrinking {len(image_file_list)} files, beginning with {image_file_list[0]}...")
+        print(f"\t\tShrinking {len(image_file_list) - len(small_image_list)} files, beginning with {image_file_list[0]}...")
 
-        for i in image_file_list:
+    result_OUT = shrink_images(image_file_list, max_workers = max_workers, fast = fast, resample = resample, encoder = encoder)
 
-            new_out_path, new_out_name = make_new_filepath(i)
+    print(f"\t\t{encoder}: {describe_sizes(result_OUT)}")
+    for error in result_OUT['errors']:
+        print(f"\t\t{error}")
 
-            try:
-                shrink_image(i, new_out_path)
-            
-            except Exception as e:
-                print(e)
+    return result_OUT
 
 
-def shrink_images_before_db_in_bulk(csv_path):
+def shrink_images_before_db_in_bulk(csv_path, max_workers = None, fast = False, resample = None, encoder = DEFAULT_SHRINK_ENCODER):
     '''
-    Shrink images in bulk from a csv file with the paths
+    Shrink images in bulk from a csv file with the paths. All reels' images
+    go through one pool, so workers don't sit idle waiting for the last few
+    images of one reel before the next reel starts.
 
     Takes:
-    - string path to the csv
-    Returns: None
+    - string path to the csv, reel filepath in the first column (the same
+        file load_db.load_reels_from_csv() reads)
+    - optional number of worker processes (see shrink_images())
+    - optional boolean for fast (draft mode) shrinking
+    - optional Pillow filter for fast mode, see make_half_size()
+    - optional encoder name from SHRINK_ENCODERS
+    Returns:
+    - dict of counts, sizes and errors from shrink_images()
     '''
 
     to_shrink = pd.read_csv(csv_path)
-    to_shrink.apply(lambda x: shrink_reel_images_before_db(x.reel_name), axis=1)
+
+    image_file_list = []
+    for reel_path in to_shrink.iloc[:, 0]:
+        reel_image_list = get_full_size_image_list(reel_path)
+        print(f"\t{reel_path}: {len(reel_image_list)} images")
+        image_file_list.extend(reel_image_list)
+
+    result_OUT = shrink_images(image_file_list, max_workers = max_workers, fast = fast, resample = resample, encoder = encoder)
+
+    print(f"\tShrunk {result_OUT['num_shrunk']}, skipped {result_OUT['num_skipped']}, {len(result_OUT['errors'])} errors in {result_OUT['seconds']:.0f} s")
+    print(f"\t{encoder}: {describe_sizes(result_OUT)}")
+    for error in result_OUT['errors']:
+        print(f"\t\t{error}")
+
+    return result_OUT
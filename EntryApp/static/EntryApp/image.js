@@ -1,14 +1,21 @@
+// imgpath is either the scan itself or, once the reel has been tiled, its
+// Deep Zoom descriptor (.dzi): then the viewer only fetches the tiles on
+// screen instead of downloading and decoding the whole JPEG first
 function initSeaDragon(imgpath, docobj) {
   if(!docobj){
     docobj = document;
   }
+  var tileSources = {
+      type: 'image',
+      url: imgpath
+  };
+  if (/\.dzi$/.test(imgpath)) {
+    tileSources = imgpath;
+  }
   var Viewer = OpenSeadragon({
       id: "openseadragon1",
       prefixUrl: "/static/openseadragon_images/",
-      tileSources: {
-	  type: 'image',
-	  url: imgpath
-      },
+      tileSources: tileSources,
       buildPyramid: false
   });
   Viewer.addHandler('open', function(){
@@ -135,3 +142,167 @@ function initIndexPage(popOutExists) {
     popOutForAllForms();
   }
 }
+
+// Record form on the sheet page: save through the save-record endpoint and
+// swap in the returned row and blank form, so the page (and the viewer) stay
+// put. Falls back to a normal full-page POST only if the request never got
+// a response; once the server has answered, the record may already be saved,
+// so the form is never posted again.
+function initRecordForm() {
+  var container = document.getElementById("record-form");
+  if (!container || !container.dataset.saveUrl || !window.fetch) {
+    return;
+  }
+  container.addEventListener("submit", function(event) {
+    var form = event.target;
+    event.preventDefault();
+    fetch(container.dataset.saveUrl, {
+      method: "POST",
+      body: new FormData(form),
+      credentials: "same-origin"
+    })
+      .then(function(response) {
+        return response.json()
+          .catch(function() {
+            return {};
+          })
+          .then(function(data) {
+            if (!response.ok) {
+              showRecordErrors(container, data, response.status);
+              return;
+            }
+            updateRecordList(data);
+            container.innerHTML = data.record_form_html;
+            syncFormState(container);
+            var firstInput = container.querySelector("input:not([type='hidden']), select");
+            if (firstInput) {
+              firstInput.focus();
+            }
+          })
+          .catch(function(error) {
+            console.log(error);
+          });
+      }, function(error) {
+        // network failure: the server never saw the record
+        console.log(error);
+        form.submit();
+      });
+  });
+}
+
+// a refused save: put back the keyer's form as the server returned it (a
+// 400 carries it, with what they typed) and list what went wrong above it
+function showRecordErrors(container, data, status) {
+  if (data.record_form_html) {
+    container.innerHTML = data.record_form_html;
+    syncFormState(container);
+  }
+  var oldList = container.querySelector("ul.record-errors");
+  if (oldList) {
+    oldList.remove();
+  }
+  var messages = (data.errors && data.errors.length) ? data.errors : ["Record not saved (error " + status + ")."];
+  var list = document.createElement("ul");
+  list.className = "errorlist record-errors";
+  messages.forEach(function(message) {
+    var item = document.createElement("li");
+    item.textContent = message;
+    list.appendChild(item);
+  });
+  container.insertBefore(list, container.firstChild);
+}
+
+function updateRecordList(data) {
+  var list = document.getElementById("recordList");
+  var row = list.querySelector("tr[data-record-id='" + data.record_id + "']");
+  var table = list.querySelector("table");
+  if (row) {
+    row.outerHTML = data.record_row_html;
+  }
+  else if (data.record_list_html || !table) {
+    list.innerHTML = data.record_list_html || "";
+  }
+  else {
+    (table.tBodies[0] || table).insertAdjacentHTML("beforeend", data.record_row_html);
+  }
+  syncFormState(list);
+}
+
+// give forms added to the page the viewer state (and pop out flag) the
+// stateChangeHandler / popOutForAllForms already put on the others
+function syncFormState(element) {
+  var latest = {
+    "x": document.getElementById("latest_state_x"),
+    "y": document.getElementById("latest_state_y"),
+    "zoom": document.getElementById("latest_state_zoom")
+  };
+  var popOutOn = document.querySelector("input[name='popOut']");
+  var forms = element.querySelectorAll("form");
+  for (var i = 0; i < forms.length; i++) {
+    var form = forms[i];
+    for (var state in latest) {
+      if (latest[state] && latest[state].value && latest[state].value != "None" && !form.querySelector("input[name='state_" + state + "']")) {
+        form.appendChild(createElementFromHTML("<input type='hidden' name='state_" + state + "' value='" + latest[state].value + "' />"));
+      }
+    }
+    if (popOutOn && !form.querySelector("input[name='popOut']")) {
+      form.appendChild(createElementFromHTML("<input type='hidden' name='popOut' value='true' />"));
+    }
+  }
+}
+
+// Warm the browser cache with the next images in the keyer's queue, so the
+// next CodeImage page opens its scan from cache instead of waiting on a
+// several-hundred-KB download. Waits for this page to finish loading so the
+// prefetches don't compete with the image on screen.
+function prefetchNextImages(endpoint) {
+  if (!window.fetch) {
+    return;
+  }
+  var start = function() {
+    fetch(endpoint, {credentials: "same-origin"})
+      .then(function(response) {
+        if (!response.ok) {
+          throw new Error("next-images returned " + response.status);
+        }
+        return response.json();
+      })
+      .then(function(data) {
+        data.images.forEach(function(image) {
+          // tiled images open from their descriptor, not the JPEG
+          prefetchImage(image.tile_url || image.url);
+        });
+      })
+      .catch(function(error) {
+        console.log(error);
+      });
+  };
+  if (document.readyState == "complete") {
+    start();
+  }
+  else {
+    window.addEventListener("load", start);
+  }
+}
+
+function prefetchImage(url) {
+  if (document.querySelector("link[rel='prefetch'][href='" + url + "']")) {
+    return;
+  }
+  var link = document.createElement("link");
+  if (link.relList && link.relList.supports && link.relList.supports("prefetch")) {
+    link.rel = "prefetch";
+    if (!/\.dzi$/.test(url)) {
+      link.as = "image";
+    }
+    link.href = url;
+    document.head.appendChild(link);
+  }
+  else if (/\.dzi$/.test(url)) {
+    fetch(url, {credentials: "same-origin"});
+  }
+  else {
+    // no prefetch support (Safari): a detached image still fills the cache
+    new Image().src = url;
+  }
+}
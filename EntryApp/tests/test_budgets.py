@@ -0,0 +1,411 @@
+"""
+QUERY AND LATENCY BUDGETS FOR EVERY VIEW AND ACTION
+
+Each test runs one view (and, for CodeImage and IndexView, one action)
+against a production-sized data set and fails if it runs more queries or
+takes longer than its budget in BUDGETS. On failure the SQL it ran is
+printed, numbered, so the N+1 is easy to spot.
+
+The data set is seeded once for the module (no fixture file): three
+2,000-image reels for one keyer (1970 current reel, 1970 reel still free
+to assign, 1990 long form reel), with the first REEL_DONE images of the
+current reel keyed as a breaker plus sheets of RECORDS_PER_SHEET records.
+
+Runs on whatever database settings point at: sqlite for local runs, or
+postgres when available. Wall-clock budgets are generous, for a laptop on
+sqlite; scale them on slow machines with DCDL_BUDGET_TIME_SCALE, e.g.
+
+    DCDL_BUDGET_TIME_SCALE=3 python manage.py test EntryApp.tests.test_budgets
+"""
+
+import json
+import os
+import time
+
+from http import HTTPStatus
+
+# django imports
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+# EntryApp models
+from EntryApp.models import Breaker
+from EntryApp.models import CurrentEntry
+from EntryApp.models import Image
+from EntryApp.models import LongForm1990
+from EntryApp.models import OtherImage
+from EntryApp.models import Record
+from EntryApp.models import Sheet
+
+# EntryApp modules
+from EntryApp.dashboard import NEXT_IMAGE_PARAM
+from EntryApp.progress import rebuild_progress
+
+import EntryApp.choices as choices
+import EntryApp.form_registry as form_registry
+import EntryApp.load_db as ldb
+import EntryApp.tests.test_utils as utils
+import EntryApp.views as views
+
+#================================#
+# GLOBALS
+#================================#
+
+TEMP_USERNAME = 'jbid321'
+TEMP_PW = 'dcdl1980'
+
+REEL_SIZE = 2000
+REEL_DONE = 200
+RECORDS_PER_SHEET = 10
+
+TIME_SCALE = float(os.environ.get('DCDL_BUDGET_TIME_SCALE', '1'))
+
+# (view, action): (max queries, max milliseconds). Query budgets are what
+# each request runs today; lower them when a change saves a query.
+BUDGETS = {
+    ('index', None): (7, 250),
+    # landing on the index from complete_image, with the next image handed over
+    ('index', NEXT_IMAGE_PARAM): (5, 250),
+    ('index', views.ACTION_LOAD_NEXT_BATCH): (9, 250),
+    ('index', views.ACTION_LOAD_NEXT_REEL): (49, 2000),
+    ('code_image', 'untyped'): (4, 250),
+    ('code_image', 'breaker'): (5, 250),
+    ('code_image', 'sheet'): (6, 250),
+    ('code_image', 'longform'): (5, 250),
+    ('code_image', 'other'): (5, 250),
+    ('code_image', views.ACTION_COMPLETE_IMAGE): (9, 250),
+    ('code_image', views.ACTION_EDIT_RECORD): (6, 250),
+    ('code_image', views.ACTION_UPDATE_BREAKER_TYPE): (8, 250),
+    ('code_image', views.ACTION_UPDATE_IMAGE): (7, 250),
+    ('code_image', views.ACTION_UPDATE_LONGFORM): (9, 250),
+    ('code_image', views.ACTION_UPDATE_OTHER_IMAGE): (13, 250),
+    ('code_image', views.ACTION_UPDATE_RECORD): (11, 250),
+    ('code_image', views.ACTION_UPDATE_SHEET_TYPE): (12, 250),
+    ('save_record', None): (9, 250),
+    # 10 updates, 5 creates; on sqlite each create is its own INSERT
+    ('save_records', None): (12, 250),
+    ('next_images', None): (4, 250),
+    ('report_problem', 'GET'): (6, 250),
+    ('report_problem', 'POST'): (9, 250),
+}
+
+
+#================================#
+# TESTS
+#================================#
+
+class ViewBudgetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        ldb.load_form_fields(settings.FORM_FIELDS_CSV)
+
+        cls.keyer = utils.create_keyer(TEMP_USERNAME, TEMP_PW)
+
+        cls.reel = utils.create_reel('budget_reel_1970', year=1970, num_images=REEL_SIZE)
+        cls.free_reel = utils.create_reel('budget_free_1970', year=1970, num_images=REEL_SIZE)
+        cls.longform_reel = utils.create_reel('budget_reel_1990', year=1990, num_images=REEL_SIZE)
+
+        utils.assign_reel_images(cls.reel, cls.keyer)
+        utils.assign_reel_images(cls.longform_reel, cls.keyer, slot=2)
+
+        image_list = list(
+            Image.objects.filter(image_file__img_reel=cls.reel).order_by('image_file__img_position')
+        )
+        done_list = image_list[:REEL_DONE]
+
+        # a keyed breaker, then sheets with records
+        cls.breaker_image = done_list[0]
+        cls.breaker = Breaker.objects.create(
+            img=cls.breaker_image,
+            jbid=TEMP_USERNAME,
+            year=1970,
+            state='IL',
+            county='Cook',
+            enumeration_district='1'
+        )
+        Image.objects.filter(pk=cls.breaker_image.pk).update(image_type=choices.IMAGE_TYPE_BREAKER)
+
+        sheet_image_list = done_list[1:]
+        Image.objects.filter(pk__in=[i.pk for i in sheet_image_list]).update(image_type=choices.IMAGE_TYPE_SHEET)
+        Sheet.objects.bulk_create([
+            Sheet(img=image, breaker=cls.breaker, jbid=TEMP_USERNAME, year=1970, num_records=RECORDS_PER_SHEET)
+            for image in sheet_image_list
+        ])
+        Record.objects.bulk_create([
+            Record(sheet=sheet, jbid=TEMP_USERNAME, line_no=str(line_no), last_name=f'name{line_no}')
+            for sheet in Sheet.objects.all()
+            for line_no in range(1, RECORDS_PER_SHEET + 1)
+        ])
+        Image.objects.filter(pk__in=[i.pk for i in done_list]).update(is_complete=True)
+
+        cls.sheet_image = sheet_image_list[0]
+        cls.sheet = Sheet.objects.get(img=cls.sheet_image)
+        cls.record = Record.objects.filter(sheet=cls.sheet).order_by('line_no').first()
+
+        # the rest of the reel: one other, the rest not started
+        cls.other_image = image_list[REEL_DONE]
+        Image.objects.filter(pk=cls.other_image.pk).update(image_type=choices.IMAGE_TYPE_OTHER)
+        OtherImage.objects.create(img=cls.other_image, jbid=TEMP_USERNAME, year=1970, description='blank')
+        cls.untyped_image = image_list[REEL_DONE + 1]
+        cls.new_sheet_image = image_list[REEL_DONE + 2]
+
+        cls.longform_image = Image.objects.filter(image_file__img_reel=cls.longform_reel).first()
+        Image.objects.filter(pk=cls.longform_image.pk).update(image_type=choices.IMAGE_TYPE_LONGFORM)
+
+        current = utils.create_current_entry(cls.keyer, cls.reel)
+        CurrentEntry.objects.filter(pk=current.pk).update(breaker=cls.breaker)
+
+        rebuild_progress(TEMP_USERNAME, cls.reel)
+        rebuild_progress(TEMP_USERNAME, cls.longform_reel)
+
+    def setUp(self):
+        form_registry.invalidate()
+        form_registry.get_registry()
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+
+    def assertWithinBudget(self, budget_key, do_request):
+        '''
+        Runs do_request() and checks it against BUDGETS[budget_key],
+        reporting the SQL it ran if it's over
+
+        Returns:
+        - the response
+        '''
+
+        max_queries, max_ms = BUDGETS[budget_key]
+        max_ms = max_ms * TIME_SCALE
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = do_request()
+            elapsed_ms = 1000 * (time.perf_counter() - start)
+
+        sql = '\n'.join(f'{i}. {q["sql"]}' for i, q in enumerate(queries.captured_queries, start=1))
+
+        self.assertLessEqual(
+            len(queries),
+            max_queries,
+            f'{budget_key}: {len(queries)} queries, budget is {max_queries}\n{sql}'
+        )
+        self.assertLessEqual(
+            elapsed_ms,
+            max_ms,
+            f'{budget_key}: {elapsed_ms:.0f} ms, budget is {max_ms:.0f} ms\n{sql}'
+        )
+        self.assertIn(response.status_code, [HTTPStatus.OK, HTTPStatus.FOUND])
+
+        return response
+
+    def code_image(self, image, **data):
+        url = reverse('EntryApp:code_image')
+        params = {views.PARAM_NAME_IMAGE_ID: image.pk, **data}
+        if views.PARAM_NAME_ACTION in data:
+            return lambda: self.client.post(url, params)
+        return lambda: self.client.get(url, params)
+
+    #--------------------------------#
+    # IndexView
+    #--------------------------------#
+
+    def test_index(self):
+        self.assertWithinBudget(('index', None), lambda: self.client.get(reverse('EntryApp:index')))
+
+    def test_index_handed_next_image(self):
+        response = self.code_image(self.sheet_image, action=views.ACTION_COMPLETE_IMAGE)()
+        self.assertIn(NEXT_IMAGE_PARAM, response.url)
+        self.assertWithinBudget(('index', NEXT_IMAGE_PARAM), lambda: self.client.get(response.url))
+
+    def test_index_next_batch(self):
+        self.assertWithinBudget(
+            ('index', views.ACTION_LOAD_NEXT_BATCH),
+            lambda: self.client.post(reverse('EntryApp:index'), {'action': views.ACTION_LOAD_NEXT_BATCH})
+        )
+
+    @override_settings(REEL_ASSIGN_IN_BACKGROUND=False)
+    def test_index_next_reel(self):
+        Image.objects.filter(jbid=TEMP_USERNAME, image_file__img_reel=self.reel).update(is_complete=True)
+        rebuild_progress(TEMP_USERNAME, self.reel)
+
+        response = self.assertWithinBudget(
+            ('index', views.ACTION_LOAD_NEXT_REEL),
+            lambda: self.client.post(reverse('EntryApp:index'), {'action': views.ACTION_LOAD_NEXT_REEL})
+        )
+        self.assertFalse(response.context['out_of_reels'])
+
+    #--------------------------------#
+    # CodeImage GET, per image type
+    #--------------------------------#
+
+    def test_code_image_untyped(self):
+        self.assertWithinBudget(('code_image', 'untyped'), self.code_image(self.untyped_image))
+
+    def test_code_image_breaker(self):
+        self.assertWithinBudget(('code_image', 'breaker'), self.code_image(self.breaker_image))
+
+    def test_code_image_sheet(self):
+        response = self.assertWithinBudget(('code_image', 'sheet'), self.code_image(self.sheet_image))
+        self.assertEqual(len(response.context['record_list']), RECORDS_PER_SHEET)
+
+    def test_code_image_longform(self):
+        self.assertWithinBudget(('code_image', 'longform'), self.code_image(self.longform_image))
+
+    def test_code_image_other(self):
+        self.assertWithinBudget(('code_image', 'other'), self.code_image(self.other_image))
+
+    #--------------------------------#
+    # CodeImage actions
+    #--------------------------------#
+
+    def test_complete_image(self):
+        self.assertWithinBudget(
+            ('code_image', views.ACTION_COMPLETE_IMAGE),
+            self.code_image(self.sheet_image, action=views.ACTION_COMPLETE_IMAGE)
+        )
+
+    def test_edit_record(self):
+        response = self.assertWithinBudget(
+            ('code_image', views.ACTION_EDIT_RECORD),
+            self.code_image(self.sheet_image, action=views.ACTION_EDIT_RECORD, record_id=self.record.pk)
+        )
+        self.assertEqual(response.context['record_instance'], self.record)
+
+    def test_update_breaker(self):
+        data = {
+            'form-TOTAL_FORMS': '1',
+            'form-INITIAL_FORMS': '1',
+            'form-MAX_NUM_FORMS': '1000',
+            'form-0-id': self.breaker.pk,
+            'form-0-county': 'DuPage',
+            'form-0-enumeration_district': '2',
+        }
+        self.assertWithinBudget(
+            ('code_image', views.ACTION_UPDATE_BREAKER_TYPE),
+            self.code_image(
+                self.breaker_image,
+                action=views.ACTION_UPDATE_BREAKER_TYPE,
+                breaker_id=self.breaker.pk,
+                **data
+            )
+        )
+        self.assertEqual(Breaker.objects.get(pk=self.breaker.pk).county, 'DuPage')
+
+    def test_update_image(self):
+        self.assertWithinBudget(
+            ('code_image', views.ACTION_UPDATE_IMAGE),
+            self.code_image(
+                self.untyped_image,
+                action=views.ACTION_UPDATE_IMAGE,
+                year=1970,
+                image_type=choices.IMAGE_TYPE_SHEET
+            )
+        )
+        self.assertEqual(Image.objects.get(pk=self.untyped_image.pk).image_type, choices.IMAGE_TYPE_SHEET)
+
+    def test_update_longform(self):
+        self.assertWithinBudget(
+            ('code_image', views.ACTION_UPDATE_LONGFORM),
+            self.code_image(
+                self.longform_image,
+                action=views.ACTION_UPDATE_LONGFORM,
+                employer='Acme',
+                occupation='clerk'
+            )
+        )
+        self.assertTrue(LongForm1990.objects.filter(img=self.longform_image).exists())
+
+    def test_update_other_image(self):
+        Image.objects.filter(pk=self.untyped_image.pk).update(image_type=choices.IMAGE_TYPE_OTHER)
+        self.assertWithinBudget(
+            ('code_image', views.ACTION_UPDATE_OTHER_IMAGE),
+            self.code_image(self.untyped_image, action=views.ACTION_UPDATE_OTHER_IMAGE, description='blank')
+        )
+        self.assertTrue(OtherImage.objects.filter(img=self.untyped_image).exists())
+
+    def test_update_record(self):
+        self.assertWithinBudget(
+            ('code_image', views.ACTION_UPDATE_RECORD),
+            self.code_image(
+                self.sheet_image,
+                action=views.ACTION_UPDATE_RECORD,
+                sheet_id=self.sheet.pk,
+                line_no='11',
+                last_name='new'
+            )
+        )
+        self.assertEqual(Record.objects.filter(sheet=self.sheet).count(), RECORDS_PER_SHEET + 1)
+
+    def test_update_sheet(self):
+        Image.objects.filter(pk=self.new_sheet_image.pk).update(image_type=choices.IMAGE_TYPE_SHEET)
+        self.assertWithinBudget(
+            ('code_image', views.ACTION_UPDATE_SHEET_TYPE),
+            self.code_image(self.new_sheet_image, action=views.ACTION_UPDATE_SHEET_TYPE, num_records='5')
+        )
+        self.assertTrue(Sheet.objects.filter(img=self.new_sheet_image).exists())
+
+    #--------------------------------#
+    # save_record
+    #--------------------------------#
+
+    def test_save_record(self):
+        response = self.assertWithinBudget(
+            ('save_record', None),
+            lambda: self.client.post(
+                reverse('EntryApp:save_record'),
+                {
+                    'image_id': self.sheet_image.pk,
+                    'sheet_id': self.sheet.pk,
+                    'line_no': '11',
+                    'last_name': 'new'
+                }
+            )
+        )
+        self.assertTrue(Record.objects.filter(pk=response.json()['record_id']).exists())
+
+    def test_save_records(self):
+        bubbles = {f'{bubble}_{i}': '1' for bubble in ['serial_no', 'block'] for i in range(1, 4)}
+        record_rows = [
+            {**bubbles, 'record_id': record.pk, 'line_no': record.line_no, 'last_name': 'upd'}
+            for record in Record.objects.filter(sheet=self.sheet)
+        ] + [
+            {**bubbles, 'line_no': str(line_no), 'last_name': 'new'}
+            for line_no in range(RECORDS_PER_SHEET + 1, RECORDS_PER_SHEET + 6)
+        ]
+        payload = {'image_id': self.sheet_image.pk, 'sheet_id': self.sheet.pk, 'records': record_rows}
+
+        response = self.assertWithinBudget(
+            ('save_records', None),
+            lambda: self.client.post(reverse('EntryApp:save_records'), json.dumps(payload), content_type='application/json')
+        )
+        self.assertEqual(len(response.json()['records']), RECORDS_PER_SHEET + 5)
+
+    def test_next_images(self):
+        response = self.assertWithinBudget(
+            ('next_images', None),
+            lambda: self.client.get(reverse('EntryApp:next_images'), {'image_id': self.sheet_image.pk})
+        )
+        self.assertTrue(response.json()['images'])
+
+    #--------------------------------#
+    # report_problem
+    #--------------------------------#
+
+    def test_report_problem_get(self):
+        self.assertWithinBudget(
+            ('report_problem', 'GET'),
+            lambda: self.client.get(reverse('EntryApp:report_problem'), {'image_id': self.untyped_image.pk})
+        )
+
+    def test_report_problem_post(self):
+        self.assertWithinBudget(
+            ('report_problem', 'POST'),
+            lambda: self.client.post(
+                reverse('EntryApp:report_problem') + f'?image_id={self.untyped_image.pk}',
+                {'image_id': self.untyped_image.pk, 'problem': 'on', 'description': 'smudged'}
+            )
+        )
+        self.assertTrue(Image.objects.get(pk=self.untyped_image.pk).problem)
@@ -0,0 +1,103 @@
+"""
+TESTS FOR THE STREAMING IMAGE PIPELINE (EntryApp.image_pipeline)
+
+Runs prepare_images' pipeline mode over scratch reels: shrink, copy, tile
+and remove, with progress kept in the sqlite manifest so a rerun resumes.
+"""
+
+import contextlib
+import io
+import os
+
+from PIL import Image as PILImage
+
+# django imports
+from django.test import SimpleTestCase
+
+# EntryApp modules
+import EntryApp.image_pipeline as image_pipeline
+import EntryApp.shrink_images as shrink_images
+import EntryApp.tests.test_utils as utils
+
+#================================#
+# TEST CASES
+#================================#
+
+class ImagePipelineTests(utils.TempDirMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dest = os.path.join(self.tmp_dir, 'dest')
+        self.manifest_path = os.path.join(self.tmp_dir, image_pipeline.MANIFEST_NAME)
+
+    def make_reel(self, reel_name, num_images):
+        reel_path = os.path.join(self.tmp_dir, 'src', reel_name)
+        for i in range(1, num_images + 1):
+            utils.write_image(os.path.join(reel_path, f'gr{i:04d}.jpg'), color=i)
+        return reel_path
+
+    def run_pipeline(self, reel_path_list, **options):
+        options = {'dest': self.dest, 'max_workers': 2, 'chunk_size': 2, 'progress': None, **options}
+        return image_pipeline.run_pipeline(reel_path_list, self.manifest_path, **options)
+
+    def get_manifest(self):
+        connection = image_pipeline.open_manifest(self.manifest_path)
+        self.addCleanup(connection.close)
+        return {
+            (os.path.basename(row['reel_path']), row['name']): dict(row)
+            for row in connection.execute('SELECT * FROM image_file')
+        }
+
+    def test_prepares_every_reel(self):
+        ''' Shrunk, copied, tiled and original removed, all recorded '''
+        reel_path_list = [self.make_reel('reel_a', 3), self.make_reel('reel_b', 2)]
+
+        result = self.run_pipeline(reel_path_list, tiles=True)
+
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(
+            [result[stage] for stage in ['num_images', 'shrunk', 'copied', 'tiled', 'removed']],
+            [5, 5, 5, 5, 5]
+        )
+        self.assertEqual(sorted(os.listdir(reel_path_list[0])), [f'gr{i:04d}_smaller.jpg' for i in range(1, 4)])
+        self.assertTrue(os.path.isfile(os.path.join(self.dest, 'reel_b', 'gr0002_smaller.jpg')))
+        self.assertTrue(os.path.isfile(os.path.join(self.dest, 'reel_b', 'gr0002_smaller.dzi')))
+
+        manifest = self.get_manifest()
+        self.assertEqual(len(manifest), 5)
+        for record in manifest.values():
+            self.assertEqual([record[f] for f in ['shrunk', 'copied', 'tiled', 'removed']], [1, 1, 1, 1])
+
+    def test_resumes_from_manifest(self):
+        ''' A rerun only does what's left, without redoing finished stages '''
+        reel_path = self.make_reel('reel_a', 4)
+        self.run_pipeline([reel_path], remove=False)
+
+        # lost copy at the destination, and an original replaced since
+        os.remove(os.path.join(self.dest, 'reel_a', 'gr0001_smaller.jpg'))
+        connection = image_pipeline.open_manifest(self.manifest_path)
+        connection.execute("UPDATE image_file SET copied = 0 WHERE name = 'gr0001.jpg'")
+        connection.commit()
+        connection.close()
+        utils.write_image(os.path.join(reel_path, 'gr0002.jpg'), size=(300, 100), color=9)
+
+        result = self.run_pipeline([reel_path], remove=False)
+
+        self.assertEqual((result['shrunk'], result['copied'], result['errors']), (1, 2, []))
+        with PILImage.open(os.path.join(self.dest, 'reel_a', 'gr0002_smaller.jpg')) as small_image:
+            self.assertEqual(small_image.size, (150, 50))
+
+        result = self.run_pipeline([reel_path], remove=False)
+        self.assertEqual((result['shrunk'], result['copied']), (0, 0))
+
+    def test_picks_up_reels_prepared_the_old_way(self):
+        ''' Originals already shrunk and removed are recorded, then just copied '''
+        reel_path = self.make_reel('reel_a', 2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            shrink_images.shrink_reel_images_before_db(reel_path, max_workers=1)
+        os.remove(os.path.join(reel_path, 'gr0001.jpg'))
+
+        result = self.run_pipeline([reel_path])
+
+        self.assertEqual((result['shrunk'], result['copied'], result['removed']), (0, 2, 1))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.dest, 'reel_a'))), ['gr0001_smaller.jpg', 'gr0002_smaller.jpg'])
@@ -0,0 +1,113 @@
+"""
+TESTS FOR IMAGE QUALITY CHECKS (EntryApp.image_quality)
+
+The checks themselves run on a scratch reel of problem scans; recording
+their flags on ImageFiles, from the diagnostics report or the reel job,
+needs the database.
+"""
+
+import io
+import os
+
+from PIL import Image as PILImage
+
+# django imports
+from django.test import SimpleTestCase
+from django.test import TestCase
+
+# EntryApp models
+from EntryApp.models import ImageFile
+from EntryApp.models import Reel
+
+# EntryApp modules
+import EntryApp.image_quality as image_quality
+import EntryApp.jobs as jobs
+import EntryApp.load_db as ldb
+import EntryApp.tests.test_utils as utils
+import reel_diagnostics
+
+#================================#
+# HELPERS
+#================================#
+
+def make_reel_files(reel_path):
+    ''' A readable page, a black frame, a blank frame, a truncated scan and a wide strip '''
+    utils.write_image(os.path.join(reel_path, 'gr0001_smaller.jpg'), image=PILImage.effect_noise((400, 500), 60))
+    utils.write_image(os.path.join(reel_path, 'gr0002_smaller.jpg'), size=(400, 500), color=5)
+    utils.write_image(os.path.join(reel_path, 'gr0003_smaller.jpg'), size=(400, 500), color=230)
+    buffer = io.BytesIO()
+    PILImage.effect_noise((400, 500), 60).save(buffer, 'JPEG')
+    with open(os.path.join(reel_path, 'gr0004_smaller.jpg'), 'wb') as truncated_file:
+        truncated_file.write(buffer.getvalue()[:len(buffer.getvalue()) // 2])
+    utils.write_image(os.path.join(reel_path, 'gr0005_smaller.jpg'), image=PILImage.effect_noise((1500, 400), 60))
+    return sorted(os.path.join(reel_path, name) for name in os.listdir(reel_path))
+
+#================================#
+# TEST CASES
+#================================#
+
+class ImageQualityTests(utils.TempDirMixin, SimpleTestCase):
+
+    def test_flags_problem_images(self):
+        ''' Thumbnail checks across worker processes find each kind of problem '''
+        path_list = make_reel_files(self.tmp_dir)
+        path_list.append(os.path.join(self.tmp_dir, 'gr0006_smaller.jpg'))
+
+        result_list = image_quality.check_images(path_list, max_workers=2, chunk_size=2)
+
+        self.assertEqual(
+            [(result['flags'], result['error']) for result in result_list],
+            [
+                ([], None),
+                (['black'], None),
+                (['blank'], None),
+                (['truncated'], None),
+                (['aspect_ratio'], None),
+                ([], 'file not found'),
+            ]
+        )
+        # shrink_images' process-wide setting is put back
+        self.assertTrue(image_quality.ImageFile.LOAD_TRUNCATED_IMAGES)
+
+
+class QualityFlagRecordTests(utils.TempDirMixin, TestCase):
+
+    def test_flags_recorded_on_image_files(self):
+        ''' The diagnostics report and the reel job both set ImageFile.quality_flags '''
+        make_reel_files(self.tmp_dir)
+        reel = utils.create_reel('quality_reel', num_images=5)
+        Reel.objects.filter(pk=reel.pk).update(reel_path=self.tmp_dir)
+
+        summary, anomalies = reel_diagnostics.diagnose_reels([self.tmp_dir], workers=1, quality=True, quality_workers=1)
+        csv_path = os.path.join(self.make_tmp_dir(), 'anomalies.csv')
+        anomalies.to_csv(csv_path, index=False)
+
+        self.assertEqual((summary['num_black'][0], summary['num_truncated'][0]), (1, 1))
+        self.assertEqual(ldb.record_quality_report(csv_path), 4)
+        self.assertEqual(
+            list(ImageFile.objects.order_by('img_position').values_list('quality_flags', flat=True)),
+            ['', 'black', 'blank', 'truncated', 'aspect_ratio']
+        )
+
+        # rescanned frame: the job re-checks the reel and clears its flag
+        utils.write_image(os.path.join(self.tmp_dir, 'gr0002_smaller.jpg'), image=PILImage.effect_noise((400, 500), 60))
+        job = jobs.enqueue_check_reel_quality(self.tmp_dir)
+        jobs.run_pending_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual((job.result['num_flagged'], job.result['num_recorded']), (3, 1))
+        self.assertEqual(ImageFile.objects.get(img_position=2).quality_flags, '')
+
+    def test_reel_path_matching(self):
+        ''' A trailing slash still finds the reel; a path with no ImageFiles is logged '''
+        reel = utils.create_reel('quality_reel', num_images=2)
+        Reel.objects.filter(pk=reel.pk).update(reel_path=self.tmp_dir)
+
+        self.assertEqual(ldb.record_reel_quality(self.tmp_dir + '/', {'gr0002_smaller.jpg': 'black'}), 1)
+        self.assertEqual(ImageFile.objects.get(img_position=2).quality_flags, 'black')
+
+        with self.assertLogs('EntryApp.load_db', level='WARNING') as logs:
+            self.assertEqual(ldb.record_reel_quality(self.tmp_dir + '_other', {}), 0)
+            self.assertEqual(ldb.record_reel_tiles(self.tmp_dir + '_other/'), 0)
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn(f'no ImageFiles loaded for {self.tmp_dir}_other', logs.output[1])
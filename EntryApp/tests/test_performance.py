@@ -0,0 +1,1033 @@
+"""
+PERFORMANCE TESTS FOR DCDL DATA ENTRY APPLICATION
+
+These tests pin down how much database work the busiest pages do. Unlike
+test_views.py they don't use the dev fixture: each test case seeds its own
+keyers and reels with the helpers in test_utils.py, so that reel size can
+be varied and query counts checked to be independent of it.
+"""
+
+import io
+import json
+import logging
+import os
+import tempfile
+
+from http import HTTPStatus
+from unittest import mock
+from urllib.parse import parse_qs
+from urllib.parse import urlencode
+from urllib.parse import urlparse
+
+# django imports
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context
+from django.template import Template
+from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+# EntryApp models
+from EntryApp.models import Breaker
+from EntryApp.models import CurrentEntry
+from EntryApp.models import FormField
+from EntryApp.models import Keyer
+from EntryApp.models import Reel
+from EntryApp.models import Image
+from EntryApp.models import KeyerReelProgress
+from EntryApp.models import OtherImage
+from EntryApp.models import Record
+from EntryApp.models import Sheet
+
+# EntryApp modules
+from EntryApp.dashboard import BATCH_SIZE
+from EntryApp.dashboard import NEXT_IMAGE_PARAM
+from EntryApp.dashboard import compute_batch_numbers
+from EntryApp.dashboard import read_next_image
+from EntryApp.dashboard import sign_next_image
+from EntryApp.forms import BreakerFormHelper
+from EntryApp.forms import RecordFormHelper
+from EntryApp.forms import clear_blank_form_html_cache
+from EntryApp.forms import clear_form_class_cache
+from EntryApp.forms import get_blank_form_html
+from EntryApp.forms import get_form_class
+from EntryApp.forms import get_formset_class
+from EntryApp.progress import get_progress
+from EntryApp.progress import mark_image_complete
+from EntryApp.progress import rebuild_progress
+from EntryApp.reel_allocator import assign_next_reel
+from EntryApp.reel_allocator import assign_reel_to_keyer
+from EntryApp.views import adapter
+from EntryApp.views import get_form_fields
+
+import EntryApp.choices as choices
+import EntryApp.form_registry as form_registry
+import EntryApp.load_db as ldb
+import EntryApp.tests.test_utils as utils
+import EntryApp.views as views
+
+#================================#
+# LOGGER
+#================================#
+
+logger = logging.getLogger('EntryApp.test_performance')
+
+#================================#
+# GLOBALS
+#================================#
+
+TEMP_USERNAME = 'jbid321'
+TEMP_PW = 'dcdl1980'
+
+SMALL_REEL_SIZE = 30
+LARGE_REEL_SIZE = 600
+
+# GET of the index page for a keyer who already has a reel:
+#   session + user, CurrentEntry, image counts, next image, recent images,
+#   plus the CurrentEntry pointer update on a keyer's first visit
+INDEX_MAX_QUERIES = 7
+
+# reel assignment: lock reel, save slot, bump keyer, ImageFile ids, then one
+# INSERT per batch. sqlite caps rows per INSERT by its bound-variable limit
+# (~100 Image rows), postgres takes the full batch, so this is a ceiling that
+# still fails loudly if we ever go back to one INSERT per image
+ASSIGN_REEL_SIZE = 2500
+ASSIGN_BATCH_SIZE = 1000
+ASSIGN_MAX_QUERIES = 40
+
+# GET of CodeImage, per image type: session + user, CurrentEntry, the image
+# with its file, reel and related flags, then one query per prefetched
+# relation (sheets add their records)
+CODE_IMAGE_MAX_QUERIES = {
+    'untyped': 4,
+    'breaker': 5,
+    'other': 5,
+    'longform': 5,
+    'new_sheet': 5,
+    'sheet': 6,
+}
+
+
+#================================#
+# BASE CLASS
+#================================#
+
+class SeededTestCase(TestCase):
+
+    reel_size = SMALL_REEL_SIZE
+    num_complete = 0
+    seed_progress = True
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.keyer = utils.create_keyer(TEMP_USERNAME, TEMP_PW)
+        cls.reel = utils.create_reel('seeded_reel', num_images=cls.reel_size)
+        utils.assign_reel_images(cls.reel, cls.keyer)
+        utils.create_current_entry(cls.keyer, cls.reel)
+
+        if cls.num_complete:
+            done_ids = Image.objects.filter(
+                jbid=TEMP_USERNAME
+            ).order_by('image_file__img_position').values_list('id', flat=True)[:cls.num_complete]
+            Image.objects.filter(id__in=list(done_ids)).update(is_complete=True)
+
+        # counters exist after a keyer's first visit to the reel
+        if cls.seed_progress:
+            rebuild_progress(TEMP_USERNAME, cls.reel)
+
+    def get_index(self):
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('EntryApp:index'))
+        return response, ctx
+
+    def assertQueryBudget(self, ctx, max_queries):
+        '''Fails with the captured SQL so regressions are easy to read'''
+        if len(ctx.captured_queries) > max_queries:
+            sql = '\n'.join(q['sql'] for q in ctx.captured_queries)
+            self.fail(f'{len(ctx.captured_queries)} queries > {max_queries}:\n{sql}')
+
+
+#================================#
+# TEST CASES
+#================================#
+
+class IndexQueryCountTests(SeededTestCase):
+
+    num_complete = 7
+
+    def test_index_ok(self):
+        ''' The seeded keyer can load the landing page '''
+        response, ctx = self.get_index()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_index_query_budget(self):
+        ''' Landing page stays within a fixed number of queries '''
+        response, ctx = self.get_index()
+        self.assertQueryBudget(ctx, INDEX_MAX_QUERIES)
+
+    def test_dashboard_values(self):
+        ''' Counts, next image and batch numbers match the seeded reel '''
+        response, ctx = self.get_index()
+        context = response.context
+
+        self.assertEqual(context['todo_image_count'], self.reel_size - self.num_complete)
+        self.assertEqual(context['next_image'].image_file.img_position, self.num_complete + 1)
+        self.assertEqual(context['num_completed'], (self.num_complete + 1) % BATCH_SIZE)
+        self.assertEqual(context['num_images'], BATCH_SIZE)
+
+        current = CurrentEntry.objects.get(jbid=TEMP_USERNAME)
+        self.assertEqual(current.img_id, context['next_image'].id)
+
+
+class LargeReelIndexQueryCountTests(IndexQueryCountTests):
+    ''' Same checks on a much bigger reel: the query count must not grow '''
+
+    reel_size = LARGE_REEL_SIZE
+    num_complete = 260
+
+
+class ReelCompleteIndexTests(SeededTestCase):
+
+    num_complete = SMALL_REEL_SIZE
+
+    def test_next_reel_button(self):
+        ''' Finished reel shows the next reel button and no batch numbers '''
+        response, ctx = self.get_index()
+
+        self.assertIsNone(response.context['next_image'])
+        self.assertIsNone(response.context['num_completed'])
+        self.assertTrue(response.context['make_next_reel_button_appear'])
+        self.assertQueryBudget(ctx, INDEX_MAX_QUERIES)
+
+
+class BatchNumberTests(TestCase):
+
+    def test_even_reel(self):
+        ''' Reel that divides evenly into batches '''
+        self.assertEqual(compute_batch_numbers(3, 50), (3, 22, 25))
+        self.assertEqual(compute_batch_numbers(25, 50), (0, 25, 25))
+
+    def test_short_final_batch(self):
+        ''' Final batch of an uneven reel is shorter '''
+        self.assertEqual(compute_batch_numbers(3, 60), (3, 22, 25))
+        self.assertEqual(compute_batch_numbers(49, 60), (24, 1, 25))
+        self.assertEqual(compute_batch_numbers(52, 60)[2], 11)
+
+
+class LazyLoggingTests(SeededTestCase):
+
+    def test_lazy_skips_disabled_level(self):
+        ''' Callable args are not evaluated when the level is filtered out '''
+        calls = []
+        with self.assertLogs('EntryApp.views', level='INFO'):
+            adapter.lazy(logging.DEBUG, 'never %s', lambda: calls.append(1))
+            adapter.info('something at INFO so assertLogs is satisfied')
+        self.assertEqual(calls, [])
+
+    def test_form_fields_length_logged_lazily(self):
+        ''' get_form_fields() hands the registry length over as a callable '''
+        with mock.patch.object(adapter, 'lazy') as lazy:
+            field_names = get_form_fields(1960, 'breaker')
+
+        length = lazy.call_args.args[2]
+        self.assertTrue(callable(length))
+        self.assertEqual(length(), len(field_names))
+
+    def test_count_off_by_default(self):
+        ''' Queryset counters run no queries unless switched on '''
+        with self.assertNumQueries(0):
+            adapter.count('todo', Image.objects.all())
+
+    @override_settings(LOG_QUERYSET_COUNTS=True)
+    def test_count_uses_count_star(self):
+        ''' When on, a counter is a single COUNT(*) at DEBUG '''
+        with self.assertLogs('EntryApp.views', level='DEBUG') as logs:
+            with CaptureQueriesContext(connection) as ctx:
+                adapter.count('todo', Image.objects.all(), user=TEMP_USERNAME)
+
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('COUNT(*)', ctx.captured_queries[0]['sql'])
+        self.assertIn(f'{TEMP_USERNAME} todo count is {self.reel_size}', logs.output[0])
+
+
+class ProgressCounterTests(SeededTestCase):
+
+    num_complete = 4
+    seed_progress = False
+
+    def get_image(self, position):
+        return Image.objects.select_related('image_file').get(
+            jbid=TEMP_USERNAME,
+            image_file__img_position=position
+        )
+
+    def test_first_read_builds_counters(self):
+        ''' Counters are built from Image rows the first time they're read '''
+        progress = get_progress(TEMP_USERNAME, self.reel)
+        self.assertEqual(progress.completed, self.num_complete)
+        self.assertEqual(progress.remaining, self.reel_size - self.num_complete)
+        self.assertEqual(progress.current_position, self.num_complete + 1)
+
+    def test_mark_complete_counts_once(self):
+        ''' Completing an image bumps the counters, completing it again doesn't '''
+        get_progress(TEMP_USERNAME, self.reel)
+        image = self.get_image(self.num_complete + 1)
+
+        self.assertTrue(mark_image_complete(image))
+        self.assertFalse(mark_image_complete(image))
+
+        progress = KeyerReelProgress.objects.get(jbid=TEMP_USERNAME, reel=self.reel)
+        self.assertEqual(progress.completed, self.num_complete + 1)
+        self.assertEqual(progress.remaining, self.reel_size - self.num_complete - 1)
+
+    def test_index_reads_counters(self):
+        ''' Index shows the counters, not a fresh count of Image rows '''
+        get_progress(TEMP_USERNAME, self.reel)
+        mark_image_complete(self.get_image(self.num_complete + 1), current_position=self.num_complete + 2)
+
+        response, ctx = self.get_index()
+        self.assertEqual(response.context['todo_image_count'], self.reel_size - self.num_complete - 1)
+        self.assertEqual(
+            KeyerReelProgress.objects.get(jbid=TEMP_USERNAME).current_position,
+            self.num_complete + 2
+        )
+        self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+
+    def test_complete_image_action_counts(self):
+        ''' The complete_image button on CodeImage updates the counters '''
+        get_progress(TEMP_USERNAME, self.reel)
+        image = self.get_image(self.num_complete + 1)
+
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+        self.client.post(
+            reverse('EntryApp:code_image'),
+            {'action': 'complete_image', 'image_id': image.id}
+        )
+
+        progress = KeyerReelProgress.objects.get(jbid=TEMP_USERNAME, reel=self.reel)
+        self.assertEqual(progress.completed, self.num_complete + 1)
+
+    def test_rebuild_command_fixes_drift(self):
+        ''' rebuild_reel_progress puts drifted counters back '''
+        get_progress(TEMP_USERNAME, self.reel)
+        KeyerReelProgress.objects.update(completed=0, remaining=1)
+
+        out = io.StringIO()
+        call_command('rebuild_reel_progress', stdout=out)
+
+        progress = KeyerReelProgress.objects.get(jbid=TEMP_USERNAME, reel=self.reel)
+        self.assertEqual(progress.completed, self.num_complete)
+        self.assertIn('fixed 1', out.getvalue())
+
+    def test_index_fixes_drift_past_next_image(self):
+        ''' Images completed outside mark_image_complete() are picked up by the next index load '''
+        get_progress(TEMP_USERNAME, self.reel)
+        Image.objects.filter(
+            jbid=TEMP_USERNAME,
+            image_file__img_position__in=[self.num_complete + 1, self.num_complete + 2]
+        ).update(is_complete=True)
+
+        response, ctx = self.get_index()
+
+        self.assertEqual(response.context['todo_image_count'], self.reel_size - self.num_complete - 2)
+        progress = KeyerReelProgress.objects.get(jbid=TEMP_USERNAME, reel=self.reel)
+        self.assertEqual((progress.completed, progress.current_position), (self.num_complete + 2, self.num_complete + 3))
+
+
+class ExplainHotQueriesTests(SeededTestCase):
+
+    def test_command_runs(self):
+        ''' explain_hot_queries prints a plan for each hot query '''
+        out = io.StringIO()
+        call_command('explain_hot_queries', jbid=TEMP_USERNAME, stdout=out)
+        output = out.getvalue()
+
+        for name in ['current entry', 'next image', 'reel queue', 'form fields']:
+            self.assertIn(f'=== {name}', output)
+        self.assertIn('sequential scan(s) flagged', output)
+
+
+class ReelAssignmentTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.keyer_list = [utils.create_keyer(f'jbid90{i}') for i in range(3)]
+        cls.big_reel = utils.create_reel('big_reel', num_images=ASSIGN_REEL_SIZE)
+
+    def test_bulk_assignment_queries(self):
+        ''' A whole reel is assigned in a few queries, not one per image '''
+        with CaptureQueriesContext(connection) as ctx:
+            reel = assign_next_reel(self.keyer_list[0], batch_size=ASSIGN_BATCH_SIZE)
+
+        self.assertEqual(reel, self.big_reel)
+        self.assertLessEqual(len(ctx.captured_queries), ASSIGN_MAX_QUERIES)
+        self.assertEqual(
+            Image.objects.filter(jbid=self.keyer_list[0].jbid, image_file__img_reel=reel).count(),
+            ASSIGN_REEL_SIZE
+        )
+
+    def test_slots_fill_then_run_out(self):
+        ''' Two keyers share a reel, a third gets nothing, counts add up '''
+        first = assign_next_reel(self.keyer_list[0])
+        second = assign_next_reel(self.keyer_list[1])
+        third = assign_next_reel(self.keyer_list[2])
+
+        self.assertEqual(first, second)
+        self.assertIsNone(third)
+
+        reel = Reel.objects.get(pk=first.pk)
+        self.assertEqual(reel.keyer_count, 2)
+        self.assertEqual(reel.keyer_one, self.keyer_list[0])
+        self.assertEqual(reel.keyer_two, self.keyer_list[1])
+        self.assertEqual(Keyer.objects.get(pk=self.keyer_list[1].pk).reel_count, 1)
+
+    def test_keyer_never_gets_reel_twice(self):
+        ''' A keyer already on a reel isn't given its other slot '''
+        assign_next_reel(self.keyer_list[0])
+        self.assertIsNone(assign_next_reel(self.keyer_list[0]))
+
+    def test_taken_slot_raises(self):
+        ''' Explicit slot assignment refuses an occupied slot '''
+        assign_reel_to_keyer(self.big_reel, self.keyer_list[0], 1)
+        with self.assertRaises(ValueError):
+            assign_reel_to_keyer(self.big_reel, self.keyer_list[1], 1)
+
+class FormFieldRegistryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for field_name in ['reel_num', 'image_num', 'page']:
+            FormField.objects.create(year=1970, form_type='breaker', field_name=field_name)
+        FormField.objects.create(year=1970, form_type='sheet', field_name='page_num')
+
+    def setUp(self):
+        # the registry outlives the test transaction that filled it
+        form_registry.invalidate()
+
+    def test_steady_state_costs_no_queries(self):
+        ''' Once loaded, field lookups don't touch the DB '''
+        self.assertEqual(get_form_fields(1970, 'breaker'), ['reel_num', 'image_num', 'page'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_form_fields(1970, 'sheet'), ['page_num'])
+            self.assertEqual(get_form_fields(1970.0, 'breaker'), ['reel_num', 'image_num', 'page'])
+            self.assertEqual(get_form_fields(1960, 'breaker'), [])
+
+    @override_settings(FORM_FIELD_VERSION_CHECK_SECONDS=0)
+    def test_version_bump_reloads(self):
+        ''' Another process bumping the version stamp makes this one reload '''
+        get_form_fields(1970, 'sheet')
+
+        # a row changed without this process hearing about it
+        FormField.objects.filter(form_type='sheet').update(field_name='sheet_num')
+        with self.assertNumQueries(1):
+            self.assertEqual(get_form_fields(1970, 'sheet'), ['page_num'])
+
+        form_registry.bump_version()
+        form_registry.get_registry()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_form_fields(1970, 'sheet'), ['sheet_num'])
+
+    def test_load_form_fields_bumps_version(self):
+        ''' Reloading the FormField table invalidates every process's copy '''
+        version = form_registry.get_db_version()
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write('year,form_type,field_name\n1970,sheet,line_no\n')
+        try:
+            ldb.load_form_fields(csv_file.name)
+        finally:
+            os.remove(csv_file.name)
+
+        self.assertEqual(form_registry.get_db_version(), version + 1)
+        self.assertEqual(get_form_fields(1970, 'sheet'), ['line_no'])
+        self.assertEqual(get_form_fields(1970, 'breaker'), [])
+
+class FormClassCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for field_name in ['num_records', 'hard_to_read']:
+            FormField.objects.create(year=1970, form_type='sheet', field_name=field_name)
+
+    def setUp(self):
+        form_registry.invalidate()
+        clear_form_class_cache()
+
+    def test_class_built_once(self):
+        ''' The same form class is reused across requests '''
+        SheetForm = get_form_class(Sheet, 1970, 'sheet')
+
+        self.assertIs(get_form_class(Sheet, 1970.0, 'sheet'), SheetForm)
+        self.assertEqual(list(SheetForm.base_fields), ['num_records', 'hard_to_read'])
+
+        BreakerFormSet = get_formset_class(Breaker, 1970, 'breaker', fields=['county'], extra=0)
+        self.assertIs(get_formset_class(Breaker, 1970, 'breaker', fields=['county'], extra=0), BreakerFormSet)
+        self.assertIsNot(get_formset_class(Breaker, 1970, 'breaker', fields=['county'], extra=1), BreakerFormSet)
+
+    def test_new_fields_new_class(self):
+        ''' A FormField reload gets a freshly built class '''
+        SheetForm = get_form_class(Sheet, 1970, 'sheet')
+        FormField.objects.create(year=1970, form_type='sheet', field_name='address_one')
+
+        NewSheetForm = get_form_class(Sheet, 1970, 'sheet')
+        self.assertIsNot(NewSheetForm, SheetForm)
+        self.assertIn('address_one', NewSheetForm.base_fields)
+
+    def test_benchmark_command_runs(self):
+        ''' benchmark_forms reports a row per form '''
+        out = io.StringIO()
+        call_command('benchmark_forms', repeat=2, stdout=out)
+        self.assertIn('1970 sheet', out.getvalue())
+
+class BlankFormHtmlCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        ldb.load_form_fields(settings.FORM_FIELDS_CSV)
+
+    def setUp(self):
+        form_registry.invalidate()
+        clear_form_class_cache()
+        clear_blank_form_html_cache()
+
+    def test_cached_html_matches_template_render(self):
+        ''' The cached HTML is what {% crispy %} renders for a blank form '''
+        template = Template('{% load crispy_forms_tags %}{% crispy form helper %}')
+
+        for year in [1960, 1970, 1980, 1990]:
+            RecordForm = get_form_class(Record, year, 'short')
+            expected = template.render(Context({'form': RecordForm(), 'helper': RecordFormHelper(year=year)}))
+            self.assertHTMLEqual(get_blank_form_html(RecordForm, RecordFormHelper, year), expected)
+
+    def test_rendered_once(self):
+        ''' A second blank form of the same class and layout isn't re-rendered '''
+        RecordForm = get_form_class(Record, 1990, 'short')
+        html = get_blank_form_html(RecordForm, RecordFormHelper, 1990)
+
+        self.assertIs(get_blank_form_html(RecordForm, RecordFormHelper, 1990), html)
+        self.assertIsNot(get_blank_form_html(RecordForm, RecordFormHelper, 1980), html)
+
+    def test_form_tag_helper_refused(self):
+        ''' Layouts with their own <form> tag carry a CSRF token and aren't cached '''
+        BreakerForm = get_form_class(Breaker, 1970, 'breaker')
+        with self.assertRaises(ValueError):
+            get_blank_form_html(BreakerForm, BreakerFormHelper, 1970)
+
+class RelatedFlagsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.keyer = utils.create_keyer(TEMP_USERNAME, TEMP_PW)
+        cls.reel = utils.create_reel('flag_reel', num_images=4)
+        utils.assign_reel_images(cls.reel, cls.keyer)
+
+        cls.breaker_image, cls.sheet_image, cls.blank_image, cls.other = Image.objects.order_by('id')
+        cls.breaker = Breaker.objects.create(img=cls.breaker_image, year=1960)
+        Sheet.objects.create(img=cls.sheet_image, breaker=cls.breaker, year=1960)
+        Image.objects.filter(pk=cls.breaker_image.pk).update(image_type=choices.IMAGE_TYPE_BREAKER)
+        Image.objects.filter(pk=cls.sheet_image.pk).update(image_type=choices.IMAGE_TYPE_SHEET)
+
+    def test_flags_in_one_query(self):
+        ''' Flags for many images come back in the query that fetches them '''
+        with self.assertNumQueries(1):
+            flags = {
+                image.pk: (image.has_breaker, image.has_sheet)
+                for image in Image.objects.with_related_flags()
+            }
+
+        self.assertEqual(flags[self.breaker_image.pk], (True, False))
+        self.assertEqual(flags[self.sheet_image.pk], (False, True))
+        self.assertEqual(flags[self.blank_image.pk], (False, False))
+
+    def test_annotated_image_costs_no_queries(self):
+        ''' has_related_objects() reads the annotated flags '''
+        image = Image.objects.with_related_flags().get(pk=self.sheet_image.pk)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(image.has_related_objects())
+            self.assertTrue(image.has_related_objects())
+
+    def test_plain_image_looks_up_each_time(self):
+        ''' Without annotations, both flags are looked up in one query, and not kept '''
+        image = Image.objects.get(pk=self.blank_image.pk)
+
+        with self.assertNumQueries(1):
+            self.assertFalse(image.has_related_objects())
+
+        Breaker.objects.create(img=self.blank_image, year=1960)
+        self.assertTrue(image.has_related_objects())
+
+    def test_writes_drop_annotated_flags(self):
+        ''' Saving or deleting a Breaker, Sheet or Record for the image drops its flags '''
+        image = Image.objects.with_related_flags().get(pk=self.blank_image.pk)
+        self.assertFalse(image.has_related_objects())
+
+        breaker = Breaker.objects.create(img=image, year=1960)
+        self.assertTrue(image.has_related_objects())
+
+        breaker.delete()
+        self.assertFalse(image.has_related_objects())
+
+        image = Image.objects.with_related_flags().get(pk=self.sheet_image.pk)
+        sheet = Sheet.objects.get(img=image)
+        sheet.img = image
+        Record.objects.create(sheet=sheet, line_no=1, last_name='name1')
+        self.assertFalse(hasattr(image, 'has_sheet'))
+
+class CodeImageQueryCountTests(TestCase):
+    '''
+    CodeImage GETs for each image type run a fixed number of queries: the
+    image and its type's related rows are loaded by get_code_image(), not by
+    lazy lookups in the prepare_* methods and templates.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        ldb.load_form_fields(settings.FORM_FIELDS_CSV)
+
+        cls.keyer = utils.create_keyer(TEMP_USERNAME, TEMP_PW)
+        cls.reel = utils.create_reel('code_reel', year=1970, num_images=6)
+        utils.assign_reel_images(cls.reel, cls.keyer)
+        utils.create_current_entry(cls.keyer, cls.reel)
+
+        image_list = list(Image.objects.order_by('image_file__img_position'))
+        cls.images = dict(zip(['breaker', 'sheet', 'big_sheet', 'other', 'untyped', 'new_sheet'], image_list))
+
+        for name in ['breaker', 'sheet', 'big_sheet', 'new_sheet']:
+            image_type = choices.IMAGE_TYPE_BREAKER if name == 'breaker' else choices.IMAGE_TYPE_SHEET
+            Image.objects.filter(pk=cls.images[name].pk).update(image_type=image_type)
+        Image.objects.filter(pk=cls.images['other'].pk).update(image_type=choices.IMAGE_TYPE_OTHER)
+
+        breaker = Breaker.objects.create(img=cls.images['breaker'], year=1970, enumeration_district='1')
+        for name, num_records in [('sheet', 2), ('big_sheet', 30)]:
+            sheet = Sheet.objects.create(img=cls.images[name], breaker=breaker, year=1970)
+            Record.objects.bulk_create([
+                Record(sheet=sheet, line_no=i, last_name=f'name{i}')
+                for i in range(num_records, 0, -1)
+            ])
+        OtherImage.objects.create(img=cls.images['other'], year=1970, description='blank page')
+
+        cls.longform_reel = utils.create_reel('longform_reel', year=1990, num_images=2)
+        utils.assign_reel_images(cls.longform_reel, cls.keyer, slot=2)
+        cls.images['longform'] = Image.objects.filter(image_file__img_reel=cls.longform_reel).first()
+        Image.objects.filter(pk=cls.images['longform'].pk).update(image_type=choices.IMAGE_TYPE_LONGFORM)
+
+    def setUp(self):
+        form_registry.invalidate()
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+        # warm the FormField registry, as any running app process would have
+        form_registry.get_registry()
+
+    def get_code_image(self, name, **params):
+        return self.client.get(
+            reverse('EntryApp:code_image'),
+            {'image_id': self.images[name].pk, **params}
+        )
+
+    def test_query_budget_per_type(self):
+        ''' Each image type renders within its query budget '''
+        for name, max_queries in CODE_IMAGE_MAX_QUERIES.items():
+            with self.subTest(image=name):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.get_code_image(name)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertLessEqual(len(queries), max_queries, '\n'.join(q['sql'] for q in queries))
+
+    def test_records_ordered_and_constant(self):
+        ''' Records come back in line_no order and don't add queries per record '''
+        with CaptureQueriesContext(connection) as small_queries:
+            self.get_code_image('sheet')
+        with CaptureQueriesContext(connection) as big_queries:
+            response = self.get_code_image('big_sheet')
+
+        self.assertEqual(len(big_queries), len(small_queries))
+        line_no_list = [record.line_no for record in response.context['record_list']]
+        expected = Record.objects.filter(sheet__img=self.images['big_sheet']).order_by('line_no', 'col_no')
+        self.assertEqual(line_no_list, [record.line_no for record in expected])
+
+    def test_edit_record_uses_prefetched_record(self):
+        ''' Editing one of the sheet's records doesn't look it up again '''
+        record = Record.objects.filter(sheet__img=self.images['sheet']).order_by('line_no').first()
+
+        with CaptureQueriesContext(connection) as view_queries:
+            self.get_code_image('sheet')
+        with CaptureQueriesContext(connection) as edit_queries:
+            response = self.get_code_image('sheet', action='edit_record', record_id=record.pk)
+
+        self.assertEqual(response.context['record_instance'], record)
+        self.assertEqual(len(edit_queries), len(view_queries))
+
+
+class SaveRecordTests(TestCase):
+    '''
+    The save-record endpoint stores a record like the update_record action
+    but answers with just the changed row and a blank form, not the page.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        ldb.load_form_fields(settings.FORM_FIELDS_CSV)
+
+        cls.keyer = utils.create_keyer(TEMP_USERNAME, TEMP_PW)
+        cls.reel = utils.create_reel('save_reel', year=1970, num_images=3)
+        utils.assign_reel_images(cls.reel, cls.keyer)
+        utils.create_current_entry(cls.keyer, cls.reel)
+
+        breaker_image, sheet_image, empty_image = Image.objects.order_by('image_file__img_position')
+        Image.objects.filter(pk__in=[sheet_image.pk, empty_image.pk]).update(image_type=choices.IMAGE_TYPE_SHEET)
+
+        breaker = Breaker.objects.create(img=breaker_image, year=1970, enumeration_district='1')
+        cls.sheet = Sheet.objects.create(img=sheet_image, breaker=breaker, year=1970)
+        cls.empty_sheet = Sheet.objects.create(img=empty_image, breaker=breaker, year=1970)
+        Record.objects.bulk_create([
+            Record(sheet=cls.sheet, line_no=i, last_name=f'name{i}')
+            for i in range(1, 31)
+        ])
+
+    def setUp(self):
+        form_registry.invalidate()
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+        form_registry.get_registry()
+
+    def record_data(self, sheet, **data):
+        return {
+            'action': 'update_record',
+            'image_id': sheet.img_id,
+            'sheet_id': sheet.pk,
+            'line_no': '31',
+            'last_name': 'new',
+            **data
+        }
+
+    def test_new_record(self):
+        ''' New record: its row and a blank form come back, not the page '''
+        response = self.client.post(reverse('EntryApp:save_record'), self.record_data(self.sheet))
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        data = response.json()
+        record = Record.objects.get(pk=data['record_id'])
+        self.assertEqual((record.sheet, record.last_name), (self.sheet, 'new'))
+        self.assertIn(f'data-record-id="{record.pk}"', data['record_row_html'])
+        self.assertIn('value="update_record"', data['record_form_html'])
+        self.assertNotIn('name="record_id"', data['record_form_html'])
+        self.assertNotIn('record_list_html', data)
+        self.assertNotIn('openseadragon', response.content.decode())
+
+    def test_update_record(self):
+        ''' Existing record: updated in place, same ID comes back '''
+        record = Record.objects.get(sheet=self.sheet, line_no='5')
+        response = self.client.post(
+            reverse('EntryApp:save_record'),
+            self.record_data(self.sheet, record_id=record.pk, line_no='5', last_name='fixed')
+        )
+
+        self.assertEqual(response.json()['record_id'], record.pk)
+        self.assertEqual(Record.objects.get(pk=record.pk).last_name, 'fixed')
+        self.assertEqual(Record.objects.filter(sheet=self.sheet).count(), 30)
+
+    def test_first_record_sends_list(self):
+        ''' The sheet's first record brings the list table with it '''
+        response = self.client.post(reverse('EntryApp:save_record'), self.record_data(self.empty_sheet))
+
+        data = response.json()
+        self.assertIn('<table', data['record_list_html'])
+        self.assertIn(f'data-record-id="{data["record_id"]}"', data['record_list_html'])
+
+    def test_cheaper_than_full_page(self):
+        ''' Fewer queries and far fewer bytes than the full-page action '''
+        with CaptureQueriesContext(connection) as page_queries:
+            page = self.client.post(reverse('EntryApp:code_image'), self.record_data(self.sheet, line_no='32'))
+        with CaptureQueriesContext(connection) as fragment_queries:
+            fragment = self.client.post(reverse('EntryApp:save_record'), self.record_data(self.sheet, line_no='33'))
+
+        self.assertLess(len(fragment_queries), len(page_queries))
+        self.assertLess(len(fragment.content) * 2, len(page.content))
+
+    def test_bad_requests(self):
+        ''' GET and unknown sheets are refused without saving anything '''
+        response = self.client.get(reverse('EntryApp:save_record'))
+        self.assertEqual(response.status_code, HTTPStatus.METHOD_NOT_ALLOWED)
+
+        response = self.client.post(
+            reverse('EntryApp:save_record'),
+            self.record_data(self.sheet, image_id=self.empty_sheet.img_id)
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertEqual(Record.objects.count(), 30)
+
+    def test_refused_save_returns_filled_form(self):
+        ''' A 400 carries the keyer's form as they filled it in, and the errors '''
+        record = Record.objects.get(sheet=self.sheet, line_no='5')
+
+        with mock.patch.object(views.CodeImage, 'action_update_record', return_value=['could not save']):
+            response = self.client.post(
+                reverse('EntryApp:save_record'),
+                self.record_data(self.sheet, record_id=record.pk, last_name='typed')
+            )
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        data = response.json()
+        self.assertIn('could not save', data['errors'])
+        self.assertIn('value="typed"', data['record_form_html'])
+        self.assertIn(f'name="record_id" value="{record.pk}"', data['record_form_html'])
+
+BUBBLES_1970 = {
+    f'{bubble}_{i}': '1' for bubble, count in [('serial_no', 3), ('block', 3)] for i in range(1, count + 1)
+}
+
+
+class SaveRecordsTests(TestCase):
+    '''
+    The batch record API validates every row with the sheet's record form
+    and saves all of them, or none, in one transaction.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        ldb.load_form_fields(settings.FORM_FIELDS_CSV)
+
+        cls.keyer = utils.create_keyer(TEMP_USERNAME, TEMP_PW)
+        cls.reel = utils.create_reel('batch_reel', year=1970, num_images=2)
+        utils.assign_reel_images(cls.reel, cls.keyer)
+        utils.create_current_entry(cls.keyer, cls.reel)
+
+        breaker_image, sheet_image = Image.objects.order_by('image_file__img_position')
+        Image.objects.filter(pk=sheet_image.pk).update(image_type=choices.IMAGE_TYPE_SHEET)
+        breaker = Breaker.objects.create(img=breaker_image, year=1970, enumeration_district='1')
+        cls.sheet = Sheet.objects.create(img=sheet_image, breaker=breaker, year=1970)
+        cls.record_list = Record.objects.bulk_create([
+            Record(sheet=cls.sheet, line_no=str(i), last_name=f'name{i}')
+            for i in range(1, 26)
+        ])
+        cls.record_list = list(Record.objects.filter(sheet=cls.sheet).order_by('pk'))
+
+    def setUp(self):
+        form_registry.invalidate()
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+        form_registry.get_registry()
+
+    def post_records(self, record_rows, **payload):
+        # the 1970 serial number and block bubbles are required
+        if record_rows is not None:
+            record_rows = [{**BUBBLES_1970, **row} if isinstance(row, dict) else row for row in record_rows]
+        payload = {'image_id': self.sheet.img_id, 'sheet_id': self.sheet.pk, 'records': record_rows, **payload}
+        return self.client.post(reverse('EntryApp:save_records'), json.dumps(payload), content_type='application/json')
+
+    def test_creates_and_updates(self):
+        ''' New rows are created, rows with a record_id update that record '''
+        response = self.post_records([
+            {'line_no': '26', 'last_name': 'new'},
+            {'record_id': self.record_list[0].pk, 'line_no': '1', 'last_name': 'fixed'},
+            {'line_no': '27', 'first_name': 'Ann', 'last_name': 'new'},
+        ])
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        saved = response.json()['records']
+        self.assertEqual([row['index'] for row in saved], [0, 1, 2])
+        self.assertEqual(saved[1]['record_id'], self.record_list[0].pk)
+
+        fixed = Record.objects.get(pk=self.record_list[0].pk)
+        self.assertEqual((fixed.last_name, fixed.jbid, fixed.is_complete), ('fixed', TEMP_USERNAME, True))
+        created = Record.objects.get(pk=saved[2]['record_id'])
+        self.assertEqual((created.sheet, created.first_name, created.line_no), (self.sheet, 'Ann', '27'))
+        self.assertEqual(Record.objects.filter(sheet=self.sheet).count(), 27)
+
+    def test_invalid_row_saves_nothing(self):
+        ''' One bad row: per-row errors come back and no row is written '''
+        other_sheet_record = Record.objects.create(
+            sheet=Sheet.objects.create(img=self.sheet.img, breaker=self.sheet.breaker, year=1970, jbid='jbid654'),
+            line_no='1'
+        )
+        response = self.post_records([
+            {'line_no': '26', 'last_name': 'ok'},
+            {'line_no': '27', 'last_name': 'x', 'favourite_colour': 'blue'},
+            {'record_id': other_sheet_record.pk, 'last_name': 'moved'},
+            'not a row',
+        ])
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        errors = {row['index']: row['errors'] for row in response.json()['errors']}
+        self.assertEqual(sorted(errors), [1, 2, 3])
+        self.assertIn('favourite_colour', errors[1]['__all__'][0])
+        self.assertIn('record_id', errors[2])
+        self.assertEqual(Record.objects.filter(sheet=self.sheet).count(), 25)
+        self.assertEqual(Record.objects.get(pk=other_sheet_record.pk).last_name, None)
+
+    def test_update_queries_independent_of_batch_size(self):
+        ''' Updating 5 or 25 records costs the same number of queries '''
+        def update_rows(record_list):
+            return [{'record_id': r.pk, 'line_no': r.line_no, 'last_name': 'upd'} for r in record_list]
+
+        with CaptureQueriesContext(connection) as small_queries:
+            self.post_records(update_rows(self.record_list[:5]))
+        with CaptureQueriesContext(connection) as big_queries:
+            self.post_records(update_rows(self.record_list))
+
+        self.assertEqual(len(big_queries), len(small_queries))
+        self.assertEqual(Record.objects.filter(sheet=self.sheet, last_name='upd').count(), 25)
+
+    def test_bad_requests(self):
+        ''' Not JSON, no records list, or an unknown sheet are refused '''
+        url = reverse('EntryApp:save_records')
+        self.assertEqual(self.client.get(url).status_code, HTTPStatus.METHOD_NOT_ALLOWED)
+        self.assertEqual(
+            self.client.post(url, 'not json', content_type='application/json').status_code,
+            HTTPStatus.BAD_REQUEST
+        )
+        self.assertEqual(self.post_records(None).status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(self.post_records([], sheet_id=self.sheet.pk + 100).status_code, HTTPStatus.NOT_FOUND)
+
+
+class RedirectActionTests(SeededTestCase):
+
+    num_complete = 7
+
+    def get_image(self, position):
+        return Image.objects.select_related('image_file').get(
+            jbid=TEMP_USERNAME,
+            image_file__img_position=position
+        )
+
+    def complete_image(self, image):
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                reverse('EntryApp:code_image'),
+                {'action': 'complete_image', 'image_id': image.id}
+            )
+        return response, ctx
+
+    def get_index_url(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        return response, ctx
+
+    def test_complete_image_hands_over_next_image(self):
+        ''' complete_image points CurrentEntry at the next image and signs it into the redirect '''
+        image = self.get_image(self.num_complete + 1)
+        next_image = self.get_image(self.num_complete + 2)
+
+        response, ctx = self.complete_image(image)
+
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        token = parse_qs(urlparse(response.url).query)[NEXT_IMAGE_PARAM][0]
+        self.assertEqual(read_next_image(token, TEMP_USERNAME), next_image.id)
+
+        current = CurrentEntry.objects.get(jbid=TEMP_USERNAME)
+        self.assertEqual(current.img_id, next_image.id)
+        self.assertEqual(current.image_file_id, next_image.image_file_id)
+        self.assertEqual(current.batch_position, 1)
+        self.assertEqual(
+            KeyerReelProgress.objects.get(jbid=TEMP_USERNAME).current_position,
+            self.num_complete + 2
+        )
+
+    def test_index_uses_handed_image(self):
+        ''' The index takes the handed-over image without looking it up again '''
+        response, ctx = self.complete_image(self.get_image(self.num_complete + 1))
+
+        handed_response, handed_ctx = self.get_index_url(response.url)
+        plain_response, plain_ctx = self.get_index_url(reverse('EntryApp:index'))
+
+        for index_response in [handed_response, plain_response]:
+            self.assertEqual(
+                index_response.context['next_image'].image_file.img_position,
+                self.num_complete + 2
+            )
+            self.assertEqual(
+                index_response.context['todo_image_count'],
+                self.reel_size - self.num_complete - 1
+            )
+        self.assertLess(len(handed_ctx), len(plain_ctx))
+
+    def test_bad_tokens_are_ignored(self):
+        ''' Tampered, foreign and stale hand-offs fall back to looking the image up '''
+        image = self.get_image(self.num_complete + 1)
+        token = sign_next_image(TEMP_USERNAME, image)
+
+        self.assertEqual(read_next_image(token, TEMP_USERNAME), image.id)
+        self.assertIsNone(read_next_image(token + 'x', TEMP_USERNAME))
+        self.assertIsNone(read_next_image(token, 'jbid999'))
+        self.assertIsNone(read_next_image(None, TEMP_USERNAME))
+
+        # CurrentEntry still points at the first image, which is now done
+        Image.objects.filter(pk=image.pk).update(is_complete=True)
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+        response, ctx = self.get_index_url(
+            '{}?{}'.format(reverse('EntryApp:index'), urlencode({NEXT_IMAGE_PARAM: token}))
+        )
+        self.assertEqual(response.context['next_image'].image_file.img_position, self.num_complete + 2)
+
+    def test_last_image_has_no_hand_off(self):
+        ''' Finishing the reel redirects without a next image '''
+        Image.objects.filter(jbid=TEMP_USERNAME).exclude(
+            image_file__img_position=self.reel_size
+        ).update(is_complete=True)
+        rebuild_progress(TEMP_USERNAME, self.reel)
+
+        response, ctx = self.complete_image(self.get_image(self.reel_size))
+
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertNotIn(NEXT_IMAGE_PARAM, parse_qs(urlparse(response.url).query))
+        self.assertIsNone(self.client.get(response.url).context['next_image'])
+
+
+class NextImagesTests(SeededTestCase):
+
+    num_complete = 7
+
+    def get_next_images(self, **params):
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+        return self.client.get(reverse('EntryApp:next_images'), params)
+
+    def test_lists_queue_in_order(self):
+        ''' The next images come back in reel order with their viewer URLs '''
+        response = self.get_next_images(count=3)
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        image_list = response.json()['images']
+        self.assertEqual(
+            [image['position'] for image in image_list],
+            [self.num_complete + 1, self.num_complete + 2, self.num_complete + 3]
+        )
+
+        image = Image.objects.select_related('image_file__img_reel').get(pk=image_list[0]['image_id'])
+        self.assertEqual(
+            image_list[0]['url'],
+            f'/images/{image.year}/{image.image_file.img_reel.reel_name}/{image.image_file.smaller_image_file_name}'
+        )
+
+    def test_leaves_out_image_on_screen(self):
+        ''' The image being coded isn't prefetched '''
+        on_screen = Image.objects.get(jbid=TEMP_USERNAME, image_file__img_position=self.num_complete + 1)
+
+        response = self.get_next_images(count=2, image_id=on_screen.pk)
+
+        self.assertEqual(
+            [image['position'] for image in response.json()['images']],
+            [self.num_complete + 2, self.num_complete + 3]
+        )
+
+    def test_count_limits(self):
+        ''' Counts are capped, the end of the reel just gives fewer, bad input is refused '''
+        response = self.get_next_images(count=1000)
+        self.assertEqual(len(response.json()['images']), views.MAX_PREFETCH_IMAGE_COUNT)
+
+        Image.objects.filter(jbid=TEMP_USERNAME).exclude(
+            image_file__img_position=self.reel_size
+        ).update(is_complete=True)
+        response = self.get_next_images(count=3)
+        self.assertEqual([image['position'] for image in response.json()['images']], [self.reel_size])
+
+        response = self.get_next_images(count='lots')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_not_cached(self):
+        ''' The queue changes with every image, so the browser mustn't keep the list '''
+        response = self.get_next_images()
+        self.assertIn('no-cache', response['Cache-Control'])
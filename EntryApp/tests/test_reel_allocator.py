@@ -0,0 +1,450 @@
+"""
+TESTS FOR REEL ASSIGNMENT AND BACKGROUND REEL JOBS
+
+The stress tests hammer EntryApp.reel_allocator from many threads at once
+to check that no reel slot is handed out twice, no reel gets more than two
+keyers and no keyer gets both slots of a reel. The job tests run the
+"next reel" button, and loading a reel, through the ReelJob queue.
+
+The stress tests use TransactionTestCase so each thread's transactions really commit
+and can see each other. They run against whatever database the settings
+point at: on postgres they exercise FOR UPDATE SKIP LOCKED for real, on
+sqlite (which has no row locks) they exercise the conditional slot UPDATE,
+and threads retry when sqlite reports the database as locked.
+"""
+
+import contextlib
+import io
+import os
+import threading
+import time
+
+from datetime import timedelta
+from unittest import mock
+
+from django.db import OperationalError
+from django.db import connection
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+import EntryApp.choices as choices
+
+# EntryApp models
+from EntryApp.models import CurrentEntry
+from EntryApp.models import Image
+from EntryApp.models import Keyer
+from EntryApp.models import KeyerReelProgress
+from EntryApp.models import ProvisionedReel
+from EntryApp.models import Reel
+from EntryApp.models import ReelJob
+
+# EntryApp modules
+import EntryApp.reel_allocator as reel_allocator
+
+from EntryApp.jobs import JOB_HANDLERS
+from EntryApp.jobs import enqueue_assign_next_reel
+from EntryApp.jobs import enqueue_load_reel
+from EntryApp.jobs import report_progress
+from EntryApp.jobs import run_pending_jobs
+from EntryApp.progress import rebuild_progress
+from EntryApp.reel_allocator import assign_next_reel
+from EntryApp.reel_allocator import fill_reel_pool
+from EntryApp.reel_allocator import release_idle_reels
+
+import EntryApp.tests.test_utils as utils
+
+#================================#
+# GLOBALS
+#================================#
+
+NUM_REELS = 6
+IMAGES_PER_REEL = 40
+NUM_KEYERS = 2 * NUM_REELS + 3 # a few keyers more than there are slots
+
+TEMP_USERNAME = 'jbid654'
+TEMP_PW = 'dcdl1980'
+
+# sqlite "database is locked" retries
+MAX_RETRIES = 200
+RETRY_SLEEP = 0.01
+
+
+#================================#
+# HELPERS
+#================================#
+
+def assign_with_retry(keyer, results, errors):
+    '''
+    Thread target: assigns a reel to keyer, retrying while sqlite is locked
+    '''
+
+    try:
+        for retry in range(MAX_RETRIES):
+            try:
+                results[keyer.jbid] = assign_next_reel(keyer)
+                return
+            except OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                time.sleep(RETRY_SLEEP)
+
+        errors.append(f'{keyer.jbid}: gave up after {MAX_RETRIES} retries')
+
+    except Exception as e:
+        errors.append(f'{keyer.jbid}: {e!r}')
+
+    finally:
+        connection.close()
+
+
+class AllLockedQuerySet:
+    '''
+    Stands in for the open reel queryset when every open reel is locked and
+    the one waited on fills while we wait: both locking reads come back
+    empty, but reels are still open
+    '''
+
+    def __init__(self, reel_qs):
+        self.reel_qs = reel_qs
+
+    def select_for_update(self, **kwargs):
+        return self.reel_qs.none()
+
+    def exists(self):
+        return self.reel_qs.exists()
+
+
+#================================#
+# TEST CASES
+#================================#
+
+class ReelAllocatorStressTests(TransactionTestCase):
+
+    def setUp(self):
+        self.reel_list = [
+            utils.create_reel(f'stress_reel_{i}', num_images=IMAGES_PER_REEL)
+            for i in range(NUM_REELS)
+        ]
+        self.keyer_list = [utils.create_keyer(f'jbid7{i:02d}') for i in range(NUM_KEYERS)]
+
+    def run_threads(self, keyer_list):
+        results = {}
+        errors = []
+        thread_list = [
+            threading.Thread(target=assign_with_retry, args=(keyer, results, errors))
+            for keyer in keyer_list
+        ]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_assignment(self):
+        ''' Every slot filled exactly once, extra keyers get nothing '''
+        results, errors = self.run_threads(self.keyer_list)
+        self.assertEqual(errors, [])
+
+        assigned = {jbid: reel for jbid, reel in results.items() if reel is not None}
+        self.assertEqual(len(assigned), 2 * NUM_REELS)
+        self.assertEqual(len(results) - len(assigned), NUM_KEYERS - 2 * NUM_REELS)
+
+        for reel in Reel.objects.all():
+            self.assertEqual(reel.keyer_count, 2)
+            self.assertNotEqual(reel.keyer_one_id, reel.keyer_two_id)
+
+            # each keyer on the reel has exactly one Image per ImageFile
+            for keyer_id in [reel.keyer_one_id, reel.keyer_two_id]:
+                jbid = Keyer.objects.get(pk=keyer_id).jbid
+                self.assertEqual(assigned[jbid].id, reel.id)
+                self.assertEqual(
+                    Image.objects.filter(jbid=jbid, image_file__img_reel=reel).count(),
+                    IMAGES_PER_REEL
+                )
+
+        self.assertEqual(Image.objects.count(), 2 * NUM_REELS * IMAGES_PER_REEL)
+
+    def test_same_keyer_twice(self):
+        ''' One keyer clicking in several tabs at once still gets one slot per reel '''
+        keyer = self.keyer_list[0]
+        results, errors = self.run_threads([keyer] * 4)
+        self.assertEqual(errors, [])
+
+        for reel in Reel.objects.filter(keyer_count__gt=0):
+            self.assertEqual(reel.keyer_count, 1)
+            self.assertEqual(keyer.id, reel.keyer_one_id or reel.keyer_two_id)
+
+
+class AssignNextReelTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.keyer = utils.create_keyer(TEMP_USERNAME, TEMP_PW)
+        cls.reel = utils.create_reel('open_reel', num_images=5)
+
+    def test_waited_on_reel_filled(self):
+        ''' Losing the wait on a locked reel retries rather than reporting no reels '''
+        get_open_reel_qs = reel_allocator.get_open_reel_qs
+        qs_list = [AllLockedQuerySet(get_open_reel_qs(self.keyer))]
+
+        def first_call_locked(keyer):
+            return qs_list.pop() if qs_list else get_open_reel_qs(keyer)
+
+        with mock.patch.object(reel_allocator, 'get_open_reel_qs', side_effect=first_call_locked) as patched:
+            this_reel = assign_next_reel(self.keyer)
+
+        self.assertEqual(patched.call_count, 2)
+        self.assertEqual(this_reel, self.reel)
+
+    def test_no_open_reels(self):
+        ''' With nothing open the keyer is told there are no reels '''
+        Reel.objects.update(keyer_count=2)
+        self.assertIsNone(assign_next_reel(self.keyer))
+
+
+class NextReelJobTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.keyer = utils.create_keyer(TEMP_USERNAME, TEMP_PW)
+        cls.done_reel = utils.create_reel('done_reel', num_images=5)
+        cls.next_reel = utils.create_reel('next_reel', num_images=5)
+
+        utils.assign_reel_images(cls.done_reel, cls.keyer)
+        utils.create_current_entry(cls.keyer, cls.done_reel)
+        Image.objects.filter(jbid=TEMP_USERNAME).update(is_complete=True)
+
+    def post_next_reel(self, reel_id=''):
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+        return self.client.post(reverse('EntryApp:index'), {'action': 'load_next_reel', 'reel_id': reel_id})
+
+    @override_settings(REEL_ASSIGN_IN_BACKGROUND=True)
+    def test_button_queues_job(self):
+        ''' Next reel button queues a job and shows the preparing state '''
+        response = self.post_next_reel()
+
+        self.assertTrue(response.context['preparing_reel'])
+        self.assertEqual(ReelJob.objects.filter(jbid=TEMP_USERNAME).count(), 1)
+        self.assertEqual(CurrentEntry.objects.get(jbid=TEMP_USERNAME).reel, self.done_reel)
+
+        # reloading while queued doesn't queue a second job
+        response = self.client.get(reverse('EntryApp:index'))
+        self.assertTrue(response.context['preparing_reel'])
+        self.assertEqual(ReelJob.objects.filter(jbid=TEMP_USERNAME).count(), 1)
+
+        run_pending_jobs()
+
+        job = ReelJob.objects.get(jbid=TEMP_USERNAME)
+        self.assertEqual(job.status, choices.REEL_JOB_DONE)
+        self.assertEqual(job.result, {'reel_id': self.next_reel.id})
+        self.assertEqual(CurrentEntry.objects.get(jbid=TEMP_USERNAME).reel, self.next_reel)
+        self.assertTrue(Reel.objects.get(pk=self.done_reel.pk).is_complete_keyer_one)
+
+        # and the landing page now offers the new reel
+        response = self.client.get(reverse('EntryApp:index'))
+        self.assertEqual(response.context['next_image'].image_file.img_reel, self.next_reel)
+
+    @override_settings(REEL_ASSIGN_IN_BACKGROUND=True)
+    def test_resubmit_after_job_done(self):
+        ''' Posting the same form again once its job ran doesn't move the keyer on again '''
+        self.post_next_reel(self.done_reel.id)
+        run_pending_jobs()
+
+        response = self.post_next_reel(self.done_reel.id)
+        run_pending_jobs()
+
+        self.assertFalse(response.context.get('preparing_reel'))
+        self.assertFalse(response.context['out_of_reels'])
+        self.assertEqual(ReelJob.objects.filter(jbid=TEMP_USERNAME).count(), 1)
+
+        # queueing it again gets the finished job back
+        job = ReelJob.objects.get(jbid=TEMP_USERNAME)
+        self.assertEqual(enqueue_assign_next_reel(TEMP_USERNAME, self.done_reel.id), job)
+        self.assertEqual(CurrentEntry.objects.get(jbid=TEMP_USERNAME).reel, self.next_reel)
+        self.assertFalse(Reel.objects.get(pk=self.next_reel.pk).is_complete_keyer_one)
+
+    @override_settings(REEL_ASSIGN_IN_BACKGROUND=False)
+    def test_button_inline(self):
+        ''' With background jobs off the reel is assigned in the request '''
+        response = self.post_next_reel()
+
+        self.assertFalse(response.context['out_of_reels'])
+        self.assertEqual(CurrentEntry.objects.get(jbid=TEMP_USERNAME).reel, self.next_reel)
+        self.assertFalse(ReelJob.objects.exists())
+
+        # the same form posted again leaves the keyer on the new reel
+        self.post_next_reel(self.done_reel.id)
+        self.assertEqual(CurrentEntry.objects.get(jbid=TEMP_USERNAME).reel, self.next_reel)
+        self.assertFalse(Reel.objects.get(pk=self.next_reel.pk).is_complete_keyer_one)
+
+    def test_job_for_old_reel_does_nothing(self):
+        ''' A job queued from a reel the keyer has since left changes nothing '''
+        job = ReelJob.objects.create(
+            job_type=choices.REEL_JOB_ASSIGN_NEXT_REEL,
+            jbid=TEMP_USERNAME,
+            payload={'jbid': TEMP_USERNAME, 'from_reel_id': self.next_reel.id}
+        )
+        run_pending_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.result, {'reel_id': self.done_reel.id})
+        self.assertEqual(CurrentEntry.objects.get(jbid=TEMP_USERNAME).reel, self.done_reel)
+        self.assertFalse(Reel.objects.get(pk=self.done_reel.pk).is_complete_keyer_one)
+        self.assertEqual(Keyer.objects.get(jbid=TEMP_USERNAME).reel_count, 0)
+
+    def test_rerun_is_idempotent(self):
+        ''' A job that already assigned its reel doesn't assign another '''
+        job = enqueue_assign_next_reel(TEMP_USERNAME, self.done_reel.id)
+        run_pending_jobs()
+
+        # pretend the worker died after committing but before marking done
+        ReelJob.objects.filter(pk=job.pk).update(status=choices.REEL_JOB_QUEUED)
+        run_pending_jobs()
+
+        self.assertEqual(Keyer.objects.get(jbid=TEMP_USERNAME).reel_count, 1)
+        self.assertEqual(CurrentEntry.objects.get(jbid=TEMP_USERNAME).reel, self.next_reel)
+
+    def test_failures_retry_then_fail(self):
+        ''' A failing job is retried after a delay up to max_attempts, then marked failed '''
+        job = enqueue_assign_next_reel(TEMP_USERNAME, self.done_reel.id)
+
+        def broken_handler(job):
+            raise RuntimeError('boom')
+
+        original = JOB_HANDLERS[choices.REEL_JOB_ASSIGN_NEXT_REEL]
+        JOB_HANDLERS[choices.REEL_JOB_ASSIGN_NEXT_REEL] = broken_handler
+        try:
+            for attempt in range(1, job.max_attempts + 1):
+                self.assertEqual(len(run_pending_jobs()), 1)
+
+                # not retried until its delay is up
+                job.refresh_from_db()
+                self.assertEqual(job.attempts, attempt)
+                self.assertGreater(job.run_after, timezone.now())
+                self.assertEqual(run_pending_jobs(), [])
+                ReelJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        finally:
+            JOB_HANDLERS[choices.REEL_JOB_ASSIGN_NEXT_REEL] = original
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, choices.REEL_JOB_FAILED)
+        self.assertEqual(job.attempts, job.max_attempts)
+        self.assertIn('boom', job.error)
+
+        # the keyer is told, and can try again
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+        response = self.client.get(reverse('EntryApp:index'))
+        self.assertTrue(response.context['reel_job_failed'])
+        self.assertTrue(response.context['make_next_reel_button_appear'])
+
+
+class LoadReelJobTests(utils.TempDirMixin, TestCase):
+
+    def test_reports_progress_while_loading(self):
+        ''' The load_reel job reports progress as it goes, keeping its heartbeat fresh '''
+        reel_path = os.path.join(self.tmp_dir, 'load_reel')
+        for i in range(1, 6):
+            utils.write_image(os.path.join(reel_path, f'gr{i:04d}_smaller.jpg'))
+        job = enqueue_load_reel(reel_path, 1960, 'IL')
+
+        with mock.patch('EntryApp.jobs.PROGRESS_EVERY', 2), \
+                mock.patch('EntryApp.jobs.report_progress', wraps=report_progress) as patched, \
+                contextlib.redirect_stdout(io.StringIO()):
+            run_pending_jobs()
+
+        self.assertEqual([c.args[1:] for c in patched.call_args_list], [(2, 5), (4, 5), (5, 5)])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), (choices.REEL_JOB_DONE, 100))
+        self.assertEqual(len(job.result['reel_ids']), 1)
+
+
+class WarmReelPoolTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.keyer = utils.create_keyer(TEMP_USERNAME, TEMP_PW)
+        cls.done_reel = utils.create_reel('done_reel', num_images=5)
+        cls.next_reel = utils.create_reel('next_reel', num_images=5)
+
+        utils.assign_reel_images(cls.done_reel, cls.keyer)
+        utils.create_current_entry(cls.keyer, cls.done_reel)
+        Image.objects.filter(jbid=TEMP_USERNAME).update(is_complete=True)
+
+        # the keyer was active just now
+        rebuild_progress(TEMP_USERNAME, cls.done_reel)
+
+    def test_fill_provisions_next_reel(self):
+        ''' Filling the pool assigns the reel and creates its Images ahead of time '''
+        provisioned_list = fill_reel_pool(depth=1)
+
+        self.assertEqual([p.reel for p in provisioned_list], [self.next_reel])
+        self.assertEqual(Reel.objects.get(pk=self.next_reel.pk).keyer_one, self.keyer)
+        self.assertEqual(
+            Image.objects.filter(jbid=TEMP_USERNAME, image_file__img_reel=self.next_reel).count(),
+            5
+        )
+        # not moved yet
+        self.assertEqual(CurrentEntry.objects.get(jbid=TEMP_USERNAME).reel, self.done_reel)
+
+        # already full: a second fill does nothing
+        self.assertEqual(fill_reel_pool(depth=1), [])
+
+    @override_settings(REEL_ASSIGN_IN_BACKGROUND=True)
+    def test_button_claims_provisioned_reel(self):
+        ''' With a reel in the pool the button is a pointer flip: no job, no Image INSERTs '''
+        fill_reel_pool(depth=1)
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('EntryApp:index'), {'action': 'load_next_reel'})
+
+        self.assertFalse(response.context['out_of_reels'])
+        self.assertFalse(response.context.get('preparing_reel', False))
+        self.assertEqual(CurrentEntry.objects.get(jbid=TEMP_USERNAME).reel, self.next_reel)
+        self.assertTrue(Reel.objects.get(pk=self.done_reel.pk).is_complete_keyer_one)
+        self.assertFalse(ProvisionedReel.objects.exists())
+        self.assertFalse(ReelJob.objects.exists())
+
+        insert_list = [
+            q['sql'] for q in queries.captured_queries
+            if q['sql'].startswith('INSERT') and '"EntryApp_image"' in q['sql']
+        ]
+        self.assertEqual(insert_list, [])
+
+    def test_idle_keyer_reels_released(self):
+        ''' Reels held for a keyer who went idle are given back '''
+        fill_reel_pool(depth=1)
+        KeyerReelProgress.objects.filter(jbid=TEMP_USERNAME).update(
+            last_modified=timezone.now() - timedelta(hours=48)
+        )
+
+        released_list = release_idle_reels(idle_hours=24)
+
+        self.assertEqual(released_list, [(TEMP_USERNAME, self.next_reel.id)])
+        self.assertIsNone(Reel.objects.get(pk=self.next_reel.pk).keyer_one)
+        self.assertFalse(Image.objects.filter(image_file__img_reel=self.next_reel).exists())
+        self.assertFalse(ProvisionedReel.objects.exists())
+
+        # idle keyers don't get a new one either
+        self.assertEqual(fill_reel_pool(depth=1, idle_hours=24), [])
+
+    def test_landing_page_counts_as_activity(self):
+        ''' A keyer who only loads the landing page keeps their pooled reels '''
+        fill_reel_pool(depth=1)
+        KeyerReelProgress.objects.filter(jbid=TEMP_USERNAME).update(
+            last_modified=timezone.now() - timedelta(hours=48)
+        )
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+        self.client.get(reverse('EntryApp:index'))
+
+        self.assertEqual(release_idle_reels(idle_hours=24), [])
+        self.assertEqual(Reel.objects.get(pk=self.next_reel.pk).keyer_one, self.keyer)
+
+        # a reload straight after doesn't write again
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('EntryApp:index'))
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('UPDATE "EntryApp_keyerreelprogress"')])
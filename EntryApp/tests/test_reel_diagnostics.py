@@ -0,0 +1,50 @@
+"""
+TESTS FOR REEL DIAGNOSTICS (reel_diagnostics.py)
+
+Builds reels of placeholder files in a scratch directory: the diagnostics
+only look at file names and sizes, so the files needn't be images.
+"""
+
+import os
+
+# django imports
+from django.test import SimpleTestCase
+
+# EntryApp modules
+import EntryApp.tests.test_utils as utils
+import reel_diagnostics
+
+#================================#
+# TEST CASES
+#================================#
+
+class ReelDiagnosticsTests(utils.TempDirMixin, SimpleTestCase):
+
+    def make_file(self, reel_name, name, size):
+        os.makedirs(os.path.join(self.tmp_dir, reel_name), exist_ok=True)
+        with open(os.path.join(self.tmp_dir, reel_name, name), 'wb') as image_file:
+            image_file.write(b'x' * size)
+
+    def test_summary_and_anomalies(self):
+        ''' Gaps and odd sizes are listed per image, as well as counted per reel '''
+        for i in [1, 2, 3, 6, 7]:
+            self.make_file('reel_a', f'gr{i:04d}_smaller.jpg', 150000 if i != 6 else 20000)
+        self.make_file('reel_a', 'gr0004.jpg', 900000)
+        self.make_file('reel_a', 'notes.txt', 10)
+        for i in range(1, 5):
+            self.make_file('reel_b', f'gr{i:04d}.jpg', 3000000)
+
+        summary, anomalies = reel_diagnostics.diagnose_reels(
+            [os.path.join(self.tmp_dir, 'reel_a'), os.path.join(self.tmp_dir, 'reel_b')],
+            workers=2
+        )
+
+        self.assertEqual(list(summary['num_images_in_directory']), [6, 4])
+        self.assertEqual(list(summary['num_missing']), [1, 0])
+        self.assertEqual(list(summary['num_suspiciously_small']), [1, 0])
+        # full-size scans aren't held to the shrunk copies' bounds
+        self.assertEqual(list(summary['num_suspiciously_large']), [0, 0])
+        self.assertEqual(
+            [(row.image_number, row.anomaly) for row in anomalies.itertuples()],
+            [(5, 'missing'), (6, 'small_for_reel'), (6, 'too_small')]
+        )
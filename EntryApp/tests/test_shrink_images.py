@@ -0,0 +1,229 @@
+"""
+TESTS FOR SHRINKING SCANS (EntryApp.shrink_images)
+
+Covers the worker pool, draft-mode decoding, the output encoders and the
+benchmark_shrink and report_encoders commands, all on files in a scratch
+directory. Loading a shrunk reel into the database is tested separately.
+"""
+
+import contextlib
+import csv
+import io
+import os
+
+from PIL import Image as PILImage
+
+# django imports
+from django.core.management import call_command
+from django.test import SimpleTestCase
+from django.test import TestCase
+from django.test import override_settings
+
+# EntryApp models
+from EntryApp.models import ImageFile
+
+# EntryApp modules
+import EntryApp.load_db as ldb
+import EntryApp.management.commands.benchmark_shrink as benchmark_shrink
+import EntryApp.shrink_images as shrink_images
+import EntryApp.tests.test_utils as utils
+
+#================================#
+# HELPERS
+#================================#
+
+def make_reel(reel_path, num_images, size=(200, 120)):
+    ''' Writes gr0001.jpg ... full-size scans and returns their paths '''
+    return [
+        utils.write_image(os.path.join(reel_path, f'gr{i:04d}.jpg'), size=size)
+        for i in range(1, num_images + 1)
+    ]
+
+#================================#
+# TEST CASES
+#================================#
+
+class ShrinkImagesTests(utils.TempDirMixin, SimpleTestCase):
+
+    def test_pool_shrinks_every_image(self):
+        ''' Chunks fanned out over worker processes halve every image '''
+        path_list = make_reel(self.tmp_dir, 7)
+        progress_list = []
+
+        result = shrink_images.shrink_images(
+            path_list,
+            max_workers=2,
+            chunk_size=2,
+            progress=lambda *args: progress_list.append(args),
+            progress_every=3
+        )
+
+        self.assertEqual((result['num_shrunk'], result['num_skipped'], result['errors']), (7, 0, []))
+        for path in path_list:
+            with PILImage.open(shrink_images.make_new_filepath(path)[0]) as small_image:
+                self.assertEqual(small_image.size, (100, 60))
+        self.assertEqual(progress_list[-1][:2], (7, 7))
+        self.assertGreater(len(progress_list), 1)
+
+    def test_rerun_skips_and_errors_are_collected(self):
+        ''' Finished images are skipped; a bad file is reported, not fatal '''
+        path_list = make_reel(self.tmp_dir, 3)
+        shrink_images.shrink_images(path_list[:1], max_workers=1, progress=None)
+
+        with open(os.path.join(self.tmp_dir, 'gr0004.jpg'), 'w') as broken_file:
+            broken_file.write('not a jpeg')
+        path_list.append(broken_file.name)
+
+        result = shrink_images.shrink_images(path_list, max_workers=2, chunk_size=1, progress=None)
+
+        self.assertEqual((result['num_shrunk'], result['num_skipped']), (2, 1))
+        self.assertEqual(len(result['errors']), 1)
+        self.assertTrue(result['errors'][0].startswith(broken_file.name))
+
+    def test_reel_resumes_part_way(self):
+        ''' A reel with some _smaller copies already gets the rest '''
+        path_list = make_reel(self.tmp_dir, 4)
+        shrink_images.shrink_images(path_list[:2], max_workers=1, progress=None)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = shrink_images.shrink_reel_images_before_db(self.tmp_dir, max_workers=1)
+
+        self.assertEqual((result['num_images'], result['num_shrunk'], result['num_skipped']), (4, 2, 2))
+
+    def test_reel_in_another_format_is_shrunk_again(self):
+        ''' A reel shrunk as JPEG still gets its WebP copies, and says so '''
+        path_list = make_reel(self.tmp_dir, 2)
+        shrink_images.shrink_images(path_list, max_workers=1, progress=None)
+
+        for expected_count, expected_message in [
+            (2, 'Shrinking 2 files'),
+            (0, '2 images in here already have webp copies, nothing to shrink.'),
+        ]:
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                result = shrink_images.shrink_reel_images_before_db(self.tmp_dir, max_workers=1, encoder='webp')
+            self.assertEqual(result['num_shrunk'], expected_count)
+            self.assertIn(expected_message, stdout.getvalue())
+
+    def test_fast_mode_matches_standard(self):
+        ''' Draft-mode decoding gives the same size, and near the same pixels, for odd scans '''
+        path = utils.write_image(
+            os.path.join(self.tmp_dir, 'gr0001.jpg'),
+            image=PILImage.linear_gradient('L').resize((201, 121)).convert('RGB')
+        )
+        standard_path = os.path.join(self.tmp_dir, 'standard.jpg')
+        fast_path = os.path.join(self.tmp_dir, 'fast.jpg')
+
+        shrink_images.shrink_image(path, standard_path)
+        shrink_images.shrink_image(path, fast_path, fast=True)
+
+        with PILImage.open(fast_path) as small_image:
+            self.assertEqual(small_image.size, (100, 60))
+        self.assertLess(benchmark_shrink.get_mean_difference(standard_path, fast_path), 2.0)
+
+    def test_fast_mode_resample_reaches_workers(self):
+        ''' A resample filter given to shrink_images() is the one its workers use '''
+        path_list = [
+            utils.write_image(
+                os.path.join(self.tmp_dir, f'gr{i:04d}.jpg'),
+                image=PILImage.linear_gradient('L').resize((201, 121)).convert('RGB')
+            )
+            for i in [1, 2]
+        ]
+        resample = shrink_images.RESAMPLE_FILTERS['bilinear']
+        crop_path = os.path.join(self.tmp_dir, 'crop.jpg')
+        bilinear_path = os.path.join(self.tmp_dir, 'bilinear.jpg')
+        shrink_images.shrink_image(path_list[0], crop_path, fast=True)
+        shrink_images.shrink_image(path_list[0], bilinear_path, fast=True, resample=resample)
+
+        result = shrink_images.shrink_images(path_list, max_workers=2, chunk_size=1, progress=None, fast=True, resample=resample)
+
+        self.assertEqual(result['num_shrunk'], 2)
+        with open(bilinear_path, 'rb') as bilinear_file, open(crop_path, 'rb') as crop_file:
+            bilinear_bytes, crop_bytes = bilinear_file.read(), crop_file.read()
+        self.assertNotEqual(bilinear_bytes, crop_bytes)
+        for path in path_list:
+            with open(shrink_images.make_new_filepath(path)[0], 'rb') as small_file:
+                self.assertEqual(small_file.read(), bilinear_bytes)
+
+    def test_benchmark_command(self):
+        ''' benchmark_shrink times both modes and leaves the reel untouched '''
+        make_reel(self.tmp_dir, 3, size=(201, 121))
+        stdout = io.StringIO()
+
+        call_command('benchmark_shrink', self.tmp_dir, '--limit', '2', stdout=stdout)
+
+        self.assertIn('fast output within tolerance', stdout.getvalue())
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['gr0001.jpg', 'gr0002.jpg', 'gr0003.jpg'])
+
+    def test_encoders(self):
+        ''' Each encoder writes its own format, reports sizes and is recognized again '''
+        path_list = make_reel(self.tmp_dir, 2)
+
+        for encoder in shrink_images.SHRINK_ENCODERS:
+            out_path = shrink_images.make_new_filepath(path_list[0], encoder=encoder)[0]
+            if os.path.exists(out_path):
+                os.remove(out_path)
+            result = shrink_images.shrink_images(path_list[:1], max_workers=1, progress=None, encoder=encoder)
+            self.assertEqual((result['num_shrunk'], result['bytes_out']), (1, os.path.getsize(out_path)))
+            self.assertEqual(shrink_images.get_image_variant(out_path), encoder)
+
+        # a reel shrunk twice still has one served copy per image
+        shrink_images.shrink_images(path_list, max_workers=1, progress=None, encoder='webp')
+        self.assertEqual(
+            [os.path.basename(p) for p in shrink_images.get_small_image_list(self.tmp_dir, 'webp')],
+            ['gr0001_smaller.webp', 'gr0002_smaller.webp']
+        )
+        self.assertEqual(
+            [os.path.basename(p) for p in shrink_images.get_small_image_list(self.tmp_dir)],
+            ['gr0001_smaller.jpg', 'gr0002_smaller.webp']
+        )
+        self.assertEqual(shrink_images.get_full_size_image_list(self.tmp_dir), path_list)
+
+    def test_report_encoders_command(self):
+        ''' report_encoders writes a row per reel and encoder without touching the reel '''
+        make_reel(self.tmp_dir, 2)
+        csv_path = os.path.join(self.make_tmp_dir(), 'encoders.csv')
+
+        call_command('report_encoders', self.tmp_dir, '--encoders', 'jpeg,webp', '--csv', csv_path, stdout=io.StringIO())
+
+        with open(csv_path) as csv_file:
+            row_list = list(csv.DictReader(csv_file))
+        self.assertEqual([(row['encoder'], row['num_images']) for row in row_list], [('jpeg', '2'), ('webp', '2')])
+        self.assertEqual(float(row_list[0]['saved_vs_jpeg']), 0.0)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['gr0001.jpg', 'gr0002.jpg'])
+
+
+class ShrunkReelLoaderTests(utils.TempDirMixin, TestCase):
+
+    @override_settings(SHRINK_IMAGE_ENCODER='webp')
+    def test_loader_records_variant(self):
+        ''' load_reel() serves the configured encoder's copy and records which it is '''
+        reel_path = os.path.join(self.tmp_dir, 'variant_reel')
+        path_list = make_reel(reel_path, 2)
+        shrink_images.shrink_images(path_list, max_workers=1, progress=None, encoder='progressive')
+        shrink_images.shrink_images(path_list[1:], max_workers=1, progress=None, encoder='webp')
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            ldb.load_reel(reel_path, 1960, 'IL')
+
+        self.assertEqual(
+            list(ImageFile.objects.order_by('img_position').values_list('smaller_image_file_name', 'smaller_image_variant')),
+            [('gr0001_smaller.jpg', 'progressive'), ('gr0002_smaller.webp', 'webp')]
+        )
+
+    def test_loader_survives_damaged_file(self):
+        ''' An unreadable _smaller copy is still loaded, just without a variant '''
+        reel_path = os.path.join(self.tmp_dir, 'damaged_reel')
+        path_list = make_reel(reel_path, 2)
+        shrink_images.shrink_images(path_list, max_workers=1, progress=None)
+        with open(os.path.join(reel_path, 'gr0002_smaller.jpg'), 'wb') as damaged_file:
+            damaged_file.write(b'\x00' * 10)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            ldb.load_reel(reel_path, 1960, 'IL')
+
+        self.assertEqual(
+            list(ImageFile.objects.order_by('img_position').values_list('smaller_image_file_name', 'smaller_image_variant')),
+            [('gr0001_smaller.jpg', 'jpeg'), ('gr0002_smaller.jpg', '')]
+        )
@@ -0,0 +1,128 @@
+"""
+TESTS FOR DEEP ZOOM TILING (EntryApp.tile_images)
+
+Tiling works on files alone, so most of these are SimpleTestCases in a
+scratch directory; recording the pyramids on ImageFiles and serving them to
+the viewer needs the database.
+"""
+
+import os
+
+from PIL import Image as PILImage
+
+# django imports
+from django.test import SimpleTestCase
+from django.test import TestCase
+from django.urls import reverse
+
+# EntryApp models
+from EntryApp.models import Image
+from EntryApp.models import ImageFile
+from EntryApp.models import Reel
+
+# EntryApp modules
+import EntryApp.jobs as jobs
+import EntryApp.load_db as ldb
+import EntryApp.tests.test_utils as utils
+import EntryApp.tile_images as tile_images
+
+#================================#
+# GLOBALS
+#================================#
+
+TEMP_USERNAME = 'jbid321'
+TEMP_PW = 'dcdl1980'
+
+TILE_IMAGE_SIZE = (600, 400)
+
+#================================#
+# TEST CASES
+#================================#
+
+class TileImagesTests(utils.TempDirMixin, SimpleTestCase):
+
+    def test_builds_pyramid(self):
+        ''' A DZI descriptor plus one directory of col_row tiles per level '''
+        image_path = utils.write_image(os.path.join(self.tmp_dir, 'gr0001_smaller.jpg'), size=TILE_IMAGE_SIZE)
+
+        dzi_name = tile_images.tile_image(image_path)
+
+        self.assertEqual(dzi_name, 'gr0001_smaller.dzi')
+        with open(os.path.join(self.tmp_dir, dzi_name)) as dzi_file:
+            dzi_xml = dzi_file.read()
+        self.assertIn('TileSize="254"', dzi_xml)
+        self.assertIn('<Size Width="600" Height="400"/>', dzi_xml)
+
+        tile_dir = os.path.join(self.tmp_dir, 'gr0001_smaller_files')
+        self.assertEqual(sorted(os.listdir(tile_dir), key=int), [str(level) for level in range(11)])
+        self.assertEqual(len(os.listdir(os.path.join(tile_dir, '10'))), 3 * 2)
+        self.assertEqual(os.listdir(os.path.join(tile_dir, '0')), ['0_0.jpg'])
+
+        # inner tiles carry the overlap on both sides
+        with PILImage.open(os.path.join(tile_dir, '10', '1_0.jpg')) as tile:
+            self.assertEqual(tile.size, (256, 255))
+
+    def test_skips_finished_and_reports_failures(self):
+        ''' Finished pyramids are left alone; unreadable images raise and leave no .dzi '''
+        image_path = utils.write_image(os.path.join(self.tmp_dir, 'gr0001_smaller.jpg'), size=TILE_IMAGE_SIZE)
+        tile_images.tile_image(image_path)
+        dzi_path = os.path.join(self.tmp_dir, 'gr0001_smaller.dzi')
+        os.utime(dzi_path, (0, 0))
+
+        self.assertEqual(tile_images.tile_image(image_path), 'gr0001_smaller.dzi')
+        self.assertEqual(os.path.getmtime(dzi_path), 0)
+
+        broken_path = os.path.join(self.tmp_dir, 'gr0002_smaller.jpg')
+        with open(broken_path, 'w') as broken_file:
+            broken_file.write('not a jpeg')
+        with self.assertRaises(PILImage.UnidentifiedImageError):
+            tile_images.tile_image(broken_path)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['gr0001_smaller.dzi', 'gr0001_smaller.jpg', 'gr0001_smaller_files', 'gr0002_smaller.jpg'])
+
+
+class TileRecordTests(utils.TempDirMixin, TestCase):
+
+    def test_viewer_uses_tiles_once_recorded(self):
+        ''' record_reel_tiles() points ImageFiles at their pyramids and the viewer follows '''
+        keyer = utils.create_keyer(TEMP_USERNAME, TEMP_PW)
+        reel = utils.create_reel('tile_reel', num_images=2)
+        ImageFile.objects.filter(img_reel=reel).update(img_folder_path=self.tmp_dir)
+        utils.assign_reel_images(reel, keyer)
+        utils.create_current_entry(keyer, reel)
+
+        tile_images.tile_image(utils.write_image(os.path.join(self.tmp_dir, 'gr0001_smaller.jpg'), size=TILE_IMAGE_SIZE))
+        utils.write_image(os.path.join(self.tmp_dir, 'gr0002_smaller.jpg'), size=TILE_IMAGE_SIZE)
+
+        self.assertEqual(ldb.record_reel_tiles(reel.reel_path), 1)
+        self.assertEqual(ldb.record_reel_tiles(reel.reel_path), 0)
+
+        image_list = list(Image.objects.order_by('image_file__img_position'))
+        self.client.login(username=TEMP_USERNAME, password=TEMP_PW)
+
+        for image, viewer_slug in zip(image_list, ['gr0001_smaller.dzi', 'gr0002_smaller.jpg']):
+            response = self.client.get(reverse('EntryApp:code_image'), {'image_id': image.pk})
+            self.assertEqual(response.context['viewer_slug'], viewer_slug)
+
+        response = self.client.get(reverse('EntryApp:next_images'))
+        self.assertEqual(
+            [image['tile_url'] for image in response.json()['images']],
+            ['/images/1960/tile_reel/gr0001_smaller.dzi', None]
+        )
+
+    def test_job_reports_failures(self):
+        ''' The tile_reel job tiles what it can and says why the rest failed '''
+        reel = utils.create_reel('tile_reel', num_images=2)
+        Reel.objects.filter(pk=reel.pk).update(reel_path=self.tmp_dir)
+        ImageFile.objects.filter(img_reel=reel).update(img_folder_path=self.tmp_dir)
+        utils.write_image(os.path.join(self.tmp_dir, 'gr0001_smaller.jpg'), size=TILE_IMAGE_SIZE)
+        broken_path = os.path.join(self.tmp_dir, 'gr0002_smaller.jpg')
+        with open(broken_path, 'w') as broken_file:
+            broken_file.write('not a jpeg')
+
+        job = jobs.enqueue_tile_reel(self.tmp_dir)
+        jobs.run_pending_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual((job.result['num_images'], job.result['num_recorded']), (2, 1))
+        self.assertEqual(len(job.result['errors']), 1)
+        self.assertTrue(job.result['errors'][0].startswith(f'{broken_path}: UnidentifiedImageError: '))
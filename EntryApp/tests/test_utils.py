@@ -2,9 +2,20 @@
 # HELPER METHODS FOR TESTING
 #===============================================================#
 
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
 from django.forms import formset_factory
+from PIL import Image as PILImage
 
 from EntryApp.models import Breaker
+from EntryApp.models import CurrentEntry
+from EntryApp.models import Image
+from EntryApp.models import ImageFile
+from EntryApp.models import Keyer
+from EntryApp.models import Reel
 
 ### FORMSETS ###
 # from https://stackoverflow.com/questions/1630754/django-formset-unit-test
@@ -59,4 +70,90 @@ def create_formset_post_data(response, new_form_data=None):
         for key, value in form_data.items():
             prefix = prefix_template.replace('__prefix__', f'{index}-')
             post_data[prefix + key] = value
-    return post_data
\ No newline at end of file
+    return post_data
+
+### SEEDED DATA ###
+# small self-contained data sets for tests that don't use the dev fixture
+
+def create_keyer(jbid, password='dcdl1980'):
+    '''Create a django user plus the matching Keyer row'''
+    user = User.objects.create_user(username=jbid, password=password)
+    return Keyer.objects.create(user=user, jbid=jbid)
+
+def create_reel(reel_name, year=1960, num_images=10, state='IL'):
+    '''Create a Reel with num_images ImageFiles in position order'''
+    reel = Reel.objects.create(
+        reel_name=reel_name,
+        reel_chunk_name=reel_name + '_0',
+        reel_path='/images/' + reel_name,
+        year=year,
+        state=state,
+        image_count=num_images,
+        reel_label='',
+    )
+    ImageFile.objects.bulk_create([
+        ImageFile(
+            img_path=f'/images/{reel_name}/gr{i:04d}_smaller.jpg',
+            img_file_name=f'gr{i:04d}_smaller.jpg',
+            img_folder_path='/images/' + reel_name,
+            img_reel=reel,
+            img_position=i,
+            smaller_image_file_name=f'gr{i:04d}_smaller.jpg',
+            year=year,
+        )
+        for i in range(1, num_images + 1)
+    ])
+    return reel
+
+def assign_reel_images(reel, keyer, slot=1):
+    '''Put keyer in a reel slot and create their Image rows'''
+    if slot == 1:
+        reel.keyer_one = keyer
+    else:
+        reel.keyer_two = keyer
+    reel.keyer_count += 1
+    reel.save()
+
+    Image.objects.bulk_create([
+        Image(image_file=f, jbid=keyer.jbid, year=reel.year, is_complete=False)
+        for f in ImageFile.objects.filter(img_reel=reel)
+    ])
+
+def create_current_entry(keyer, reel):
+    '''Point keyer's CurrentEntry at the first image of reel'''
+    first_image = Image.objects.filter(
+        jbid=keyer.jbid,
+        image_file__img_reel=reel
+    ).order_by('image_file__img_position').select_related('image_file').first()
+
+    return CurrentEntry.objects.create(
+        keyer=keyer,
+        jbid=keyer.jbid,
+        reel=reel,
+        image_file=first_image.image_file,
+        img=first_image,
+    )
+
+### IMAGE FILES ###
+# scratch directories and scans for tests of the image preparation modules
+
+class TempDirMixin:
+    '''Give each test a scratch directory, self.tmp_dir, removed afterwards'''
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = self.make_tmp_dir()
+
+    def make_tmp_dir(self):
+        '''Create another scratch directory, removed after the test'''
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+def write_image(path, size=(200, 120), color=100, image=None):
+    '''Save a flat grey scan (or a given PIL image) to path, creating its directory'''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if image is None:
+        image = PILImage.new('L', size, color=color)
+    image.save(path)
+    return path
@@ -0,0 +1,218 @@
+"""
+BUILD DEEP ZOOM TILE PYRAMIDS FOR THE IMAGE VIEWER
+
+This module is intended for import and use in prepare_images.py, the reel
+jobs or the Django shell, like shrink_images.py. It cuts each served image
+into a Deep Zoom (DZI) pyramid so the OpenSeadragon viewer only downloads
+the tiles for the part of the scan on screen, at the zoom shown, instead of
+the whole JPEG before it can draw anything.
+
+Tiles live next to the image they're cut from, so the web server's existing
+/images alias serves them as static files:
+
+    gr0001_smaller.jpg        the served image
+    gr0001_smaller.dzi        pyramid descriptor (written last)
+    gr0001_smaller_files/     one directory per level, tiles named col_row.jpg
+
+ImageFile.tile_source_name records the .dzi file name once the pyramid
+exists (see load_db.record_reel_tiles()); the viewer falls back to the
+plain JPEG when it's empty.
+"""
+
+import glob
+import math
+import os
+import shutil
+
+from PIL import Image, ImageFile
+
+from EntryApp.shrink_images import get_small_image_list
+
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+# DZI defaults OpenSeadragon expects: 254 + 1 px overlap on each side = 256
+TILE_SIZE = 254
+TILE_OVERLAP = 1
+TILE_FORMAT = "jpg"
+TILE_QUALITY = 60
+
+DZI_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{tile_format}"'
+    ' Overlap="{overlap}" TileSize="{tile_size}">\n'
+    '  <Size Width="{width}" Height="{height}"/>\n'
+    '</Image>\n'
+)
+
+
+def make_tile_paths(image_file_path):
+    '''
+    Works out where an image's pyramid goes
+
+    Takes:
+    - string filepath to image file
+    Returns:
+    - tuple: (path to .dzi file, name of .dzi file, path to tile directory)
+    '''
+
+    stem = os.path.splitext(image_file_path)[0]
+    dzi_path = stem + ".dzi"
+
+    return dzi_path, os.path.basename(dzi_path), stem + "_files"
+
+
+def get_tiled_name(image_file_path):
+    '''
+    Returns the .dzi file name for an image if its pyramid is finished,
+    otherwise an empty string
+    '''
+
+    dzi_path, dzi_name, tile_dir = make_tile_paths(image_file_path)
+
+    return dzi_name if os.path.isfile(dzi_path) else ""
+
+
+def get_level_count(width, height):
+    '''
+    Returns the number of DZI levels: level 0 is 1x1, the last is full size
+    '''
+    return int(math.ceil(math.log2(max(width, height, 1)))) + 1
+
+
+def save_level_tiles(level_image, level_dir, tile_size = TILE_SIZE, overlap = TILE_OVERLAP):
+    '''
+    Cuts one level of the pyramid into tiles named col_row.jpg
+
+    Takes:
+    - PIL image at this level's size
+    - string directory to write the tiles in
+    - optional tile size and overlap
+    Returns:
+    - number of tiles written
+    '''
+
+    width, height = level_image.size
+    num_cols = int(math.ceil(width / tile_size))
+    num_rows = int(math.ceil(height / tile_size))
+
+    os.makedirs(level_dir, exist_ok = True)
+
+    for col in range(num_cols):
+        for row in range(num_rows):
+
+            left = col * tile_size - (overlap if col > 0 else 0)
+            top = row * tile_size - (overlap if row > 0 else 0)
+            right = min(width, (col + 1) * tile_size + overlap)
+            bottom = min(height, (row + 1) * tile_size + overlap)
+
+            tile = level_image.crop((left, top, right, bottom))
+            tile.save(os.path.join(level_dir, f"{col}_{row}.{TILE_FORMAT}"), quality = TILE_QUALITY)
+
+    return num_cols * num_rows
+
+
+def tile_image(image_file_path, tile_size = TILE_SIZE, overlap = TILE_OVERLAP):
+    '''
+    Builds the DZI pyramid for an image. Does nothing if the .dzi file is
+    already there. Tiles are written to a scratch directory that's renamed
+    into place before the .dzi is written, and the .dzi itself is written
+    to a .partial file that's replaced into place, so a crash part way never
+    leaves a .dzi pointing at missing tiles, or a half-written .dzi;
+    rerunning just starts that image over.
+
+    Takes:
+    - string filepath to image file
+    - optional tile size and overlap
+    Returns:
+    - string name of the .dzi file
+    Raises:
+    - whatever opening or tiling the image raised, once the scratch files
+      are cleaned up, so the caller can report it
+    '''
+
+    dzi_path, dzi_name, tile_dir = make_tile_paths(image_file_path)
+
+    # skip this if the pyramid already exists
+    if os.path.isfile(dzi_path):
+        return dzi_name
+
+    scratch_dir = tile_dir + ".tmp"
+    partial_path = dzi_path + ".partial"
+
+    try:
+        shutil.rmtree(scratch_dir, ignore_errors = True)
+
+        image = Image.open(image_file_path)
+        if image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+
+        width, height = image.size
+        level_image = image
+
+        # largest level first, halving each time
+        for level in reversed(range(get_level_count(width, height))):
+
+            save_level_tiles(level_image, os.path.join(scratch_dir, str(level)), tile_size, overlap)
+
+            next_size = (max(1, int(math.ceil(level_image.size[0] / 2))), max(1, int(math.ceil(level_image.size[1] / 2))))
+            level_image = level_image.resize(next_size, Image.LANCZOS)
+
+        shutil.rmtree(tile_dir, ignore_errors = True)
+        os.rename(scratch_dir, tile_dir)
+
+        with open(partial_path, "w") as dzi_file:
+            dzi_file.write(DZI_TEMPLATE.format(
+                tile_format = TILE_FORMAT,
+                overlap = overlap,
+                tile_size = tile_size,
+                width = width,
+                height = height
+            ))
+        os.replace(partial_path, dzi_path)
+
+    except Exception:
+        shutil.rmtree(scratch_dir, ignore_errors = True)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    return dzi_name
+
+
+def get_served_image_list(reel_path):
+    '''
+    Returns the images the app serves from a reel directory, in order: the
+    _smaller copies if the reel has been shrunk, otherwise the originals
+    '''
+
+    image_file_list = get_small_image_list(reel_path)
+    if not image_file_list:
+        image_file_list = sorted(glob.glob(reel_path + "/gr*.jpg"))
+
+    return image_file_list
+
+
+def tile_reel_images(reel_path):
+    '''
+    Builds pyramids for the served images in a reel directory
+
+    Takes:
+    - string of path to reel, e.g. /data/storage/images/1970/this_1970_reel
+    Returns:
+    - tuple: (number of images, number of pyramids built or already there)
+    '''
+
+    image_file_list = get_served_image_list(reel_path)
+
+    print(f"\t\tTiling {len(image_file_list)} files in {reel_path}...")
+
+    num_tiled = 0
+    for image_path in image_file_list:
+        try:
+            tile_image(image_path)
+        except Exception as e:
+            print(f"\t\t{image_path}: {type(e).__name__}: {e}")
+            continue
+        num_tiled += 1
+
+    return len(image_file_list), num_tiled
@@ -8,6 +8,9 @@ app_name = 'EntryApp'
 urlpatterns = [
     path('', views.IndexView.as_view(extra_context={'app_instance': settings.APP_INSTANCE}), name='index'),
     path( 'code-image/', views.CodeImage.as_view(), name="code_image" ),
+    path('code-image/save-record/', views.save_record, name='save_record'),
+    path('code-image/save-records/', views.save_records, name='save_records'),
+    path('code-image/next-images/', views.next_images, name='next_images'),
     path('report-problem/', views.report_problem, name='report_problem'),
     path('test-crispy-formset/<int:year>/<str:form_type>', views.test_crispy_formset_view, name='test_crispy_formset'),
     path('develop-household1960/', views.test_household1960_form, name='test_household_1960'),
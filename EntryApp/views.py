@@ -16,22 +16,29 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import Permission
 from django.contrib.auth.models import User
 from django.db import IntegrityError
+from django.db import connection
 from django.db import transaction
+from django.db.models import Prefetch
 from django.db.models import Q
+from django.db.models import prefetch_related_objects
 import django.forms as forms
 from django.forms import modelform_factory
-from django.forms import modelformset_factory
 from django.forms import RadioSelect
 from django.http import Http404
 from django.http import HttpResponse
 from django.http import HttpResponseNotFound
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.shortcuts import redirect
 from django.shortcuts import render
 from django.template import loader
 from django.template import RequestContext
+from django.template.loader import render_to_string
 from django.template.context_processors import csrf
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from django.views.decorators.cache import never_cache
 from django.views.generic import CreateView
 from django.views.generic import FormView
 from django.views.generic import ListView
@@ -41,7 +48,6 @@ from django.views.generic import View
 # EntryApp models
 from EntryApp.models import Breaker
 from EntryApp.models import CurrentEntry
-from EntryApp.models import FormField
 from EntryApp.models import Image
 from EntryApp.models import ImageFile
 from EntryApp.models import Keyer
@@ -59,6 +65,9 @@ from EntryApp.forms import BaseRecordFormSet
 from EntryApp.forms import BreakerFormHelper
 from EntryApp.forms import CrispyFormSetHelper
 from EntryApp.forms import CrispyLongFormHelper
+from EntryApp.forms import get_blank_form_html
+from EntryApp.forms import get_form_class
+from EntryApp.forms import get_formset_class
 from EntryApp.forms import ImageForm
 from EntryApp.forms import LongForm1990Form
 from EntryApp.forms import LongFormHelper
@@ -71,15 +80,34 @@ from EntryApp.forms import SheetFormHelper
 
 # EntryApp choices
 import EntryApp.choices as choices
+import EntryApp.form_registry as form_registry
+
+# EntryApp dashboard state
+from EntryApp.dashboard import BATCH_SIZE
+from EntryApp.dashboard import NEXT_IMAGE_PARAM
+from EntryApp.dashboard import advance_current_entry
+from EntryApp.dashboard import compute_batch_numbers
+from EntryApp.dashboard import get_current_entry
+from EntryApp.dashboard import get_image_position
+from EntryApp.dashboard import get_next_todo_image
+from EntryApp.dashboard import get_todo_image_qs
+from EntryApp.dashboard import get_upcoming_images
+from EntryApp.dashboard import load_dashboard_state
+from EntryApp.dashboard import point_current_entry_to_image
+from EntryApp.dashboard import read_next_image
+from EntryApp.dashboard import sign_next_image
+from EntryApp.progress import mark_image_complete
+from EntryApp.jobs import enqueue_assign_next_reel
+from EntryApp.jobs import get_latest_keyer_job
+from EntryApp.reel_allocator import assign_next_reel
+from EntryApp.reel_allocator import claim_provisioned_reel
+from EntryApp.reel_allocator import move_keyer_to_next_reel
 
 
 #==============================================================================#
 # CONSTANTS-ish
 #==============================================================================#
 
-# image batch size
-BATCH_SIZE = 25
-
 # standard context names
 CONTEXT_BREAKER_INSTANCE = "breaker_instance"
 CONTEXT_BREAKER_FORMSET = "breaker_formset"
@@ -87,38 +115,47 @@ CONTEXT_BREAKER_FORM_HELPER = "breaker_helper"
 CONTEXT_FORM_HELPER = "helper"
 CONTEXT_LONGFORM_INSTANCE = "longform_instance"
 CONTEXT_LONGFORM_FORM = "longform_form"
+CONTEXT_LONGFORM_FORM_HTML = "longform_form_html"
 CONTEXT_LONGFORM_HELPER = "helper"
+CONTEXT_NEXT_IMAGE = "next_image"
 CONTEXT_PARAM_NAMES = "param_names"
 CONTEXT_PAGE_STATUS_MESSAGE_LIST = "page_status_message_list"
 CONTEXT_OTHER_IMAGE_INSTANCE = "other_image_instance"
 CONTEXT_OTHER_IMAGE_FORM = "other_image_form"
 CONTEXT_RECORD_INSTANCE = "record_instance"
 CONTEXT_RECORD_FORM = "record_form"
+CONTEXT_RECORD_FORM_HTML = "record_form_html"
 CONTEXT_RECORD_FORMSET_HELPER = "record_helper"
 CONTEXT_RECORD_LIST = "record_list"
+CONTEXT_SAVED_RECORD = "saved_record"
 CONTEXT_SHEET_INSTANCE = "sheet_instance"
 CONTEXT_SHEET_FORM = "sheet_form"
+CONTEXT_SHEET_FORM_HTML = "sheet_form_html"
 CONTEXT_SHEET_HELPER = "sheet_helper"
 CONTEXT_USERNAME = "username"
 
 # input parameter names
 PARAM_NAME_ACTION = "action"
 PARAM_NAME_BREAKER_ID = "breaker_id"
+PARAM_NAME_COUNT = "count"
 PARAM_NAME_IMAGE_ID = "image_id"
 PARAM_NAME_IMAGE_TYPE = "image_type"
 PARAM_NAME_LONGFORM_ID = "longform_id"
 PARAM_NAME_OTHER_IMAGE_ID = "other_image_id"
 PARAM_NAME_RECORD_ID = "record_id"
+PARAM_NAME_REEL_ID = "reel_id"
 PARAM_NAME_SHEET_ID = "sheet_id"
 PARAM_NAME_YEAR = "year"
 PARAM_NAMES = {}
 PARAM_NAMES[ "PARAM_NAME_ACTION" ] = PARAM_NAME_ACTION
 PARAM_NAMES[ "PARAM_NAME_BREAKER_ID" ] = PARAM_NAME_BREAKER_ID
+PARAM_NAMES[ "PARAM_NAME_COUNT" ] = PARAM_NAME_COUNT
 PARAM_NAMES[ "PARAM_NAME_IMAGE_ID" ] = PARAM_NAME_IMAGE_ID
 PARAM_NAMES[ "PARAM_NAME_IMAGE_TYPE" ] = PARAM_NAME_IMAGE_TYPE
 PARAM_NAMES[ "PARAM_NAME_LONGFORM_ID" ] = PARAM_NAME_LONGFORM_ID
 PARAM_NAMES[ "PARAM_NAME_OTHER_IMAGE_ID" ] = PARAM_NAME_OTHER_IMAGE_ID
 PARAM_NAMES[ "PARAM_NAME_RECORD_ID" ] = PARAM_NAME_RECORD_ID
+PARAM_NAMES[ "PARAM_NAME_REEL_ID" ] = PARAM_NAME_REEL_ID
 PARAM_NAMES[ "PARAM_NAME_SHEET_ID" ] = PARAM_NAME_SHEET_ID
 PARAM_NAMES[ "PARAM_NAME_YEAR" ] = PARAM_NAME_YEAR
 
@@ -141,6 +178,12 @@ VALID_ACTIONS.append( ACTION_UPDATE_OTHER_IMAGE )
 VALID_ACTIONS.append( ACTION_UPDATE_SHEET_TYPE )
 VALID_ACTIONS.append( ACTION_UPDATE_RECORD )
 
+# actions that finish the image and redirect to IndexView
+REDIRECT_ACTIONS = []
+REDIRECT_ACTIONS.append( ACTION_COMPLETE_IMAGE )
+REDIRECT_ACTIONS.append( ACTION_UPDATE_BREAKER_TYPE )
+REDIRECT_ACTIONS.append( ACTION_UPDATE_OTHER_IMAGE )
+
 # actions for IndexView
 ACTION_LOAD_NEXT_BATCH = "load_next_batch"
 ACTION_LOAD_NEXT_REEL = "load_next_reel"
@@ -148,6 +191,11 @@ INDEX_ACTIONS = []
 INDEX_ACTIONS.append( ACTION_LOAD_NEXT_BATCH )
 INDEX_ACTIONS.append( ACTION_LOAD_NEXT_REEL )
 
+# how many upcoming images the pages prefetch (override with
+# settings.NEXT_IMAGE_PREFETCH_COUNT), and the most next_images() will list
+DEFAULT_PREFETCH_IMAGE_COUNT = 3
+MAX_PREFETCH_IMAGE_COUNT = 10
+
 #==============================================================================#
 # LOGGER
 #==============================================================================#
@@ -161,6 +209,24 @@ class CustomAdapter(logging.LoggerAdapter):
         extra_info = kwargs.pop('user', self.extra['user'])
         return '%s %s' % (extra_info, msg), kwargs
 
+    def lazy(self, level, msg, *args, **kwargs):
+        '''
+        Logs msg with %-style args only if level is enabled. Callable args
+        are called at that point, so expensive values cost nothing when the
+        level is filtered out.
+        '''
+        if self.isEnabledFor(level):
+            args = tuple(arg() if callable(arg) else arg for arg in args)
+            self.log(level, msg, *args, **kwargs)
+
+    def count(self, label, queryset, **kwargs):
+        '''
+        Opt-in debug counter: logs SELECT COUNT(*) for queryset at DEBUG
+        when settings.LOG_QUERYSET_COUNTS is on. Never fetches rows.
+        '''
+        if getattr(settings, 'LOG_QUERYSET_COUNTS', False):
+            self.lazy(logging.DEBUG, '%s count is %s', label, queryset.count, **kwargs)
+
 adapter = CustomAdapter(logger, {'user': "_"})
 
 #==============================================================================#
@@ -169,7 +235,9 @@ adapter = CustomAdapter(logger, {'user': "_"})
 
 def get_form_fields( year, form_type ):
     '''
-    Looks up the fields that a given form needs to display in FormFields
+    Looks up the fields that a given form needs to display in FormFields.
+    Reads the in-process FormField registry (see EntryApp.form_registry), so
+    this costs no queries once the registry is loaded.
 
     Takes: 
     - int year (must be 1960, 1970, 1980, or 1990)
@@ -188,13 +256,14 @@ def get_form_fields( year, form_type ):
 
     if year in allowed_years and form_type in allowed_forms:
 
-        field_query = FormField.objects.filter(year=year).filter(form_type=form_type)
-        adapter.info(
-            f'FormField query length was {len(field_query)}',
-            # {'user': '_'}
+        field_names = form_registry.get_form_fields(year, form_type)
+        adapter.lazy(
+            logging.DEBUG,
+            'FormField registry length was %s',
+            lambda: len(field_names),
         )
         
-        return [f.field_name for f in list(field_query)]
+        return field_names
 
     else:
 
@@ -206,13 +275,60 @@ def get_form_fields( year, form_type ):
         return []
 
 
-def make_batch_done_true(keyer_jbid):
+# what CodeImage reads for each image type, fetched up front so the prepare_*
+#     methods and templates don't each run their own lazy queries
+CODE_IMAGE_PREFETCH = {
+    choices.IMAGE_TYPE_BREAKER: [
+        Prefetch( 'breaker_set', queryset = Breaker.objects.order_by( 'id' ) ),
+    ],
+    choices.IMAGE_TYPE_SHEET: [
+        Prefetch( 'sheet_set', queryset = Sheet.objects.order_by( 'id' ) ),
+        Prefetch( 'sheet_set__record_set', queryset = Record.objects.order_by( 'line_no', 'col_no' ) ),
+    ],
+    choices.IMAGE_TYPE_LONGFORM: [
+        Prefetch( 'longform1990_set', queryset = LongForm1990.objects.order_by( 'id' ) ),
+    ],
+    choices.IMAGE_TYPE_OTHER: [
+        Prefetch( 'otherimage_set', queryset = OtherImage.objects.order_by( 'id' ) ),
+    ],
+}
+
+
+def get_code_image( image_id ):
+    '''
+    Loads an image for CodeImage in one planned fetch: the image with its
+    ImageFile, reel and related-object flags in one query, then whatever its
+    type needs (breakers, or sheets and their ordered records, ...) in one
+    query per relation.
+
+    Takes:
+    - image id
+    Returns:
+    - Image instance
+    '''
+
+    image_OUT = Image.objects.with_related_flags().select_related(
+        'image_file__img_reel'
+    ).get( pk = image_id )
+
+    prefetch_list = CODE_IMAGE_PREFETCH.get( image_OUT.image_type, [] )
+    if prefetch_list:
+        prefetch_related_objects( [ image_OUT ], *prefetch_list )
+
+    return image_OUT
+
+
+def make_batch_done_true(keyer_jbid, next_image = None, **fields):
     '''
     Helper method to track whether last image in batch is done
-    Method should be called when an image is completed
+    Method should be called when an image is completed. Also points
+    CurrentEntry at the keyer's next image, and sets any other CurrentEntry
+    fields passed in, in the same UPDATE.
 
     Takes:
     - string keyer jbid
+    - optional next Image to code (see dashboard.get_next_todo_image())
+    - optional other CurrentEntry field values, e.g. breaker
     Returns:
     - None
     '''
@@ -224,9 +340,7 @@ def make_batch_done_true(keyer_jbid):
 
     try:
         # now update CurrentEntry batch position
-        current = CurrentEntry.objects.get(jbid = keyer_jbid)
-        current.batch_position = 1 
-        current.save()
+        advance_current_entry(keyer_jbid, next_image, batch_position = 1, **fields)
 
     except:
 
@@ -236,13 +350,14 @@ def make_batch_done_true(keyer_jbid):
         )
 
 
-def compute_batch_position(current_username):
+def compute_batch_position(current_username, current_entry = None):
     '''
     Helper function
     Where are we in this batch of images?
 
     Takes:
     - string username
+    - optional CurrentEntry instance (saves a lookup if caller has one)
     Returns:
     - tuple: (current batch position, num images left in batch)
     '''
@@ -250,7 +365,8 @@ def compute_batch_position(current_username):
     me = "compute_batch_position()"
 
     # get user and current info
-    current_entry = CurrentEntry.objects.get(jbid=current_username)
+    if current_entry is None:
+        current_entry = CurrentEntry.objects.get(jbid=current_username)
     current_reel = current_entry.reel
     current_image = current_entry.img
     current_position_in_reel = current_image.image_file.img_position
@@ -261,41 +377,12 @@ def compute_batch_position(current_username):
         {'user': current_username}
     )
 
-    # figure out batch size, handling corner case where batch_size > # images left in reel
-    # case 1: # images in reel is evenly divisible by batch size, easy
-    if num_images_in_reel % BATCH_SIZE == 0:
-        batch_size = BATCH_SIZE
-
-        adapter.info(
-            f'{me}: case 1: batch_size is {batch_size}',
-            {'user': current_username}
-        )
-
-    # case 2: # images not evenly divisible by batch size, need to compute final batch size and figure out where we are relative to end of the reel
-    else:
-        num_standard_batches = num_images_in_reel // BATCH_SIZE
-
-        adapter.info(
-            f'{me}: case 2',
-            {'user': current_username}
-        )
-
-        if current_position_in_reel >= BATCH_SIZE * num_standard_batches:
-            batch_size = num_images_in_reel % BATCH_SIZE + 1 # otherwise off by one error
-            adapter.info(
-                f'{me}: case 2B: batch_size is {batch_size}',
-                {'user': current_username}
-            ) 
-        else:
-            batch_size = BATCH_SIZE
-            adapter.info(
-                f'{me}: case 2A: batch_size is {batch_size}',
-                {'user': current_username}
-            ) 
-
-    # modular arithmetic to compute where we are in a batch    
-    current_batch_position = current_position_in_reel % batch_size
-    num_images_left = batch_size - current_batch_position
+    # figure out batch size, handling corner case where batch_size > # images
+    # left in reel, and where we are in the batch
+    current_batch_position, num_images_left, batch_size = compute_batch_numbers(
+        current_position_in_reel,
+        num_images_in_reel
+    )
 
     adapter.info(
         f"{me}: current_batch_position is {current_batch_position}, num_left is {num_images_left}, batch_size is {batch_size}", #, batch_done is {batch_done}
@@ -322,8 +409,7 @@ def get_next_image(request):
 
     # get user to-do image lists
     todo_image_qs = get_image_todo_qs( request )
-    todo_image_count = todo_image_qs.count()
-    next_image = todo_image_qs.first()
+    next_image = todo_image_qs.select_related('image_file').first()
 
     adapter.info(
         f'get_next_image got {next_image}',
@@ -332,11 +418,7 @@ def get_next_image(request):
 
     if next_image:
 
-        current = CurrentEntry.objects.get(jbid=request.user)
-        next_image_file = next_image.image_file
-        current.img = next_image
-        current.image_file = next_image_file
-        current.save()
+        point_current_entry_to_image(get_current_entry(request), next_image)
 
 #-- END function get_next_image() --#
 
@@ -395,16 +477,13 @@ def get_image_todo_qs( request ):
     current_username = current_user.username
 
     # get list of images in this reel 
-    current_reel = CurrentEntry.objects.get(jbid = current_username).reel
-    reel_image_qs = Image.objects.filter(image_file__img_reel = current_reel)
-    user_image_qs = reel_image_qs.filter(jbid = current_username)
-    todo_image_qs = user_image_qs.filter( is_complete = False )
-
-    # order according to ImageFile name instead of id in case loaded wrong?
-    todo_image_qs = todo_image_qs.order_by("image_file__img_position")
+    current_reel = get_current_entry(request).reel
+    todo_image_qs = get_todo_image_qs(current_username, current_reel)
 
-    adapter.info(
-        f'get_image_todo_qs() reel_image_qs length {len(reel_image_qs)}, todo_image_qs length {len(todo_image_qs)}',
+    # off unless LOG_QUERYSET_COUNTS is set; COUNT(*) only, no rows
+    adapter.count(
+        'get_image_todo_qs() todo_image_qs',
+        todo_image_qs,
         user = current_username
     )
 
@@ -446,8 +525,8 @@ def initialize_context( request_IN, dict_IN = None ):
     # param names
     dict_OUT[ CONTEXT_PARAM_NAMES ] = PARAM_NAMES
 
-    # retrieve things from current
-    current = CurrentEntry.objects.get( jbid = request_IN.user )
+    # retrieve things from current (memoized on the request)
+    current = get_current_entry( request_IN )
     dict_OUT[ CONTEXT_BREAKER_INSTANCE ] = current.breaker
     dict_OUT[ CONTEXT_USERNAME ] = request_IN.user.username 
 
@@ -472,71 +551,22 @@ def assign_reel(keyer):
     me = 'assign_reel()'
     this_reel = None
 
-    # - take the ones that have 0 or 1 keyer assigned
-    # - exclude the 1990 dummy breaker reel
-    # - exclude ones already assigned to this keyer
-    reel_qs = Reel.objects.filter(keyer_count__lt = 2)
-    reel_qs = reel_qs.exclude(reel_name = 'dummy_breaker_reel')
-    reel_qs = reel_qs.exclude(Q(keyer_one = keyer) | Q(keyer_two = keyer))
+    # one transaction: lock the first free reel (skipping any another keyer
+    # holds), take the slot and bulk create this keyer's Images
+    this_reel = assign_next_reel(keyer)
 
     # do we have any reels to assign?
-    if len(reel_qs) == 0:
+    if this_reel is None:
         adapter.info(
             f'{me}: found no reels to assign',
             user = keyer.jbid
         )
         return None
 
-    # prefer to assign reels that have 0 keyers over those that have 1
-    # then assign reels with lower IDs (i.e. those loaded earlier) over higher
-    # take the one at the top
-    ordered_reel_qs = reel_qs.order_by('keyer_count', 'id')
     adapter.info(
-        f'reel queue is {list(ordered_reel_qs)}'
+        f'{me}: assigned {this_reel}',
+        user = keyer.jbid
     )
-    this_reel = ordered_reel_qs[0]
- 
-    # set the keyer
-    if this_reel.keyer_one is None:
-        this_reel.keyer_one = keyer
-
-    elif this_reel.keyer_two is None:
-        this_reel.keyer_two = keyer
-
-    else:
-        adapter.warn(
-            f'assign_images() reel has a keyer issue /n keyer one is {this_reel.keyer_one} keyer two is {this_reel.keyer_two}',
-            user = keyer.jbid
-        )
-        raise ValueError
-
-    # increment reel keyer count
-    this_reel.keyer_count += 1
-    this_reel.save()
-
-    # also increment keyer reel count
-    keyer.reel_count += 1
-    keyer.save()
-
-    # now, get year and associated image files 
-    year = this_reel.year
-    image_file_qs = ImageFile.objects.filter(img_reel_id = this_reel)
-
-    # loop through and create Image instance w/this keyer 
-    for image_file_instance in image_file_qs:
-
-        img = Image( 
-                image_file=image_file_instance, \
-                jbid=keyer.jbid, \
-                is_complete=False, \
-                year=year,
-                image_type=None, \
-                problem=False
-            )
-        img.save()
-
-
-    #-- END loop over images in the reel --#
 
     return this_reel
 
@@ -551,8 +581,6 @@ def seed_current_entry(request):
     '''
 
     # declare variables
-    current_qs = None
-    current_count = None
     this_image = None
     this_breaker = None
     current = None
@@ -562,13 +590,13 @@ def seed_current_entry(request):
         user = request.user.username
     )
 
-    # got a current for current user?
-    current_qs = CurrentEntry.objects.filter(jbid=request.user)
-    current_count = current_qs.count()
-    this_keyer = Keyer.objects.get(jbid=request.user)
+    # got a current for current user? (memoized, so this is free later on)
+    current = get_current_entry(request)
 
     # if this user doesn't have a row in CurrentEntry, we need to do stuff
-    if ( current_count == 0 ):
+    if ( current is None ):
+
+        this_keyer = Keyer.objects.get(jbid=request.user)
 
         # does this keyer have any reels assigned?
         reel_qs = Reel.objects.filter(Q(keyer_one = this_keyer) | Q(keyer_two = this_keyer))
@@ -600,7 +628,8 @@ def seed_current_entry(request):
         )
         current.save()
 
-
+        # refresh the request-level copy so later helpers see the new row
+        get_current_entry(request, refresh = True)
 
     #-- END check to see if we need to create current for new user. --#
 
@@ -756,73 +785,113 @@ class IndexView(LoginRequiredMixin, TemplateView):
         return context_OUT
 
 
-    def action_load_next_reel(self, current_username):
+    def action_load_next_reel(self, current_username, from_reel_id, context_IN):
         '''
         Helper method to put next reel in queue for a keyer. It is called from
-        IndexView.process_request(). It populates CurrentEntry with a new reel
-        when a keyer clicks the button. 
+        IndexView.process_request() when a keyer clicks the button. Moving to
+        the next reel (see reel_allocator.move_keyer_to_next_reel()):
 
-        - marks the existing reel in CurrentEntry (if there is one) complete
-        for that keyer
-        - queries DB for a new reel for that keyer
+        - marks the existing reel in CurrentEntry complete for that keyer
+        - queries DB for a new reel for that keyer and creates their Images
         - saves that reel in CurrentEntry for that keyer
-        - returns boolean: True if we're out of reels, False otherwise
+
+        If the warm pool already holds a reel for this keyer (see
+        reel_allocator.fill_reel_pool()), this is only a pointer flip and
+        runs in this request. Otherwise, with settings.REEL_ASSIGN_IN_BACKGROUND
+        on, it is queued as a ReelJob for the run_reel_jobs worker and the page
+        shows a "preparing your reel" state until it is done; with it off it
+        runs in this request.
+
+        Nothing moves if the keyer is no longer on from_reel_id, so a second
+        click or a resubmitted form can't complete a reel they just started.
+
+        Takes:
+        - string keyer jbid
+        - integer id of the reel the keyer is moving on from
+        - context dict
+        Returns:
+        - modified context dict
         '''
 
-        me = 'IndexView.get_next_reel()'
-        current = CurrentEntry.objects.get(jbid = current_username)
-        this_keyer = Keyer.objects.get(jbid = current_username)
+        me = 'IndexView.action_load_next_reel()'
+        context_OUT = context_IN
 
         adapter.info(
             f"{me}: loading new reel",
             user = current_username
         )
 
-        # is there a reel in CurrentEntry? mark complete if so
-        if current.reel:
+        this_reel = claim_provisioned_reel(current_username, from_reel_id = from_reel_id)
 
-            old_reel = current.reel
+        if this_reel:
 
             adapter.info(
-                f"{me}: replacing {old_reel}",
+                f"{me}: claimed provisioned {this_reel}",
+                user = current_username
+            )
+
+            context_OUT[ 'out_of_reels' ] = False
+
+        elif getattr(settings, 'REEL_ASSIGN_IN_BACKGROUND', False):
+
+            reel_job = enqueue_assign_next_reel(current_username, from_reel_id)
+
+            adapter.info(
+                f"{me}: queued {reel_job}",
                 user = current_username
             )
-            
-            # which keyer is this? mark old reel complete
-            # handle case where first slot is null because we meddled
-            if old_reel.keyer_one and old_reel.keyer_one.jbid == current_username:     
-                old_reel.is_complete_keyer_one = True
-                old_reel.save()
-            
-            elif old_reel.keyer_two.jbid == current_username:
-                old_reel.is_complete_keyer_two = True
-                old_reel.save()
 
+            context_OUT[ 'reel_job' ] = reel_job
+
+            # a resubmitted form gets the job that already ran
+            if reel_job.is_active:
+                context_OUT[ 'preparing_reel' ] = True
+                context_OUT[ 'make_next_reel_button_appear' ] = False
             else:
-                adapter.exception(
-                    f"{me}: user is not assigned to either keyer slot in this reel",
-                    user = current_username
-                )
-                raise ValueError
+                context_OUT[ 'out_of_reels' ] = reel_job.result.get( 'reel_id' ) is None
+
+        else:
 
-        # if not, assign the reel:
-        #   priority goes to reels with one other keyer assigned
-        #   then to reels with lower IDs 
-        this_reel = assign_reel(this_keyer)
+            this_reel = move_keyer_to_next_reel(current_username, from_reel_id = from_reel_id)
 
-        # this is what happens if we got a new reel to assign
-        # boolean seems backwards but it should be False
-        if this_reel:
+            # out_of_reels is True if there was nothing left for this keyer
+            context_OUT[ 'out_of_reels' ] = this_reel is None
 
-            # then update CurrentEntry
-            current.reel = this_reel
-            current.save()        
-            return False
-        
-        # handle case where we're out of reels
-        else: 
+        return context_OUT
+
+
+    def add_reel_job_context(self, current_username, context_IN):
+        '''
+        When the keyer's reel is finished, checks on their latest "next reel"
+        job: still running means show "preparing your reel", finished with
+        no reel means they are out of reels.
+
+        Takes:
+        - string keyer jbid
+        - context dict
+        Returns:
+        - modified context dict
+        '''
+
+        context_OUT = context_IN
+        reel_job = get_latest_keyer_job(current_username)
+
+        if reel_job is None:
+            return context_OUT
+
+        context_OUT[ 'reel_job' ] = reel_job
+
+        if reel_job.is_active:
+            context_OUT[ 'preparing_reel' ] = True
+            context_OUT[ 'make_next_reel_button_appear' ] = False
 
-            return True
+        elif reel_job.status == choices.REEL_JOB_FAILED:
+            context_OUT[ 'reel_job_failed' ] = True
+
+        elif reel_job.result.get( 'reel_id', 0 ) is None:
+            context_OUT[ 'out_of_reels' ] = True
+
+        return context_OUT
 
 
     def get(self, request):
@@ -862,28 +931,6 @@ class IndexView(LoginRequiredMixin, TemplateView):
     #-- END method post() --#
 
 
-    def prepare_recent_image_queue(self, user_image_qs):
-        '''
-        Helper method to get most recent images: 
-        - completed images with a year and a type, but not 1990 breakers
-        - order images based on most recently modified to least recently modified
-        - limited to recent_image limit (defined in process_request)
-        '''
-        me = "IndexView:prepare_recent_image_queue()"
-
-        recent_image_qs = user_image_qs.filter( Q( year__isnull = False ) | Q( image_type__isnull = False ) )
-        recent_image_qs = recent_image_qs.filter(is_complete = True)
-        recent_image_qs = recent_image_qs.exclude( (Q(year__exact = 1990) & Q(image_type__contains = 'breaker'))) # exclude 1900 dummy breaker
-        recent_image_qs = recent_image_qs.order_by( '-last_modified' )
-        recent_image_qs = recent_image_qs[ : self.recent_image_limit ]
-
-        adapter.info(
-            f'{me}: recent_image_qs is {recent_image_qs}'
-        )
-
-        return list( recent_image_qs )
-        
-
     def process_request( self, request ):
 
         # return reference
@@ -897,14 +944,11 @@ class IndexView(LoginRequiredMixin, TemplateView):
         # batch_size = None
         current_user = None
         current_username = None
-        user_image_qs = None
-        todo_image_qs = None
+        dashboard_state = None
         todo_image_count = None
-        recent_image_qs = None
-        # recent_image_limit = None
-        completed_image_qs = None
         completed_count = None
         next_image = None
+        batch_done = False
 
         request_inputs = get_request_data(request)
 
@@ -919,7 +963,12 @@ class IndexView(LoginRequiredMixin, TemplateView):
 
         # init state 
         seed_current_entry( request ) # ensures there's a value in CurrentEntry
-        get_next_image( request ) # gets the next image loaded into CurrentEntry
+
+        # counts, next image (loaded into CurrentEntry), recent images and
+        # batch numbers, all from a fixed handful of queries. Coming from an
+        # action that finished an image, the next image is handed over.
+        next_image_id = read_next_image( request_inputs.get( NEXT_IMAGE_PARAM ), request.user.username )
+        dashboard_state = load_dashboard_state( request, self.recent_image_limit, next_image_id )
         
         # prep context dict
         context = initialize_context( request ) 
@@ -931,33 +980,28 @@ class IndexView(LoginRequiredMixin, TemplateView):
         current_user = request.user
         current_username = current_user.username
         context[ "user" ] = current_user
-        current_entry = CurrentEntry.objects.get(jbid = current_username)
+        current_entry = dashboard_state[ 'current_entry' ]
 
-        # get user image queryset for this reel and get recent images
-        current_reel = current_entry.reel
-        image_qs = Image.objects.filter(image_file__img_reel = current_reel)
-        user_image_qs = image_qs.filter(jbid = current_username)
-        recent_image_qs = self.prepare_recent_image_queue(user_image_qs)
-        context[ 'recent_image_list' ] = recent_image_qs
+        # recent images for this reel
+        current_reel = dashboard_state[ 'current_reel' ]
+        context[ 'current_reel_id' ] = current_reel.id
+        context[ 'recent_image_list' ] = dashboard_state[ 'recent_image_list' ]
 
         adapter.info(
             f'{me}: current reel is {current_reel}',
             {'user': current_username}
         )
 
-        # get queue of images to code and add next image to context for thumbnail
-        todo_image_qs = get_image_todo_qs( request )
-        todo_image_ct = todo_image_qs.count()
-        next_image = todo_image_qs.first()
+        # queue of images to code and next image in context for thumbnail
+        todo_image_ct = dashboard_state[ 'todo_image_count' ]
+        next_image = dashboard_state[ 'next_image' ]
         context[ "todo_image_count" ] = todo_image_ct
         context[ 'next_image' ] = next_image
 
-        # timestamps_list.append(('after todo_image_qs before context stuff', datetime.datetime.now()))
-
         # get batch information for keyers
         if next_image:
 
-            current_batch_position, images_left_in_batch, batch_size = compute_batch_position(current_username)
+            current_batch_position, images_left_in_batch, batch_size = dashboard_state[ 'batch_numbers' ]
 
             # if batch_position == 0, we're at the end of a batch but haven't entered data yet
             if current_batch_position == 0: 
@@ -968,7 +1012,7 @@ class IndexView(LoginRequiredMixin, TemplateView):
                 
                 # set up button to appear when we finish this image
                 current_entry.batch_position = 1 # change to bool later
-                current_entry.save()
+                current_entry.save( update_fields = [ 'batch_position' ] )
 
                 adapter.info(
                     f'{me}: case 3A',
@@ -1007,12 +1051,11 @@ class IndexView(LoginRequiredMixin, TemplateView):
             context[ 'num_todo' ] = None
 
 
-        # timestamps_list.append(('after context stuff before sketchy action section', datetime.datetime.now()))
         # check if all images in reel or batch are completed
         # if so, reveal one of two buttons
         # - advance to next reel if more images needed (takes priority)
         # - advance to "new batch" if batch_position is zero
-        completed_count = user_image_qs.filter( is_complete = True ).count()
+        completed_count = dashboard_state[ 'completed_count' ]
 
         adapter.info(
             f'{me}(): completed_count is {completed_count}',
@@ -1026,7 +1069,9 @@ class IndexView(LoginRequiredMixin, TemplateView):
         if completed_count == current_reel.image_count:
             # this will reveal a button that has backend effects
             context[ 'make_next_reel_button_appear' ] = True
-            adapter.info(f'{context}')
+
+            # is a "next reel" job still running for this keyer?
+            context = self.add_reel_job_context( current_username, context )
         
         # this case will reveal a button that has no backend effects but will
         # allow user to trigger reset of count of images to do
@@ -1049,10 +1094,13 @@ class IndexView(LoginRequiredMixin, TemplateView):
                 {'user': current_username}
             )
 
-            # load new reel: out_of_reels is a boolean indicating if reel load worked
-            # if it didn't, it's probably because we're out of reels for that keyer 
-            out_of_reels = self.action_load_next_reel(current_username)
-            context[ 'out_of_reels' ] = out_of_reels
+            # the reel the button was shown for; falls back to the current
+            # reel for a post without one
+            reel_id_value = request_inputs.get( PARAM_NAME_REEL_ID, '' )
+            from_reel_id = int( reel_id_value ) if reel_id_value.isdigit() else current_reel.id
+
+            # load new reel, or queue it: sets out_of_reels or preparing_reel
+            context = self.action_load_next_reel(current_username, from_reel_id, context)
 
         elif action == ACTION_LOAD_NEXT_BATCH:
 
@@ -1165,13 +1213,15 @@ class CodeImage( LoginRequiredMixin, FormView ):
             # check for image ID
             if image_id:
 
-                # if we get one, mark as complete
-                image_instance = Image.objects.get(pk = image_id)
-                image_instance.is_complete = True
-                image_instance.save()
+                # if we get one, mark as complete (and count it), noting
+                #     where the keyer's next image is
+                image_instance = Image.objects.select_related('image_file').get(pk = image_id)
+                next_image = get_next_todo_image(request_IN.user.username, image_instance)
+                mark_image_complete(image_instance, current_position = get_image_position(next_image))
 
                 # also increment the pointer in CurrentEntry
-                make_batch_done_true(request_IN.user.username)
+                make_batch_done_true(request_IN.user.username, next_image)
+                context_IN[ CONTEXT_NEXT_IMAGE ] = next_image
             
             else:
 
@@ -1233,14 +1283,14 @@ class CodeImage( LoginRequiredMixin, FormView ):
             inputs_IN = get_request_data( request_IN )
 
             # get current reel for year and state info
-            current = CurrentEntry.objects.get(jbid = request_IN.user.username)
-            current_reel = Reel.objects.get(id = current.reel_id)
+            current = get_current_entry( request_IN )
+            current_reel = current.reel
 
             # get image for ID 
             image_id = inputs_IN.get( PARAM_NAME_IMAGE_ID, None )
 
             if image_id:
-                image_instance = Image.objects.get( pk = image_id )
+                image_instance = Image.objects.with_related_flags().select_related( 'image_file' ).get( pk = image_id )
                 image_has_related_objects = image_instance.has_related_objects()
             else:
                 adapter.exception(
@@ -1258,16 +1308,22 @@ class CodeImage( LoginRequiredMixin, FormView ):
             # define fields based on which year it is
             breaker_fields = get_form_fields(image_instance.year, "breaker")
 
-            BreakerFormSet = modelformset_factory( 
+            BreakerFormSet = get_formset_class(
                 Breaker,
-                fields = breaker_fields,
-                formset = BaseBreakerFormSet 
+                image_instance.year,
+                "breaker",
+                formset = BaseBreakerFormSet,
+                fields = breaker_fields
             )
             formset = BreakerFormSet( inputs_IN, request_IN.FILES )
             helper = BreakerFormHelper(year=image_instance.year)
 
-            adapter.info(
-                f"{me}(): breaker formset is {formset}"
+            # rendering the formset is expensive, only do it at DEBUG
+            adapter.lazy(
+                logging.DEBUG,
+                "%s(): breaker formset is %s",
+                me,
+                formset
             )
 
             # get data from request
@@ -1336,16 +1392,13 @@ class CodeImage( LoginRequiredMixin, FormView ):
                     breaker_instance = Breaker.objects.create( **breaker_data )
 
                     # is it time to set Image to complete?
-                    image_instance.is_complete = True
-                    image_instance.save()
-
-                    # new breaker - update CurrentEntry with breaker and batch position
-                    current = CurrentEntry.objects.get( jbid = request_IN.user )
-                    current.breaker = breaker_instance
-                    current.save()
+                    next_image = get_next_todo_image( request_IN.user.username, image_instance )
+                    mark_image_complete( image_instance, current_position = get_image_position( next_image ) )
 
-                    # increment batch position
-                    make_batch_done_true(request_IN.user.username)
+                    # new breaker - update CurrentEntry with breaker, batch
+                    #     position and next image
+                    make_batch_done_true( request_IN.user.username, next_image, breaker = breaker_instance )
+                    context_IN[ CONTEXT_NEXT_IMAGE ] = next_image
 
                 #-- END check to see if new or existing --#
 
@@ -1411,7 +1464,7 @@ class CodeImage( LoginRequiredMixin, FormView ):
 
             # get image for ID
             image_id = inputs_IN.get( PARAM_NAME_IMAGE_ID, None )
-            image_instance = Image.objects.get( pk = image_id )
+            image_instance = Image.objects.with_related_flags().get( pk = image_id )
             image_has_related_objects = image_instance.has_related_objects()
 
             logger.info(
@@ -1582,7 +1635,6 @@ class CodeImage( LoginRequiredMixin, FormView ):
 
             # define fields based on which year it is
             fields = get_form_fields(1990, 'long') 
-            field_widgets = {f: choices.FORM_WIDGETS[f] for f in fields if f in choices.FORM_WIDGETS}
 
             # TODO: what should this condition actually check for?                
             if form:
@@ -1722,7 +1774,7 @@ class CodeImage( LoginRequiredMixin, FormView ):
 
             # get image for ID
             image_id = inputs_IN.get( PARAM_NAME_IMAGE_ID, None )
-            image_instance = Image.objects.get( pk = image_id )
+            image_instance = Image.objects.select_related( 'image_file' ).get( pk = image_id )
 
             # do we have an image ID?
             other_image_id = inputs_IN.get( PARAM_NAME_OTHER_IMAGE_ID, None )
@@ -1775,15 +1827,15 @@ class CodeImage( LoginRequiredMixin, FormView ):
                 ot_data['jbid'] = request_IN.user
                 ot_data['year'] = image_instance.year
                 ot_data['description'] = inputs_IN['description']
-                
+
+                next_image = get_next_todo_image( request_IN.user.username, image_instance )
 
                 try:                
                     with transaction.atomic():
                         other_image_instance = OtherImage.objects.create(**ot_data) 
 
                         # set Image to complete after initial creation
-                        image_instance.is_complete = True
-                        image_instance.save()
+                        mark_image_complete( image_instance, current_position = get_image_position( next_image ) )
 
                 except Exception as e:
 
@@ -1805,8 +1857,13 @@ class CodeImage( LoginRequiredMixin, FormView ):
                         error_list_OUT.append( error_message )
 
 
-                # increment current batch position
-                make_batch_done_true(request_IN.user.username)
+                # increment current batch position; only move on to the
+                #     next image if this one was saved
+                if ( len( error_list_OUT ) == 0 ):
+                    make_batch_done_true( request_IN.user.username, next_image )
+                    context_IN[ CONTEXT_NEXT_IMAGE ] = next_image
+                else:
+                    make_batch_done_true( request_IN.user.username )
 
             #-- END check to see if other image ID present --#
 
@@ -1936,6 +1993,10 @@ class CodeImage( LoginRequiredMixin, FormView ):
                         record_instance = Record.objects.create(**r_data)
 
                     #-- END check to see if this is a record create or update--#
+
+                    # hand the saved record back to the caller (save_record())
+                    if ( context_IN is not None ):
+                        context_IN[ CONTEXT_SAVED_RECORD ] = record_instance
                 
                 else:
 
@@ -2003,7 +2064,7 @@ class CodeImage( LoginRequiredMixin, FormView ):
 
             # get image for ID
             image_id = inputs_IN.get( PARAM_NAME_IMAGE_ID, None )
-            image_instance = Image.objects.get( pk = image_id )
+            image_instance = Image.objects.with_related_flags().get( pk = image_id )
             image_has_related_objects = image_instance.has_related_objects()
 
             form = inputs_IN
@@ -2213,15 +2274,15 @@ class CodeImage( LoginRequiredMixin, FormView ):
         #     instance for this image.
         # - pull in images, link to edit each, OR link to edit next image.
 
-        # is there an existing Breaker instance?
+        # is there an existing Breaker instance? (prefetched by get_code_image())
         breaker_qs = image_IN.breaker_set.all()
-        breaker_count = breaker_qs.count()
+        breaker_count = len( breaker_qs )
 
         # do we have a breaker?
         if ( breaker_count == 1 ):
 
             # yes, one match - get instance
-            my_breaker = breaker_qs.get()
+            my_breaker = breaker_qs[ 0 ]
 
             # set up form so it displays current, doesn't output extra.
             formset_extra_count = 0
@@ -2253,16 +2314,15 @@ class CodeImage( LoginRequiredMixin, FormView ):
         context_OUT[ CONTEXT_BREAKER_INSTANCE ] = my_breaker
 
         # set up form.
-        field_qs = FormField.objects.filter( year = image_IN.year )
-        field_qs = field_qs.filter( form_type = "breaker" )
-        logger.info( f'{me}: FormField query length was {len(field_qs)}' )
-        breaker_fields = [f.field_name for f in list(field_qs)]
+        breaker_fields = get_form_fields( image_IN.year, "breaker" )
 
-        BreakerFormSet = modelformset_factory(
+        BreakerFormSet = get_formset_class(
             Breaker,
-            fields = breaker_fields,
+            image_IN.year,
+            "breaker",
             formset = BaseBreakerFormSet,
-            extra = formset_extra_count
+            extra = formset_extra_count,
+            fields = breaker_fields
         )
         formset = BreakerFormSet( queryset = breaker_qs )
         helper = BreakerFormHelper(year = image_IN.year)
@@ -2296,6 +2356,9 @@ class CodeImage( LoginRequiredMixin, FormView ):
         context_OUT[ "reel_name" ] = image_IN.image_file.img_reel.reel_name
         context_OUT[ "slug" ] = image_IN.image_file.smaller_image_file_name
 
+        # the viewer opens the tile pyramid instead, once the image has one
+        context_OUT[ "viewer_slug" ] = image_IN.image_file.tile_source_name or image_IN.image_file.smaller_image_file_name
+
         # does image have related objects?
         image_has_related_objects = image_IN.has_related_objects()
 
@@ -2308,10 +2371,8 @@ class CodeImage( LoginRequiredMixin, FormView ):
             image_form_values[ PARAM_NAME_YEAR ] = image_IN.year
             image_form_values[ PARAM_NAME_IMAGE_TYPE ] = image_IN.image_type
 
-            # look up reel name
-            username = context_IN[ CONTEXT_USERNAME ]
-            current = CurrentEntry.objects.get(jbid = username)
-            reel_name = current.reel.reel_name 
+            # reel name of the image's own reel (fetched with the image)
+            reel_name = image_IN.image_file.img_reel.reel_name
 
             # create image form(s).
             # note we do want reel_name here because this is how we check for long form 1990
@@ -2340,13 +2401,13 @@ class CodeImage( LoginRequiredMixin, FormView ):
         context_OUT = context_IN
         longform_instance = None
 
-        # look up existing instance for this image
-        longform_qs = image_IN.longform1990_set.all()
+        # look up existing instance for this image (prefetched by get_code_image())
+        longform_list = list( image_IN.longform1990_set.all() )
 
         # there shouldn't be more than one
-        if longform_qs.count() == 1:
-            longform_instance = longform_qs.get()
-        elif longform_qs.count() > 1:
+        if len( longform_list ) == 1:
+            longform_instance = longform_list[ 0 ]
+        elif len( longform_list ) > 1:
             adapter.error(
                 f"Multiple 1990 long forms associated with image {image_IN}.",
                 {'user': "_"}
@@ -2356,11 +2417,10 @@ class CodeImage( LoginRequiredMixin, FormView ):
 
         # define fields based on which year it is
         fields = get_form_fields(1990, 'long') 
-        field_widgets = {f: choices.FORM_WIDGETS[f] for f in fields if f in choices.FORM_WIDGETS}
 
         # - render form, populated if there is already a longform
         #     instance for this image.
-        LongForm1990Form = modelform_factory(LongForm1990, fields=fields, widgets = field_widgets)
+        LongForm1990Form = get_form_class(LongForm1990, 1990, 'long', fields = fields)
         helper = LongFormHelper(year='1990')
 
         if longform_instance:
@@ -2369,6 +2429,9 @@ class CodeImage( LoginRequiredMixin, FormView ):
         else:
             this_form = LongForm1990Form()
 
+            # blank form: reuse its cached HTML instead of rendering it
+            context_OUT[ CONTEXT_LONGFORM_FORM_HTML ] = get_blank_form_html( LongForm1990Form, LongFormHelper, '1990' )
+
         context_OUT[ CONTEXT_LONGFORM_FORM ] = this_form
         context_OUT[ CONTEXT_LONGFORM_HELPER ] = helper
 
@@ -2388,18 +2451,20 @@ class CodeImage( LoginRequiredMixin, FormView ):
         context_OUT = context_IN
         this_other_image = None
 
-        # look up existing instance for this image
-        other_image_qs = image_IN.otherimage_set.all()
+        # look up existing instance for this image (prefetched by get_code_image())
+        other_image_list = list( image_IN.otherimage_set.all() )
 
-        adapter.info(
-            f"{me}(): other_image_qs is {other_image_qs}",
-            {'user': "_"}
+        adapter.lazy(
+            logging.DEBUG,
+            "%s(): other_image_list is %s",
+            me,
+            other_image_list
         )
 
         # there shouldn't be more than one
-        if other_image_qs.count() == 1:
-            this_other_image = other_image_qs.get()
-        elif other_image_qs.count() > 1:
+        if len( other_image_list ) == 1:
+            this_other_image = other_image_list[ 0 ]
+        elif len( other_image_list ) > 1:
             adapter.error(
                 f"Multiple OtherImages associated with image {image_IN}.",
                 {'user': "_"}
@@ -2434,13 +2499,14 @@ class CodeImage( LoginRequiredMixin, FormView ):
         context_OUT = context_IN
 
         # look up parent sheet instance (relying on Jon's error check in prepare_sheet_context)
-        parent_sheet = image_IN.sheet_set.get()  
+        parent_sheet = context_IN[ CONTEXT_SHEET_INSTANCE ]
 
-        # look up associated record(s) and sort in order of keyed row/column
-        # line_no is filled in for 1960/1970; col_no for 1980/1990, but whichever
-        # is null will be null for all records on sheet -> does not affect sort
-        record_qs = parent_sheet.record_set.all().order_by('line_no', 'col_no')
-        record_count = record_qs.count()
+        # associated record(s), prefetched by get_code_image() sorted in order
+        # of keyed row/column: line_no is filled in for 1960/1970; col_no for
+        # 1980/1990, but whichever is null will be null for all records on
+        # sheet -> does not affect sort
+        record_qs = parent_sheet.record_set.all()
+        record_count = len( record_qs )
 
         # DEBUG
         adapter.info(
@@ -2454,9 +2520,8 @@ class CodeImage( LoginRequiredMixin, FormView ):
 
         # set up form.
         record_fields = get_form_fields( parent_sheet.year, 'short' ) #TODO: THIS SHOULD NOT BE HARD-CODED
-        field_widgets = {f: choices.FORM_WIDGETS[f] for f in record_fields if f in choices.FORM_WIDGETS}
 
-        RecordForm = modelform_factory(Record, fields = record_fields, widgets = field_widgets)
+        RecordForm = get_form_class(Record, parent_sheet.year, 'short', fields = record_fields)
         helper = RecordFormHelper(year=parent_sheet.year)
 
         # get the action from context
@@ -2473,7 +2538,10 @@ class CodeImage( LoginRequiredMixin, FormView ):
             record_instance = context_IN[ CONTEXT_RECORD_INSTANCE ]
 
         elif my_action == ACTION_EDIT_RECORD:
-            record_instance = Record.objects.get(id=record_id)            
+            # usually one of this sheet's records, which we already have
+            record_instance = { str( r.id ): r for r in record_qs }.get( str( record_id ) )
+            if record_instance is None:
+                record_instance = Record.objects.get(id=record_id)
 
         else:
             record_instance = None
@@ -2494,6 +2562,9 @@ class CodeImage( LoginRequiredMixin, FormView ):
         else:
             form = RecordForm()
 
+            # blank form: reuse its cached HTML instead of rendering it
+            context_OUT[ CONTEXT_RECORD_FORM_HTML ] = get_blank_form_html( RecordForm, RecordFormHelper, parent_sheet.year )
+
         context_OUT[ CONTEXT_RECORD_FORM ] = form
         context_OUT[ CONTEXT_RECORD_FORMSET_HELPER ] = helper
         context_OUT[ CONTEXT_RECORD_LIST ] = record_qs
@@ -2532,12 +2603,12 @@ class CodeImage( LoginRequiredMixin, FormView ):
 
 
         # - look up sheet instance for this image (could be None).
-        # is there an existing Sheet instance?
+        # is there an existing Sheet instance? (prefetched by get_code_image())
         sheet_qs = image_IN.sheet_set.all()
-        sheet_count = sheet_qs.count()
+        sheet_count = len( sheet_qs )
 
         if ( sheet_count == 1 ):
-            sheet_instance = sheet_qs.get()
+            sheet_instance = sheet_qs[ 0 ]
         elif ( sheet_count > 1 ):
             adapter.error( 
                 "Multiple sheets for image {image}. Not good.".format( image = image_IN ),
@@ -2549,10 +2620,9 @@ class CodeImage( LoginRequiredMixin, FormView ):
 
         # look up fields
         fields = get_form_fields(this_year, 'sheet')
-        widgets = {f: choices.FORM_WIDGETS[f] for f in fields if f in choices.FORM_WIDGETS}
 
         # set up form
-        SheetForm = modelform_factory(Sheet, fields=fields, widgets=widgets)
+        SheetForm = get_form_class(Sheet, this_year, 'sheet', fields = fields)
         helper = SheetFormHelper(year=this_year)
 
         # - if sheet instance:
@@ -2570,6 +2640,9 @@ class CodeImage( LoginRequiredMixin, FormView ):
 
             form = SheetForm()
 
+            # blank form: reuse its cached HTML instead of rendering it
+            context_OUT[ CONTEXT_SHEET_FORM_HTML ] = get_blank_form_html( SheetForm, SheetFormHelper, this_year )
+
         context_OUT[ CONTEXT_SHEET_FORM ] = form
         context_OUT[ CONTEXT_SHEET_HELPER ] = helper
 
@@ -2601,7 +2674,6 @@ class CodeImage( LoginRequiredMixin, FormView ):
         action_error_list = None
 
         # init
-        context = initialize_context( request_IN )
         error_list = list()
         request = request_IN
 
@@ -2729,6 +2801,45 @@ class CodeImage( LoginRequiredMixin, FormView ):
     #-- END method process_action() --#
 
 
+    def process_redirect_action( self, request_IN, request_inputs ):
+        '''
+        Runs one of the REDIRECT_ACTIONS (complete_image, update_breaker_type,
+        update_other_image) and redirects to the index, Post/Redirect/Get
+        style. The action looks up the keyer's next image and points
+        CurrentEntry at it; its ID goes to the index signed in the redirect
+        URL so IndexView uses it instead of looking it up again.
+
+        Takes:
+        - request
+        - request inputs
+        Returns:
+        - redirect response
+        '''
+
+        me = "CodeImage.process_redirect_action"
+
+        # the actions only put things in context, so they get an empty one
+        context = {}
+        error_list = self.process_action( request_IN, context )
+
+        # there's no page to show these on
+        if error_list:
+            adapter.warning(
+                f'{me}(): {request_inputs.get( PARAM_NAME_ACTION )} errors: {error_list}',
+                {'user': request_IN.user.username}
+            )
+
+        params = {}
+        if "popOut" in request_inputs:
+            params[ "popOut" ] = "true"
+        if context.get( CONTEXT_NEXT_IMAGE ) is not None:
+            params[ NEXT_IMAGE_PARAM ] = sign_next_image( request_IN.user.username, context[ CONTEXT_NEXT_IMAGE ] )
+
+        return redirect( "{}?{}".format( reverse( "EntryApp:index" ), urlencode( params ) ) )
+
+    #-- END method process_redirect_action() --#
+
+
     def process_request( self, request ):
 
         # return reference
@@ -2765,7 +2876,6 @@ class CodeImage( LoginRequiredMixin, FormView ):
 
         # init  
         return_template_name = self.template_name
-        context = initialize_context( request )
         error_list = list()
 
         # get request inputs (get or post)
@@ -2773,6 +2883,14 @@ class CodeImage( LoginRequiredMixin, FormView ):
         # if you need request_inputs in a prepare_context method, pass request_inputs in
         # please don't mess with the context
 
+        # actions that finish the image go straight back to the index: they
+        #     don't need this page's context
+        if ( ( request_inputs.get( PARAM_NAME_ACTION, None ) in REDIRECT_ACTIONS )
+            and request_inputs.get( PARAM_NAME_IMAGE_ID, None ) ):
+            return self.process_redirect_action( request, request_inputs )
+
+        context = initialize_context( request )
+
         # get current user info
         current_user = request.user.username
         context[ "user" ] = current_user
@@ -2805,26 +2923,13 @@ class CodeImage( LoginRequiredMixin, FormView ):
                     error_list.extend( returned_error_list )
                 #-- END check if process_action errors. --#
 
-                # if the action is complete_image, update_breaker_type, update_other_image, we return to the index
-                if my_action in [
-                    ACTION_COMPLETE_IMAGE, \
-                    ACTION_UPDATE_OTHER_IMAGE, \
-                    ACTION_UPDATE_BREAKER_TYPE
-                ]:
-                    
-                    popout = "popOut=true" if "popOut" in request_inputs else ""
-                    return redirect("{}?{}".format(reverse("EntryApp:index"), popout))
-                
-                #-- END check to see if action is completing image --#
-
             #-- END check to see if action. --#
 
             #------------------------------------------------------------------#
             # ==> Image
 
-            # retrieve image
-            image_qs = Image.objects.filter( pk = current_image_id )
-            current_image = image_qs.get()
+            # retrieve image, with everything the prepare_* methods need
+            current_image = get_code_image( current_image_id )
 
             # prepare image context
             context = self.prepare_image_context( current_image, context )
@@ -2913,6 +3018,312 @@ class CodeImage( LoginRequiredMixin, FormView ):
 
 #-- END class CodeImage --#
 
+#------------------------------------------------------------------------------#
+# RECORD SAVE VIEWS
+#------------------------------------------------------------------------------#
+
+@login_required
+def save_record(request):
+    '''
+    Saves one Record from the sheet page's record form and returns only the
+    parts of the page that change, so keying a sheet doesn't re-render the
+    whole CodeImage page (and restart the image viewer) for every person.
+
+    POST only. Takes the same inputs as the update_record action.
+
+    Returns JSON:
+    - record_id: ID of the saved record
+    - record_row_html: its row for the record list
+    - record_list_html: the whole record list, only when this is the sheet's
+        first record (the page has no list table yet)
+    - record_form_html: a fresh blank record form
+    - errors: list of error messages (status 400 when not empty; then
+        record_form_html is the keyer's form again, with what they typed)
+    '''
+
+    me = 'save_record'
+
+    if request.method != 'POST':
+        return JsonResponse({'errors': [f'{me}(): POST only']}, status = 405)
+
+    request_inputs = get_request_data(request)
+
+    try:
+        sheet_instance = Sheet.objects.select_related('img__image_file').get(
+            pk = request_inputs.get(PARAM_NAME_SHEET_ID),
+            img_id = request_inputs.get(PARAM_NAME_IMAGE_ID),
+        )
+    except (Sheet.DoesNotExist, ValueError):
+        return JsonResponse({'errors': [f'{me}(): no sheet for that sheet and image ID']}, status = 404)
+
+    # save through the same code as the full-page update_record action
+    context = {}
+    error_list = CodeImage().action_update_record(request, context)
+    record_instance = context.get(CONTEXT_SAVED_RECORD)
+    if record_instance is None:
+        error_list.append(f'{me}(): record was not saved')
+
+    year = sheet_instance.year
+    record_form_class = get_form_class(Record, year, 'short', fields = get_form_fields(year, 'short'))
+
+    fragment_context = {
+        'img': sheet_instance.img,
+        'record': record_instance,
+        CONTEXT_PARAM_NAMES: PARAM_NAMES,
+        CONTEXT_SHEET_INSTANCE: sheet_instance,
+    }
+
+    if error_list:
+
+        # the keyer's form back as they filled it in, so nothing is lost
+        record_id = request_inputs.get(PARAM_NAME_RECORD_ID)
+        if record_id and record_id.isdigit():
+            fragment_context[CONTEXT_RECORD_INSTANCE] = sheet_instance.record_set.filter(pk = record_id).first()
+        fragment_context[CONTEXT_RECORD_FORM] = record_form_class(data = request.POST)
+        fragment_context[CONTEXT_RECORD_FORMSET_HELPER] = RecordFormHelper(year = year)
+
+        return JsonResponse({
+            'record_form_html': render_to_string('EntryApp/includes/code-image-record-form.html', fragment_context, request),
+            'errors': error_list,
+        }, status = 400)
+
+    fragment_context[CONTEXT_RECORD_FORM] = record_form_class()
+    fragment_context[CONTEXT_RECORD_FORM_HTML] = get_blank_form_html(record_form_class, RecordFormHelper, year)
+
+    data_OUT = {
+        'record_id': record_instance.id,
+        'record_row_html': render_to_string('EntryApp/includes/code-image-record-row.html', fragment_context, request),
+        'record_form_html': render_to_string('EntryApp/includes/code-image-record-form.html', fragment_context, request),
+        'errors': [],
+    }
+
+    if not sheet_instance.record_set.exclude(pk = record_instance.pk).exists():
+        fragment_context[CONTEXT_RECORD_LIST] = [record_instance]
+        data_OUT['record_list_html'] = render_to_string(
+            'EntryApp/includes/code-image-record-list.html',
+            fragment_context,
+            request
+        )
+
+    return JsonResponse(data_OUT)
+
+#-- END function save_record() --#
+
+
+def save_record_batch(sheet_IN, row_list_IN, jbid_IN):
+    '''
+    Validates several records for one sheet with the sheet's record form
+    and, if every row is valid, writes them all in one transaction. A row
+    with a record_id updates that record of the sheet; a row without one
+    creates a record. Fields a row leaves out are saved blank, as when the
+    record form is submitted with them empty.
+
+    Takes:
+    - Sheet instance
+    - list of dicts of record field values (plus optional record_id)
+    - string jbid of the keyer
+    Returns:
+    - list of saved Records, in row order (empty if there were errors)
+    - list of {"index", "errors": {field: [messages]}} for invalid rows
+    '''
+
+    me = 'save_record_batch'
+    record_list_OUT = []
+    error_list_OUT = []
+
+    year = sheet_IN.year
+    record_fields = get_form_fields(year, 'short')
+    record_form_class = get_form_class(Record, year, 'short', fields = record_fields)
+
+    # the sheet's records this batch updates, in one query
+    record_id_list = [
+        str(row.get(PARAM_NAME_RECORD_ID)) for row in row_list_IN
+        if isinstance(row, dict) and str(row.get(PARAM_NAME_RECORD_ID)).isdigit()
+    ]
+    existing_records = {
+        str(pk): record for pk, record in sheet_IN.record_set.in_bulk(record_id_list).items()
+    }
+
+    seen_id_set = set()
+    for index, row in enumerate(row_list_IN):
+
+        if not isinstance(row, dict):
+            error_list_OUT.append({'index': index, 'errors': {'__all__': ['Row must be an object']}})
+            continue
+
+        row_errors = {}
+        unknown_fields = set(row) - set(record_fields) - {PARAM_NAME_RECORD_ID}
+        if unknown_fields:
+            row_errors['__all__'] = [f'Unknown field(s) for {int(year)} records: {", ".join(sorted(unknown_fields))}']
+
+        record_id = row.get(PARAM_NAME_RECORD_ID)
+        record_instance = None
+        if record_id not in (None, ''):
+            record_instance = existing_records.get(str(record_id))
+            if record_instance is None:
+                row_errors[PARAM_NAME_RECORD_ID] = [f'No record {record_id} on sheet {sheet_IN.id}']
+            elif str(record_id) in seen_id_set:
+                row_errors[PARAM_NAME_RECORD_ID] = [f'Record {record_id} is in the batch more than once']
+            seen_id_set.add(str(record_id))
+
+        form = record_form_class(data = row, instance = record_instance)
+        if not form.is_valid():
+            row_errors.update({field: list(message_list) for field, message_list in form.errors.items()})
+
+        if row_errors:
+            error_list_OUT.append({'index': index, 'errors': row_errors})
+        else:
+            record_list_OUT.append(form.save(commit = False))
+
+    #-- END loop over rows --#
+
+    if error_list_OUT:
+        adapter.info(
+            f'{me}(): {len(error_list_OUT)} of {len(row_list_IN)} rows invalid for sheet {sheet_IN.id}, nothing saved',
+            {'user': jbid_IN}
+        )
+        return [], error_list_OUT
+
+    now = timezone.now()
+    new_list = []
+    update_list = []
+    for record in record_list_OUT:
+        record.jbid = jbid_IN
+        record.timestamp = now
+        record.is_complete = True
+        if record.pk is None:
+            record.sheet = sheet_IN
+            new_list.append(record)
+        else:
+            # bulk_update() doesn't fill in auto_now fields
+            record.last_modified = now
+            update_list.append(record)
+
+    with transaction.atomic():
+
+        if update_list:
+            Record.objects.bulk_update(
+                update_list,
+                record_fields + ['jbid', 'timestamp', 'is_complete', 'last_modified']
+            )
+
+        # saved records' IDs go back to the client, and bulk_create() only
+        #     sets them where the backend can return inserted rows (postgres)
+        if connection.features.can_return_rows_from_bulk_insert:
+            Record.objects.bulk_create(new_list)
+        else:
+            for record in new_list:
+                record.save()
+
+    #-- END transaction --#
+
+    adapter.info(
+        f'{me}(): sheet {sheet_IN.id}: {len(new_list)} records created, {len(update_list)} updated',
+        {'user': jbid_IN}
+    )
+
+    return record_list_OUT, error_list_OUT
+
+#-- END function save_record_batch() --#
+
+
+@login_required
+def save_records(request):
+    '''
+    JSON API for keying several records of a sheet in one round trip (the
+    record form saves one per POST). Takes a POST whose body is JSON:
+
+        {"image_id": 12, "sheet_id": 34, "records": [{"line_no": "1", ...}, ...]}
+
+    with the CSRF token in the X-CSRFToken header. All rows are validated
+    first and nothing is saved unless every row is valid; see
+    save_record_batch().
+
+    Returns JSON:
+    - records: list of {"index", "record_id"}, one per row, when saved
+    - errors: list of {"index", "errors"} for invalid rows (status 400)
+    '''
+
+    me = 'save_records'
+
+    if request.method != 'POST':
+        return JsonResponse({'errors': [f'{me}(): POST only']}, status = 405)
+
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        payload = None
+
+    if not isinstance(payload, dict) or not isinstance(payload.get('records'), list):
+        return JsonResponse({'errors': [f'{me}(): body must be a JSON object with a "records" list']}, status = 400)
+
+    try:
+        sheet_instance = Sheet.objects.get(
+            pk = payload.get(PARAM_NAME_SHEET_ID),
+            img_id = payload.get(PARAM_NAME_IMAGE_ID),
+        )
+    except (Sheet.DoesNotExist, ValueError, TypeError):
+        return JsonResponse({'errors': [f'{me}(): no sheet for that sheet and image ID']}, status = 404)
+
+    record_list, error_list = save_record_batch(sheet_instance, payload['records'], request.user.username)
+
+    if error_list:
+        return JsonResponse({'records': [], 'errors': error_list}, status = 400)
+
+    return JsonResponse({
+        'records': [{'index': index, 'record_id': record.id} for index, record in enumerate(record_list)],
+        'errors': [],
+    })
+
+#-- END function save_records() --#
+
+#------------------------------------------------------------------------------#
+# PREFETCH VIEW
+#------------------------------------------------------------------------------#
+
+@never_cache
+@login_required
+def next_images(request):
+    '''
+    Lists the next images in the keyer's queue so the page can have the
+    browser fetch them ahead of time (see prefetchNextImages() in image.js).
+    The scans are hundreds of KB each; fetched while the keyer works on the
+    current image, the next one opens from the browser cache.
+
+    GET inputs:
+    - count: how many images (default settings.NEXT_IMAGE_PREFETCH_COUNT, at
+        most MAX_PREFETCH_IMAGE_COUNT)
+    - image_id: optional image to leave out, the one on screen
+
+    Returns JSON:
+    - images: list of {"image_id", "position", "url"}, in reel order
+    '''
+
+    # declare variables
+    count = None
+    exclude_image_id = None
+    current = None
+    image_list = []
+
+    request_inputs = request.GET
+
+    count = getattr(settings, 'NEXT_IMAGE_PREFETCH_COUNT', DEFAULT_PREFETCH_IMAGE_COUNT)
+    try:
+        count = int(request_inputs.get(PARAM_NAME_COUNT, count))
+        exclude_image_id = int(request_inputs[PARAM_NAME_IMAGE_ID]) if request_inputs.get(PARAM_NAME_IMAGE_ID) else None
+    except ValueError:
+        return JsonResponse({'images': [], 'errors': ['count and image_id must be integers']}, status = 400)
+
+    count = max(0, min(count, MAX_PREFETCH_IMAGE_COUNT))
+
+    current = get_current_entry(request)
+    if count and current is not None and current.reel_id is not None:
+        image_list = get_upcoming_images(request.user.username, current.reel_id, count, exclude_image_id)
+
+    return JsonResponse({'images': image_list})
+
+#-- END function next_images() --#
+
 #------------------------------------------------------------------------------#
 # PROBLEM VIEW
 #------------------------------------------------------------------------------#
@@ -90,6 +90,53 @@ LOGGING = {
     }
 }
 
+# opt-in debug counters: when True and the EntryApp logger is at DEBUG, views
+# log SELECT COUNT(*) for a few hot querysets (e.g. a keyer's todo queue)
+LOG_QUERYSET_COUNTS = False
+
+# rows per INSERT when creating a keyer's Images on reel assignment
+REEL_ASSIGN_BATCH_SIZE = 1000
+
+# queue "next reel" assignments for the run_reel_jobs worker instead of doing
+# them in the request. Needs `python manage.py run_reel_jobs` running.
+REEL_ASSIGN_IN_BACKGROUND = False
+
+# warm reel pool (`python manage.py fill_reel_pool`): reels kept assigned
+# ahead of time per active keyer, and hours without activity before a
+# keyer's pooled reels are given back
+REEL_POOL_DEPTH = 1
+REEL_POOL_IDLE_HOURS = 24
+
+# seconds between checks of the FormField version stamp; each app process
+# caches the FormField table and reloads it when load_form_fields bumps it
+FORM_FIELD_VERSION_CHECK_SECONDS = 30
+
+# upcoming images in the keyer's queue the code-image and landing pages
+# have the browser fetch ahead of time (at most 10)
+NEXT_IMAGE_PREFETCH_COUNT = 3
+
+# worker processes the shrink_reel job uses (None: one per CPU). Leave
+# some cores for the web server if the job worker runs on the app host.
+SHRINK_IMAGE_WORKERS = 2
+
+# halve images while decoding them (JPEG draft mode) in the shrink_reel job;
+# check the output on a sample reel first with `manage.py benchmark_shrink`
+SHRINK_IMAGE_FAST = False
+
+# final step in fast mode for odd-sized scans: "crop" (trim the odd pixel),
+# "bilinear", "bicubic" or "lanczos"; use the one benchmark_shrink --resample
+# passed with
+SHRINK_IMAGE_RESAMPLE = "crop"
+
+# encoder for the shrunk images the app serves: "jpeg", "progressive" or
+# "webp" (see SHRINK_ENCODERS in EntryApp/shrink_images.py). Compare them on
+# sample reels with `manage.py report_encoders` before switching. load_reel
+# records each ImageFile's variant, and picks this one if a reel has two.
+SHRINK_IMAGE_ENCODER = "jpeg"
+
+# worker processes the check_reel_quality job uses (None: one per CPU)
+IMAGE_QUALITY_WORKERS = 2
+
 
 ALLOWED_HOSTS = [
     'localhost',
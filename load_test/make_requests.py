@@ -212,6 +212,27 @@ if __name__ == '__main__':
     }
     post4 = make_post(s, code_image_url, record_data)
 
+    # add a whole sheet of records in one request (JSON batch API). The
+    # sheet's year may require more fields; the response lists any per row
+    batch_data = {
+        'image_id':  user_info['image_id'],
+        'sheet_id':  user_info['sheet_id'],
+        'records': [
+            {
+                'line_no': str(line_no),
+                'last_name':  user_info['last_name'],
+                'first_name': user_info['first_name'],
+                'age':  user_info['age'],
+            }
+            for line_no in range(1, int(user_info['num_records']) + 1)
+        ],
+    }
+    post4b = s.post(
+        make_url('code-image/save-records/'),
+        json=batch_data,
+        headers={'X-CSRFToken': s.cookies['csrftoken']},
+    )
+
     # mark image as complete
     complete_data = {
         'image_id':  user_info['image_id'],
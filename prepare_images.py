@@ -4,8 +4,16 @@ import os
 import pandas as pd
 import re
 import shutil
-
+import sys
+
+from EntryApp.image_pipeline import MANIFEST_NAME
+from EntryApp.image_pipeline import run_pipeline
+from EntryApp.shrink_images import DEFAULT_SHRINK_ENCODER
+from EntryApp.shrink_images import RESAMPLE_FILTERS
+from EntryApp.shrink_images import SHRINK_ENCODERS
+from EntryApp.shrink_images import get_small_image_list
 from EntryApp.shrink_images import shrink_reel_images_before_db
+from EntryApp.tile_images import tile_reel_images
 
 
 """
@@ -18,19 +26,30 @@ It will:
 - provided a count of shrunken images
 - remove full size images
 - provide a final count of images in directory
+- optionally (-t), cut the served images into Deep Zoom tiles for the viewer
+
+With --pipeline it does the same for every reel in one streaming pass
+instead (see EntryApp/image_pipeline.py): each directory is scanned once,
+per-image progress is kept in a SQLite manifest so an interrupted run
+resumes where it stopped, and shrinking, copying, tiling and removal
+overlap rather than running reel by reel.
 """
 
 
 
-def shrink_wrapper(dir_name, num_images):
+def shrink_wrapper(dir_name, num_images, max_workers = None, fast = False, resample = None, encoder = DEFAULT_SHRINK_ENCODER):
     '''
     Wraps shrink method from EntryApp.shrink_images to give it a try/except
 
     Takes:
     - directory name
     - expected number of images
+    - optional number of worker processes (default: one per CPU)
+    - optional boolean to shrink while decoding (see shrink_image())
+    - optional Pillow filter for fast mode's last step (see make_half_size())
+    - optional encoder for the small images (see SHRINK_ENCODERS)
     Returns:
-    - boolean based on success of shrinking
+    - boolean based on success of shrinking every image
     '''
 
     # get # of images here, so we can see if we're mid-copy
@@ -44,10 +63,11 @@ def shrink_wrapper(dir_name, num_images):
 
 
     try:
-        shrink_reel_images_before_db(dir_name)
-        print(f"\tShrunk images in {dir_name}.")
+        result = shrink_reel_images_before_db(dir_name, max_workers = max_workers, fast = fast, resample = resample, encoder = encoder)
+        print(f"\tShrunk {result['num_shrunk']} images in {dir_name} in {result['seconds']:.0f} s, {len(result['errors'])} errors.")
 
-        return True
+        # keep the full size images if any failed
+        return not result['errors']
 
     except Exception as e:
         print(e)
@@ -96,7 +116,7 @@ def copy_small_images(dir_name, dest):
 
         print(f"\tDestination directory {destination} already exists.")
 
-        if len(glob.glob(destination + "*.jpg")) != 0:
+        if len(glob.glob(destination + "*.jpg")) + len(get_small_image_list(destination.rstrip("/"))) != 0:
 
             print(f"\tDestination directory already contains images. Skipping.")
 
@@ -107,7 +127,7 @@ def copy_small_images(dir_name, dest):
         print(f"\tCreating destination directory {destination}...")
         os.mkdir(destination)
 
-    small_images_orig_path = glob.glob(dir_name + "/" + "*_smaller.jpg")
+    small_images_orig_path = get_small_image_list(dir_name)
     # print(f"small_images_orig_path is {small_images_orig_path[:10]}")
 
     small_images_new_path = [destination + i.split("/")[-1] for i in small_images_orig_path]
@@ -123,24 +143,81 @@ def copy_small_images(dir_name, dest):
     return
 
 
+def tile_wrapper(dir_name):
+    '''
+    Wraps tile method from EntryApp.tile_images to give it a try/except.
+    Tiles are built next to the images the app will serve, so they need to
+    be in their final directory.
+
+    Takes:
+    - directory filepath
+    Returns:
+    - boolean based on success of tiling
+    '''
+
+    try:
+        num_images, num_tiled = tile_reel_images(dir_name.rstrip("/"))
+        print(f"\tTiled {num_tiled} of {num_images} images in {dir_name}.")
+
+        return num_tiled == num_images
+
+    except Exception as e:
+        print(e)
+
+        return False
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Shrink images and remove full size versions')
     parser.add_argument( '-p', '--path', help='path down which to look', dest='filepath')
     parser.add_argument( '-d', '--destination', help='destination to move small images to', dest='destination')
+    parser.add_argument( '-w', '--workers', help='processes to shrink images with (default: one per CPU)', dest='workers', type=int)
+    parser.add_argument( '-f', '--fast', help='halve images while decoding (JPEG draft mode); see benchmark_shrink', dest='fast', action='store_true')
+    parser.add_argument( '-r', '--resample', help='final step in fast mode for odd-sized scans (default: crop)', dest='resample', choices=sorted(RESAMPLE_FILTERS), default='crop')
+    parser.add_argument( '-e', '--encoder', help=f'format for the small images (default: {DEFAULT_SHRINK_ENCODER})', dest='encoder', choices=list(SHRINK_ENCODERS), default=DEFAULT_SHRINK_ENCODER)
+    parser.add_argument( '-t', '--tiles', help='also build Deep Zoom tiles for the image viewer', dest='tiles', action='store_true')
+    parser.add_argument( '--pipeline', help='prepare all reels in one resumable streaming pass', dest='pipeline', action='store_true')
+    parser.add_argument( '-m', '--manifest', help=f'pipeline manifest (default: {MANIFEST_NAME} in the path)', dest='manifest')
     args = parser.parse_args()
 
     start_filepath = args.filepath
     dest = args.destination
+    tiles = args.tiles
+    workers = args.workers
+    fast = args.fast
+    resample = RESAMPLE_FILTERS[args.resample]
+    encoder = args.encoder
 
     parent_dir_contents = os.listdir(start_filepath)
     dir_list = [d for d in parent_dir_contents if os.path.isdir(start_filepath + d)]
 
+    if args.pipeline:
+
+        result = run_pipeline(
+            [start_filepath + d for d in sorted(dir_list)],
+            args.manifest or os.path.join(start_filepath, MANIFEST_NAME),
+            dest = dest,
+            tiles = tiles,
+            max_workers = workers,
+            fast = fast,
+            resample = resample,
+            encoder = encoder
+        )
+
+        print(f"{result['num_images']} images in {len(dir_list)} reels, {len(result['errors'])} errors in {result['seconds']:.0f} s.")
+        for error in result['errors']:
+            print(f"\t{error}")
+
+        sys.exit(1 if result['errors'] else 0)
+
     for d in dir_list:
 
         path_to_dir = start_filepath + d
-        num_images = len(glob.glob(path_to_dir + '/*.jpg'))
-        num_smaller_images = len(glob.glob(path_to_dir + "/*_smaller.jpg"))
+        small_image_list = get_small_image_list(path_to_dir)
+        num_smaller_images = len(small_image_list)
+        # every .jpg, plus small copies in other formats (.webp)
+        num_images = len(glob.glob(path_to_dir + '/*.jpg')) + len([i for i in small_image_list if not i.endswith('.jpg')])
 
         print(f"Reel directory {d} has {num_smaller_images} shrunk images out of {num_images}.")
 
@@ -153,7 +230,7 @@ if __name__ == "__main__":
         elif num_images > 0 and num_smaller_images == 0:
 
             print(f"\tDirectory {d} has {num_images} but it looks like we haven't shrunk them yet.")
-            shrunk_success = shrink_wrapper(path_to_dir, num_images)
+            shrunk_success = shrink_wrapper(path_to_dir, num_images, workers, fast, resample, encoder)
 
             if shrunk_success:
 
@@ -187,3 +264,10 @@ if __name__ == "__main__":
 
             print(f"\Directory {d} has an unexpected number of images. Please go look.")
 
+            continue
+
+        # tile where the small images will be served from
+        if tiles and num_images > 0:
+
+            tile_wrapper(dest + d if dest else path_to_dir)
+
@@ -1,83 +1,310 @@
 import argparse
-import glob
 import os
-import pandas as pd
 import re
 
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from EntryApp.image_quality import QUALITY_FLAGS
+from EntryApp.image_quality import check_images
+from EntryApp.shrink_images import SMALL_IMAGE_EXTENSIONS
+from EntryApp.shrink_images import SMALLER_SUFFIX
+
 """
 This module counts the number of images in reels and identifies
 any missing or strangely sized images.
+
+Each reel directory is read once with os.scandir, and every file's size is
+taken from that pass (one stat per file, kept with its name) instead of
+separate globs and getsize calls. Reels are read in a pool of threads, since
+on the storage mount the time goes on waiting for the file server rather
+than on this process. Image numbers go into integer arrays, so the gaps in a
+reel come from one set difference instead of a regex per name per check.
+
+It writes the per-reel summary (-o) and, next to it, a per-image anomaly
+table (-a): one row for each missing image number and for each file whose
+size is out of bounds (absolute) or far from its reel's median (relative).
+
+With -q it also decodes every checked image as a thumbnail, in a pool of
+processes, and flags truncated, corrupt, blank and black frames and odd
+aspect ratios (see EntryApp/image_quality.py). Those go in the same anomaly
+table; load_db.record_quality_report() copies them to ImageFile.quality_flags.
 """
 
-pd.set_option('max_rows', 50)
-pd.set_option('max_columns', 150)
+pd.set_option('display.max_rows', 50)
+pd.set_option('display.max_columns', 150)
 pd.set_option('mode.chained_assignment', None)
 
+# image number and kind of image from a file name, e.g. gr0012.jpg (full
+# size) or gr0012_smaller.jpg / gr0012_smaller.webp (shrunk)
+IMAGE_NAME_REGEX = re.compile(
+    r'(?P<number>[0-9]+)(?P<smaller>' + re.escape(SMALLER_SUFFIX) + r')?'
+    r'(?P<extension>' + '|'.join(re.escape(e) for e in SMALL_IMAGE_EXTENSIONS) + r')$'
+)
+
+# absolute bounds (bytes) for a shrunk image's size
+MIN_IMAGE_SIZE = 100000
+MAX_IMAGE_SIZE = 20 * 100000
+
+# relative bounds: sizes this far below / above the reel's median
+MEDIAN_FRACTION_SMALL = 0.25
+MEDIAN_MULTIPLE_LARGE = 4.0
+
+# reel directories read at once
+DEFAULT_WORKERS = 16
 
-def check_image_order(image_list, image_regex='[0-9]{4}(?=_smaller.jpg)'):
+ANOMALY_COLUMNS = ['path', 'image_number', 'file_name', 'anomaly', 'size', 'reel_median_size']
+
+
+def scan_reel(path_to_dir):
     '''
-    Check if image filenames monotonically increase by one with no gaps
+    Reads a reel directory once
 
     Takes:
-    - list of images (should come in sorted)
-    - regex to get image number from filename 
+    - reel directory filepath
     Returns:
-    - boolean indicating whether there's any missing images
-    - list of missing (empty if there are none)
+    - dict of 'full' and 'smaller', each a tuple of (array of image
+        numbers, array of sizes, list of file names), sorted by number
     '''
 
-    if len(image_list) == 0:
-        return False, []
+    found = {'full': ([], [], []), 'smaller': ([], [], [])}
+
+    with os.scandir(path_to_dir) as entry_list:
+        for entry in entry_list:
+
+            match = IMAGE_NAME_REGEX.search(entry.name)
+            if not match:
+                continue
+
+            # full-size scans are only ever .jpg
+            kind = 'smaller' if match.group('smaller') else 'full'
+            if kind == 'full' and match.group('extension') != '.jpg':
+                continue
 
-    first_image = image_list[0]
-    last_image = image_list[-1]
+            try:
+                if not entry.is_file():
+                    continue
+                size = entry.stat().st_size
+            except OSError:
+                print("Problem getting file size of {i}".format(i=entry.path))
+                continue
 
-    # construct list of expected image numbers
-    start_index = int(re.findall(image_regex, first_image)[0])
-    stop_index = int(re.findall(image_regex, last_image)[0])
-    ordered_indices = list(range(start_index, stop_index + 1))
-        
-    # construct list of actual image numbers
-    image_indices = [int(re.findall(image_regex, i)[0]) for i in image_list]
+            numbers, sizes, names = found[kind]
+            numbers.append(int(match.group('number')))
+            sizes.append(size)
+            names.append(entry.name)
 
-    # compare
-    missing = list(set(ordered_indices).difference(image_indices))
+    scan_OUT = {}
+    for kind, (numbers, sizes, names) in found.items():
+        numbers = np.array(numbers, dtype=np.int64)
+        order = np.argsort(numbers, kind='stable')
+        scan_OUT[kind] = (numbers[order], np.array(sizes, dtype=np.int64)[order], [names[i] for i in order])
+
+    return scan_OUT
+
+
+def check_image_order(image_numbers):
+    '''
+    Check if image numbers run from first to last with no gaps
+
+    Takes:
+    - array of image numbers (any order; duplicates are fine)
+    Returns:
+    - boolean indicating whether there are no missing images
+    - array of the missing numbers (empty if there are none)
+    '''
+
+    if len(image_numbers) == 0:
+        return True, np.array([], dtype=np.int64)
+
+    present = np.unique(image_numbers)
+    missing = np.setdiff1d(np.arange(present[0], present[-1] + 1), present, assume_unique=True)
 
     return len(missing) == 0, missing
 
 
-def count_abnormally_sized_files(image_list):
+def find_abnormally_sized_files(sizes, min_size=MIN_IMAGE_SIZE, max_size=MAX_IMAGE_SIZE):
     '''
-    Check for image file sizes that are abnormally small/large, which
-    might indicate a problem with scan quality
+    Flag image file sizes that are abnormally small/large, which might
+    indicate a problem with scan quality: outside fixed bounds, or far from
+    the reel's median size
 
     Takes:
-    - list of images
+    - array of file sizes
+    - optional absolute bounds in bytes
     Returns:
-    - count of very small images
-    - count of very large images
+    - dict of anomaly name -> boolean array over sizes ('too_small',
+        'too_large', 'small_for_reel', 'large_for_reel')
+    - median size (0 if there are no files)
     '''
 
-    too_small = 0
-    too_big = 0
+    median = float(np.median(sizes)) if len(sizes) else 0.0
 
-    for i in image_list:
+    flags_OUT = {
+        'too_small': sizes < min_size,
+        'too_large': sizes > max_size,
+        'small_for_reel': sizes < MEDIAN_FRACTION_SMALL * median,
+        'large_for_reel': sizes > MEDIAN_MULTIPLE_LARGE * median,
+    }
 
-        try:
-            size = os.path.getsize(i)
+    return flags_OUT, median
 
-            if size < 100000:
-                too_small += 1
-            elif size > (20 * 100000):
-                too_big += 1
-            else:
-                continue
 
-        except OSError:
+def diagnose_reel(path_to_dir, min_size=MIN_IMAGE_SIZE, max_size=MAX_IMAGE_SIZE):
+    '''
+    Scans a reel and checks it for gaps and odd sizes
+
+    Gaps count an image as present if either its full-size or its shrunk
+    copy is there. Sizes are checked on the shrunk copies, or, if the reel
+    hasn't been shrunk yet, on the full-size scans against the reel's median
+    only (the absolute bounds are for shrunk copies).
+
+    Takes:
+    - reel directory filepath
+    - optional absolute size bounds in bytes
+    Returns:
+    - dict summary row
+    - list of anomaly row dicts
+    - list of (image number, file name, size) for the images checked
+    '''
+
+    scan = scan_reel(path_to_dir)
+    full_numbers, full_sizes, full_names = scan['full']
+    smaller_numbers, smaller_sizes, smaller_names = scan['smaller']
+
+    no_gaps, missing = check_image_order(np.concatenate([full_numbers, smaller_numbers]))
+
+    checked_kind = 'smaller' if len(smaller_numbers) else 'full'
+    numbers, sizes, names = scan[checked_kind]
+    if checked_kind == 'full':
+        min_size, max_size = 0, np.inf
+    flags, median = find_abnormally_sized_files(sizes, min_size, max_size)
+
+    anomaly_list = [
+        {'path': path_to_dir, 'image_number': int(n), 'file_name': '', 'anomaly': 'missing', 'size': '', 'reel_median_size': median}
+        for n in missing
+    ]
+    for anomaly, flagged in flags.items():
+        for i in np.flatnonzero(flagged):
+            anomaly_list.append({
+                'path': path_to_dir,
+                'image_number': int(numbers[i]),
+                'file_name': names[i],
+                'anomaly': anomaly,
+                'size': int(sizes[i]),
+                'reel_median_size': median,
+            })
+    anomaly_list.sort(key=lambda row: (row['image_number'], row['anomaly']))
+
+    all_numbers = np.concatenate([full_numbers, smaller_numbers])
+    summary = {
+        'path': path_to_dir,
+        'num_images_in_directory': len(full_numbers) + len(smaller_numbers),
+        'num_smaller_images_in_directory': len(smaller_numbers),
+        'first_image_number': int(all_numbers.min()) if len(all_numbers) else '',
+        'last_image_number': int(all_numbers.max()) if len(all_numbers) else '',
+        'image_numbers_have_no_gaps': no_gaps,
+        'num_missing': len(missing),
+        'sizes_checked_on': checked_kind,
+        'median_size': median,
+        'num_suspiciously_small': int(flags['too_small'].sum()),
+        'num_suspiciously_large': int(flags['too_large'].sum()),
+        'num_small_for_reel': int(flags['small_for_reel'].sum()),
+        'num_large_for_reel': int(flags['large_for_reel'].sum()),
+    }
+
+    checked_list = [(int(n), name, int(size)) for n, name, size in zip(numbers, names, sizes)]
+
+    return summary, anomaly_list, checked_list
+
+
+def add_quality_checks(result_list, quality_workers=None):
+    '''
+    Decodes every checked image from diagnose_reel() results and adds what
+    the content checks find to their summaries and anomaly lists, in place.
+    All reels' images go through one process pool.
 
-            print("Problem getting file size of {i}".format(i=i))
+    Takes:
+    - list of diagnose_reel() results
+    - optional number of worker processes (default: one per CPU)
+    Returns: None
+    '''
+
+    path_list = [
+        os.path.join(summary['path'], name)
+        for summary, anomaly_list, checked_list in result_list
+        for number, name, size in checked_list
+    ]
+    quality_by_path = {result['path']: result for result in check_images(path_list, max_workers=quality_workers)}
+
+    for summary, anomaly_list, checked_list in result_list:
+
+        counts = dict.fromkeys(QUALITY_FLAGS + ['check_failed'], 0)
+
+        for number, name, size in checked_list:
+            result = quality_by_path[os.path.join(summary['path'], name)]
+            for anomaly in result['flags'] + (['check_failed'] if result['error'] else []):
+                counts[anomaly] += 1
+                anomaly_list.append({
+                    'path': summary['path'],
+                    'image_number': number,
+                    'file_name': name,
+                    'anomaly': anomaly,
+                    'size': size,
+                    'reel_median_size': summary['median_size'],
+                })
+
+        for anomaly, count in counts.items():
+            summary[f'num_{anomaly}'] = count
+        anomaly_list.sort(key=lambda row: (row['image_number'], row['anomaly']))
+
+
+def diagnose_reels(
+    dir_list,
+    workers=DEFAULT_WORKERS,
+    min_size=MIN_IMAGE_SIZE,
+    max_size=MAX_IMAGE_SIZE,
+    quality=False,
+    quality_workers=None
+):
+    '''
+    Runs diagnose_reel() over many reels in a pool of threads
+
+    Takes:
+    - list of reel directory filepaths
+    - optional number of reels to read at once
+    - optional absolute size bounds in bytes
+    - optional boolean, True to also run the image content checks
+    - optional number of processes for the content checks
+    Returns:
+    - DataFrame summary, one row per reel, in dir_list order
+    - DataFrame of anomalies, one row per missing or problem image
+    '''
 
-    return too_small, too_big
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        result_list = list(executor.map(lambda d: diagnose_reel(d, min_size, max_size), dir_list))
+
+    # decoding is CPU bound, so it gets processes rather than threads
+    if quality:
+        add_quality_checks(result_list, quality_workers)
+
+    summary = pd.DataFrame([summary for summary, anomaly_list, checked_list in result_list])
+    anomalies = pd.DataFrame(
+        [row for summary, anomaly_list, checked_list in result_list for row in anomaly_list],
+        columns=ANOMALY_COLUMNS
+    )
+
+    return summary, anomalies
+
+
+def get_anomaly_path(path_out):
+    '''
+    Default anomaly table path: the summary's, with _anomalies added
+    '''
+    stem, extension = os.path.splitext(path_out)
+    return stem + '_anomalies' + (extension or '.csv')
 
 
 if __name__ == '__main__':
@@ -85,54 +312,37 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Count images in reels and check for anomalies.')
     parser.add_argument( '-i', '--path-in', help='path down which to look', dest='path_in')
     parser.add_argument( '-o', '--path-out', help='path for output file', dest='path_out')
+    parser.add_argument( '-a', '--anomalies-out', help='path for per-image anomaly file (default: output file with _anomalies)', dest='anomalies_out')
+    parser.add_argument( '-w', '--workers', help=f'reels to read at once (default: {DEFAULT_WORKERS})', dest='workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument( '--min-size', help=f'smallest normal image in bytes (default: {MIN_IMAGE_SIZE})', dest='min_size', type=int, default=MIN_IMAGE_SIZE)
+    parser.add_argument( '--max-size', help=f'largest normal image in bytes (default: {MAX_IMAGE_SIZE})', dest='max_size', type=int, default=MAX_IMAGE_SIZE)
+    parser.add_argument( '-q', '--quality', help='also decode images to find truncated, corrupt, blank or black frames', dest='quality', action='store_true')
+    parser.add_argument( '--quality-workers', help='processes for the quality checks (default: one per CPU)', dest='quality_workers', type=int)
     args = parser.parse_args()
 
     path_in = args.path_in
     path_out = args.path_out
 
-    parent_dir_contents = os.listdir(path_in)
-    dir_list = [d for d in parent_dir_contents if os.path.isdir(path_in + d)]
-
     # what we want to know
     # - how many full size images there are
     # - how many smaller images there are
-    # - are images all in order or are there some missing?
-    # - are there any suspiciously small images?
-
-    output = {
-        'path': [],
-        'num_images_in_directory': [],
-        'num_smaller_images_in_directory': [],
-        'image_numbers_have_no_gaps': [],
-        'num_missing': [],
-        'num_suspiciously_small': [],
-        'num_suspiciously_large': [],
-        # 'missing_id': [],
-        # 'too_small_id': []
-    }
-
-    for d in dir_list:  
-
-        path_to_dir = path_in + d
-        all_images = sorted(glob.glob(path_to_dir + '/*.jpg'))
-        smaller_images = sorted(glob.glob(path_to_dir + "/*_smaller.jpg"))
-
-        any_missing, missing = check_image_order(smaller_images)
-
-        output['path'].append(path_to_dir)
-        output['num_images_in_directory'].append(len(all_images))
-        output['num_smaller_images_in_directory'].append(len(smaller_images))
-        output['image_numbers_have_no_gaps'].append(any_missing)
-        output['num_missing'].append(len(missing))
-
-        too_small, too_big = count_abnormally_sized_files(smaller_images)
-        output['num_suspiciously_small'].append(too_small)
-        output['num_suspiciously_large'].append(too_big)
-
-        # TODO
-        # output['missing_id'].append('')
-        # output['too_small_id'].append('')
-        
-    results = pd.DataFrame.from_dict(output)
+    # - are images all in order or are there some missing, and which?
+    # - are there any suspiciously small or large images, and which?
+    # - with -q: are any images damaged, blank or black, and which?
+
+    with os.scandir(path_in) as entry_list:
+        dir_list = sorted(entry.path for entry in entry_list if entry.is_dir())
+
+    results, anomalies = diagnose_reels(
+        dir_list,
+        args.workers,
+        args.min_size,
+        args.max_size,
+        quality=args.quality,
+        quality_workers=args.quality_workers
+    )
 
     results.to_csv(path_out, index=False)
+    anomalies.to_csv(args.anomalies_out or get_anomaly_path(path_out), index=False)
+
+    print(f"{len(results)} reels, {int(results['num_missing'].sum()) if len(results) else 0} missing images, {len(anomalies)} anomalies.")